@@ -0,0 +1,68 @@
+"""
+Compare deux fichiers de résultats de run.py (par exemple entre deux commits)
+
+    python benchmarks/compare.py AVANT.json APRÈS.json [--threshold 10]
+
+Affiche, pour chaque échelle et chaque étape communes, la durée et la
+mémoire de pointe avant et après ; les variations dépassant le seuil (%)
+sont signalées. Le code de sortie vaut 1 si une étape a ralenti ou
+consomme plus de mémoire au-delà du seuil.
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+METRICS = [('seconds', 's'), ('peak_rss_mb', 'MB')]
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Compare deux résultats de benchmarks')
+    parser.add_argument('before', type=Path)
+    parser.add_argument('after', type=Path)
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='Variation signalée (%%)')
+    return parser.parse_args()
+
+
+def _runs(path: Path) -> tuple:
+    results = json.loads(path.read_text())
+    label = f"{results.get('commit') or path.stem}{'+' if results.get('dirty') else ''}"
+    return label, {run['scale']: run['stages'] for run in results['runs']}
+
+
+def compare(before: Path, after: Path, threshold: float) -> bool:
+    """
+    Affiche la comparaison
+
+    Returns:
+        True si une mesure s'est dégradée au-delà de `threshold` %
+    """
+    label_before, runs_before = _runs(before)
+    label_after, runs_after = _runs(after)
+    regressed = False
+
+    print(f"{label_before} -> {label_after}")
+    for scale in [scale for scale in runs_after if scale in runs_before]:
+        print(f"\nScale {scale}")
+        print(f"  {'stage':<9}" + ''.join(f"{metric:>34}" for metric, _ in METRICS))
+        for name in [name for name in runs_after[scale] if name in runs_before[scale]]:
+            line = f"  {name:<9}"
+            for metric, unit in METRICS:
+                old, new = runs_before[scale][name][metric], runs_after[scale][name][metric]
+                change = (new - old) / old * 100 if old else 0.0
+                flag = ' '
+                if change > threshold:
+                    flag, regressed = '!', True
+                elif change < -threshold:
+                    flag = '*'
+                line += f"{old:>10.2f} {unit:<2} -> {new:>8.2f} {unit:<2} {change:+6.1f}%{flag}"
+            print(line)
+
+    return regressed
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    sys.exit(1 if compare(args.before, args.after, args.threshold) else 0)
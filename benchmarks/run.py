@@ -0,0 +1,210 @@
+"""
+Benchmarks du pipeline sur données synthétiques
+
+Génère une BPE et des contours IRIS synthétiques à l'échelle demandée
+(voir synthetic.py), les sert par un serveur HTTP local (voir server.py)
+et exécute chaque étape dans un processus neuf (voir stage.py). Pour
+chaque étape sont mesurés : durée, mémoire résidente de pointe, taille
+des sorties, lignes par seconde et volume transféré depuis le serveur.
+
+    python benchmarks/run.py --scale departement region
+    python benchmarks/run.py --scale 4 --size 0.25 --stages bpe iris geo
+    python benchmarks/compare.py benchmarks/results/<avant>.json benchmarks/results/<après>.json
+
+Les données générées sont conservées dans benchmarks/.data (réutilisées
+tant que les paramètres ne changent pas) ; les résultats sont écrits dans
+benchmarks/results/<date>-<commit>.json.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import synthetic
+from server import StandInServer
+from stage import requirements
+
+logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+logging.getLogger('pyogrio').setLevel(logging.WARNING)
+logger = logging.getLogger('benchmarks')
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = BENCHMARKS_DIR.parent
+DATA_DIR = BENCHMARKS_DIR / '.data'
+RESULTS_DIR = BENCHMARKS_DIR / 'results'
+
+STAGES = ['bpe', 'iris', 'geo', 'simplify', 'join', 'access', 'load', 'map']
+
+BPE_NAME = 'BPE.parquet'
+IRIS_NAME = 'CONTOURS-IRIS.7z'
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmarks du pipeline sur données synthétiques')
+    parser.add_argument('--scale', nargs='+', default=['departement'],
+                        help=f"Échelles : {', '.join(synthetic.SCALES)} ou nombre de départements")
+    parser.add_argument('--size', type=float, default=1.0,
+                        help='Facteur appliqué aux volumes par département (BPE et IRIS)')
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES,
+                        help='Étapes mesurées (dans l\'ordre du pipeline)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Nombre de passes (médiane retenue)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Latence simulée par requête HTTP (ms)')
+    parser.add_argument('--no-ranges', action='store_true',
+                        help='Serveur sans requêtes Range (téléchargement complet)')
+    parser.add_argument('--drops', type=int, default=0,
+                        help='Réponses HTTP coupées en cours de transfert, par passe')
+    parser.add_argument('--output', type=Path, default=None,
+                        help='Fichier JSON des résultats')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Afficher les journaux des étapes')
+    return parser.parse_args()
+
+
+def git_revision() -> dict:
+    """Commit courant et présence de modifications non validées"""
+    def git(*args):
+        return subprocess.run(['git', *args], cwd=PROJECT_ROOT, capture_output=True,
+                              text=True).stdout.strip()
+    return {'commit': git('rev-parse', '--short', 'HEAD') or None,
+            'dirty': bool(git('status', '--porcelain', '--untracked-files=no'))}
+
+
+def source_data(departements: list, size: float) -> tuple:
+    """
+    Sources synthétiques d'une échelle, générées au premier appel
+
+    Returns:
+        (dossier servi, informations sur les sources)
+    """
+    bpe_rows = max(1, int(synthetic.BPE_ROWS_PER_DEPARTEMENT * size))
+    iris_count = max(1, int(synthetic.IRIS_PER_DEPARTEMENT * size))
+    source_dir = DATA_DIR / f"{len(departements)}dep-x{size:g}"
+    info_path = source_dir / 'sources.json'
+
+    if info_path.exists():
+        return source_dir, json.loads(info_path.read_text())
+
+    source_dir.mkdir(parents=True, exist_ok=True)
+    start = time.perf_counter()
+    info = {
+        'departements': departements,
+        'bpe_rows': synthetic.write_bpe(source_dir / BPE_NAME, departements, bpe_rows, iris_count),
+        'iris': synthetic.write_iris_archive(source_dir / IRIS_NAME, departements, iris_count),
+    }
+    info['bpe_mb'] = (source_dir / BPE_NAME).stat().st_size / 1024 ** 2
+    info['iris_mb'] = (source_dir / IRIS_NAME).stat().st_size / 1024 ** 2
+    info_path.write_text(json.dumps(info))
+    logger.info(f"Synthetic sources generated in {time.perf_counter() - start:.1f}s: "
+                f"{info['bpe_rows']:,} equipments, {info['iris']:,} IRIS ({source_dir})")
+    return source_dir, info
+
+
+def run_stage(name: str, env: dict, workdir: Path, verbose: bool) -> dict:
+    """Exécute une étape dans un nouveau processus et retourne ses mesures"""
+    result_path = workdir / f"{name}.json"
+    completed = subprocess.run(
+        [sys.executable, str(BENCHMARKS_DIR / 'stage.py'), name, str(result_path)],
+        cwd=workdir, env=env, capture_output=not verbose, text=True)
+    if completed.returncode != 0:
+        if not verbose:
+            sys.stderr.write(completed.stderr)
+        raise RuntimeError(f"Stage {name!r} failed (exit code {completed.returncode})")
+    return json.loads(result_path.read_text())
+
+
+def run_pass(stages: list, departements: list, server: StandInServer, verbose: bool) -> dict:
+    """
+    Une passe dans un dossier de données vide (cache froid)
+
+    Les étapes dont dépendent `stages` sont exécutées aussi, sans être
+    mesurées.
+    """
+    with tempfile.TemporaryDirectory(prefix='mobitic-bench-') as temp_dir:
+        workdir = Path(temp_dir)
+        env = {
+            **os.environ,
+            'MOBITIC_DATA_DIR': str(workdir / 'data'),
+            'MOBITIC_BPE_URL': f"{server.url}/{BPE_NAME}",
+            'MOBITIC_IRIS_URL': f"{server.url}/{IRIS_NAME}",
+            'MOBITIC_DEPARTEMENTS': ','.join(departements),
+        }
+
+        measures = {}
+        for name in requirements(stages):
+            requests_before, sent_before = server.counters()
+            measure = run_stage(name, env, workdir, verbose)
+            requests_after, sent_after = server.counters()
+            if name in stages:
+                measure['http_requests'] = requests_after - requests_before
+                measure['transferred_mb'] = (sent_after - sent_before) / 1024 ** 2
+                measures[name] = measure
+        return measures
+
+
+def summarize(passes: list) -> dict:
+    """Médiane de chaque mesure sur les passes, débit en lignes par seconde"""
+    summary = {}
+    for name in passes[0]:
+        values = {key: statistics.median_low(p[name][key] for p in passes)
+                  for key in passes[0][name] if passes[0][name][key] is not None}
+        rows = passes[0][name].get('rows')
+        values['rows'] = rows
+        values['rows_per_s'] = rows / values['seconds'] if rows and values['seconds'] else None
+        summary[name] = {key: round(value, 3) if isinstance(value, float) else value
+                         for key, value in values.items()}
+    return summary
+
+
+def main():
+    args = parse_arguments()
+    stages = [name for name in STAGES if name in args.stages]
+
+    results = {
+        **git_revision(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'size': args.size,
+        'latency_ms': args.latency,
+        'ranges': not args.no_ranges,
+        'drops': args.drops,
+        'runs': [],
+    }
+
+    for scale in args.scale:
+        departements = synthetic.scale_departements(scale)
+        source_dir, sources = source_data(departements, args.size)
+
+        with StandInServer(source_dir, ranges=not args.no_ranges, latency=args.latency / 1000) as server:
+            passes = []
+            for i in range(args.repeat):
+                server.stats['drops'] = args.drops
+                logger.info(f"Scale {scale!r} ({len(departements)} departements), pass {i + 1}/{args.repeat}")
+                passes.append(run_pass(stages, departements, server, args.verbose))
+
+        stages_summary = summarize(passes)
+        results['runs'].append({'scale': scale, 'sources': sources, 'stages': stages_summary})
+        for name, measure in stages_summary.items():
+            logger.info(f"  {name:<9} {measure['seconds']:8.2f}s  {measure['peak_rss_mb']:8.0f} MB peak  "
+                        f"{measure['output_mb']:8.1f} MB out  "
+                        f"{measure['rows_per_s'] or 0:12,.0f} rows/s")
+
+    output = args.output or RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}-{results['commit'] or 'nogit'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, ensure_ascii=False, indent=2))
+    logger.info(f"Results saved: {output}")
+
+
+if __name__ == '__main__':
+    main()
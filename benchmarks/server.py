@@ -0,0 +1,158 @@
+"""
+Serveur HTTP local tenant lieu des serveurs INSEE et IGN
+
+Sert un dossier en gérant ce dont dépendent les téléchargements du
+pipeline : requêtes HEAD, Range (lecture distante de la BPE,
+téléchargements par segments), If-Range, ETag et Last-Modified
+(revalidation du cache). Une latence par requête, des coupures de
+connexion en cours de réponse et le refus des requêtes HEAD peuvent être
+simulés, le débit de chaque réponse peut être limité, et les octets
+envoyés sont comptés.
+"""
+
+import email.utils
+import functools
+import http.server
+import os
+import re
+import threading
+import time
+
+_RANGE = re.compile(r'bytes=(\d*)-(\d*)$')
+
+
+class StandInHandler(http.server.SimpleHTTPRequestHandler):
+    """Fichiers statiques avec Range, If-Range, ETag et Last-Modified"""
+
+    ranges = True
+    head = True
+    latency = 0.0
+    rate = None
+    stats = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        if not self.head:
+            self.send_error(405)
+            return
+        super().do_HEAD()
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            return super().send_head()
+
+        if self.latency:
+            time.sleep(self.latency)
+        with self.stats['lock']:
+            self.stats['requests'] += 1
+
+        stat = os.stat(path)
+        size = stat.st_size
+        etag = f'"{int(stat.st_mtime):x}-{size:x}"'
+        last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return None
+
+        start, end = 0, size - 1
+        match = _RANGE.match(self.headers.get('Range', '')) if self.ranges else None
+        if self.headers.get('If-Range') not in (None, etag, last_modified):
+            match = None   # Version différente : contenu complet
+        if match and any(match.groups()):
+            first, last = match.groups()
+            if first:
+                start, end = int(first), min(int(last), size - 1) if last else size - 1
+            else:
+                start = max(0, size - int(last))
+            if start > end:
+                self.send_error(416)
+                return None
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        if self.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+        f = open(path, 'rb')
+        f.seek(start)
+        self._remaining = end - start + 1
+        return f
+
+    def copyfile(self, source, outputfile):
+        remaining = self._remaining
+        with self.stats['lock']:
+            drop = self.stats['drops'] > 0 and remaining > 1
+            if drop:
+                self.stats['drops'] -= 1
+        if drop:
+            # Coupure simulée : la moitié du corps, puis fermeture de la connexion
+            remaining //= 2
+            self.close_connection = True
+        # Débit limité : petits envois espacés
+        block = 1024 * 1024 if not self.rate else max(1, self.rate // 20)
+        while remaining > 0:
+            if self.rate:
+                time.sleep(block / self.rate)
+            chunk = source.read(min(block, remaining))
+            if not chunk:
+                break
+            try:
+                outputfile.write(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                return   # Client parti (réponse abandonnée après les en-têtes)
+            remaining -= len(chunk)
+            with self.stats['lock']:
+                self.stats['bytes_sent'] += len(chunk)
+
+
+class StandInServer:
+    """
+    Serveur local en arrière-plan (gestionnaire de contexte)
+
+    Args:
+        directory: Dossier servi
+        ranges: Gérer les requêtes Range (sinon réponses 200 complètes)
+        latency: Délai ajouté à chaque requête (s)
+        drops: Nombre de réponses coupées à la moitié de leur corps
+        head: Accepter les requêtes HEAD (sinon 405)
+        rate: Débit maximal de chaque réponse (octets/s, None = illimité)
+    """
+
+    def __init__(self, directory, ranges: bool = True, latency: float = 0.0, drops: int = 0,
+                 head: bool = True, rate: int = None):
+        self.stats = {'lock': threading.Lock(), 'requests': 0, 'bytes_sent': 0, 'drops': drops}
+        handler = type('Handler', (StandInHandler,),
+                       {'ranges': ranges, 'head': head, 'latency': latency, 'rate': rate,
+                        'stats': self.stats})
+        self._server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', 0), functools.partial(handler, directory=str(directory)))
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def counters(self) -> tuple:
+        """(requêtes, octets envoyés) depuis le démarrage"""
+        with self.stats['lock']:
+            return self.stats['requests'], self.stats['bytes_sent']
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
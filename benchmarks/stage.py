@@ -0,0 +1,139 @@
+"""
+Exécute une étape du pipeline et écrit ses mesures en JSON
+
+Lancé par run.py dans un processus neuf par étape (mémoire de pointe
+propre à l'étape), avec les variables MOBITIC_* pointant vers les données
+synthétiques :
+
+    python benchmarks/stage.py <étape> <résultat.json>
+
+Étapes : celles de main.build_pipeline, plus 'load' (iris_loader et
+bpe_loader).
+"""
+
+import json
+import resource
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+import pyarrow.parquet as pq  # noqa: E402
+
+from main import build_pipeline  # noqa: E402
+from utils.data_manager import iris_loader, bpe_loader, memory_report, clear_cache  # noqa: E402
+
+# Étapes préalables au chargement des tables ('load')
+LOAD_DEPS = ['iris', 'geo']
+
+
+def requirements(names: list) -> list:
+    """Étapes `names` et celles dont elles dépendent, dans l'ordre d'exécution"""
+    stages = build_pipeline().stages
+    ordered = []
+
+    def visit(name):
+        if name in ordered:
+            return
+        for dep in LOAD_DEPS if name == 'load' else stages[name].deps:
+            visit(dep)
+        ordered.append(name)
+
+    for name in names:
+        visit(name)
+    return ordered
+
+
+def peak_rss_mb() -> float:
+    """Mémoire résidente de pointe du processus (Mo)"""
+    # Sous Linux, ru_maxrss conserve le maximum du processus parent
+    # d'avant exec : VmHWM ne compte que ce processus
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Octets sous macOS, kilo-octets sous Linux
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def _size(path: Path) -> int:
+    if path.is_dir():
+        return sum(f.stat().st_size for f in path.rglob('*') if f.is_file())
+    return path.stat().st_size if path.exists() else 0
+
+
+def _rows(paths: list) -> int:
+    """
+    Lignes de la plus grande table parquet de `paths` (métadonnées seules),
+    les partitions d'un même jeu (.../dep=XX/part-0.parquet) étant sommées
+    """
+    counts = {}
+    for path in paths:
+        if path.suffix == '.parquet' and path.exists():
+            table = path.parent.parent if path.parent.name.startswith('dep=') else path
+            counts[table] = counts.get(table, 0) + pq.ParquetFile(path).metadata.num_rows
+    return max(counts.values(), default=None)
+
+
+def run_loaders() -> dict:
+    """
+    Chargement à froid (parquet, cache vidé), puis depuis les instantanés
+    Arrow IPC écrits au passage (snapshot_seconds, cache mémoire vidé)
+    """
+    clear_cache()
+    start = time.perf_counter()
+    iris_gdf, bpe_gdf = iris_loader(), bpe_loader()
+    seconds = time.perf_counter() - start
+
+    clear_cache(snapshots=False)
+    start = time.perf_counter()
+    iris_loader(), bpe_loader()
+    return {
+        'seconds': seconds,
+        'snapshot_seconds': time.perf_counter() - start,
+        'rows': len(iris_gdf) + len(bpe_gdf),
+        'output_mb': float(memory_report(iris_gdf).loc['total', 'MB'] + memory_report(bpe_gdf).loc['total', 'MB']),
+    }
+
+
+def run_stage(name: str) -> dict:
+    """
+    Exécute l'étape `name` (forcée) et mesure sa durée
+
+    Returns:
+        seconds, rows (lignes de la plus grande table produite, ou lue
+        pour une sortie non tabulaire), output_mb (taille des sorties, ou
+        des tables chargées pour 'load', ainsi que snapshot_seconds)
+    """
+    if name == 'load':
+        return run_loaders()
+
+    stage = build_pipeline().stages[name]
+    start = time.perf_counter()
+    if stage.forceable:
+        stage.func(force=True)
+    else:
+        stage.func()
+    seconds = time.perf_counter() - start
+
+    rows = _rows(stage.outputs)
+    if rows is None:
+        rows = _rows(stage.inputs)
+    return {
+        'seconds': seconds,
+        'rows': rows,
+        'output_mb': sum(_size(path) for path in stage.outputs) / 1024 ** 2,
+    }
+
+
+if __name__ == '__main__':
+    name, result_path = sys.argv[1], Path(sys.argv[2])
+    baseline = peak_rss_mb()
+    result = run_stage(name)
+    result.update(baseline_rss_mb=baseline, peak_rss_mb=peak_rss_mb())
+    result_path.write_text(json.dumps(result))
@@ -0,0 +1,218 @@
+"""
+Données synthétiques au format des sources INSEE et IGN
+
+- BPE : fichier parquet national trié par département, en groupes de
+  lignes, avec les colonnes de la BPE (codes, coordonnées Lambert 93,
+  libellés) ;
+- IRIS : archive 7z de shapefiles (France métropolitaine + un petit
+  shapefile DOM, documentation), champs de CONTOURS-IRIS 2.1.
+
+Chaque département occupe un carré de DEPARTEMENT_SIZE mètres dans
+l'emprise de la métropole, découpé en IRIS carrés déformés (contours
+riches en sommets, frontières communes identiques entre voisins). Les
+équipements sont répartis en grappes, dont une part partage exactement
+les mêmes coordonnées.
+"""
+
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import py7zr
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from config import CRS_LAMBERT93  # noqa: E402
+from config.categories import get_all_codes  # noqa: E402
+
+# Départements de métropole, dans l'ordre utilisé par les échelles numériques
+DEPARTEMENTS = ['69', '01', '42', '38', '73', '74', '03', '07', '15', '26', '43', '63'] + [
+    dep for dep in [f"{i:02d}" for i in range(2, 96) if i != 20] + ['2A', '2B']
+    if dep not in ('01', '03', '07', '15', '26', '38', '42', '43', '63', '69', '73', '74')
+]
+
+# Échelles nommées : un département, une région, la France métropolitaine
+SCALES = {
+    'departement': DEPARTEMENTS[:1],
+    'region': DEPARTEMENTS[:12],
+    'france': DEPARTEMENTS,
+}
+
+# Volumes par département, proches de la moyenne nationale
+BPE_ROWS_PER_DEPARTEMENT = 27000
+IRIS_PER_DEPARTEMENT = 500
+IRIS_VERTICES = 120             # Sommets par contour IRIS (environ)
+DEPARTEMENT_SIZE = 90000        # Côté du carré d'un département (m)
+COLOCATED_SHARE = 0.3           # Part des équipements partageant un emplacement
+BPE_ROW_GROUP_SIZE = 100000
+
+# Origine de la grille des départements (Lambert 93)
+ORIGIN = (150000, 6150000)
+GRID_COLUMNS = 10
+
+
+def scale_departements(scale: str) -> list:
+    """Départements d'une échelle : nom de SCALES ou nombre de départements"""
+    if scale in SCALES:
+        return SCALES[scale]
+    n = int(scale)
+    if not 1 <= n <= len(DEPARTEMENTS):
+        raise ValueError(f"Scale must be 1-{len(DEPARTEMENTS)} departements or one of {list(SCALES)}")
+    return DEPARTEMENTS[:n]
+
+
+def _departement_origin(dep: str) -> tuple:
+    """Coin sud-ouest du carré d'un département"""
+    k = DEPARTEMENTS.index(dep)
+    return (ORIGIN[0] + (k % GRID_COLUMNS) * DEPARTEMENT_SIZE,
+            ORIGIN[1] + (k // GRID_COLUMNS) * DEPARTEMENT_SIZE)
+
+
+def _iris_side(iris_per_departement: int) -> int:
+    return max(1, int(round(np.sqrt(iris_per_departement))))
+
+
+def _warp(coords: np.ndarray) -> np.ndarray:
+    """Déformation continue du plan : les frontières partagées restent identiques"""
+    x, y = coords[:, 0], coords[:, 1]
+    return np.column_stack([x + 120 * np.sin(y / 700) + 25 * np.sin((x + y) / 90),
+                            y + 120 * np.sin(x / 800) + 25 * np.cos((x - y) / 110)])
+
+
+def iris_frame(departements: list, iris_per_departement: int = IRIS_PER_DEPARTEMENT,
+               vertices: int = IRIS_VERTICES) -> gpd.GeoDataFrame:
+    """
+    Contours IRIS synthétiques (Lambert 93)
+
+    Un IRIS sur quatre (bloc de 2 x 2) forme une commune.
+    """
+    n = _iris_side(iris_per_departement)
+    cell = DEPARTEMENT_SIZE / n
+    i, j = (values.ravel() for values in np.meshgrid(np.arange(n), np.arange(n), indexing='ij'))
+    commune = (i // 2) * ((n + 1) // 2) + j // 2
+
+    frames = []
+    for dep in departements:
+        x0, y0 = _departement_origin(dep)
+        boxes = shapely.box(x0 + i * cell, y0 + j * cell, x0 + (i + 1) * cell, y0 + (j + 1) * cell)
+        boxes = shapely.transform(shapely.segmentize(boxes, 4 * cell / vertices), _warp)
+        insee_com = [f"{dep}{c % 1000:03d}" for c in commune]
+        code_iris = [f"{com}{k:04d}" for com, k in zip(insee_com, i * n + j)]
+        frames.append(pd.DataFrame({
+            'insee_com': insee_com,
+            'nom_com': [f"Commune {com}" for com in insee_com],
+            'iris': [code[5:] for code in code_iris],
+            'code_iris': code_iris,
+            'nom_iris': [f"Quartier {code[5:]}" for code in code_iris],
+            'typ_iris': 'H',
+            'geometry': boxes,
+        }))
+
+    return gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), crs=CRS_LAMBERT93)
+
+
+def bpe_frame(departements: list, rows_per_departement: int = BPE_ROWS_PER_DEPARTEMENT,
+              iris_per_departement: int = IRIS_PER_DEPARTEMENT, seed: int = 0) -> pd.DataFrame:
+    """BPE synthétique, triée par département"""
+    rng = np.random.default_rng(seed)
+    codes = np.array(sorted(get_all_codes())
+                     + ['D201', 'D221', 'D232', 'A101', 'A203', 'E107'])
+    n = _iris_side(iris_per_departement)
+    cell = DEPARTEMENT_SIZE / n
+
+    frames = []
+    for dep in departements:
+        x0, y0 = _departement_origin(dep)
+        rows = rows_per_departement
+
+        # Grappes autour de centres (bourgs), puis emplacements partagés
+        centers = rng.uniform(0, DEPARTEMENT_SIZE, (max(1, rows // 400), 2))
+        xy = centers[rng.integers(0, len(centers), rows)] + rng.normal(0, 1500, (rows, 2))
+        xy = np.clip(xy, 1, DEPARTEMENT_SIZE - 1)
+        shared = rng.random(rows) < COLOCATED_SHARE
+        xy[shared] = xy[rng.integers(0, rows, shared.sum())]
+        x, y = np.round(x0 + xy[:, 0], 1), np.round(y0 + xy[:, 1], 1)
+
+        i = np.minimum((xy[:, 0] // cell).astype(int), n - 1)
+        j = np.minimum((xy[:, 1] // cell).astype(int), n - 1)
+        depcom = np.char.add(dep, np.char.zfill(((i // 2) * ((n + 1) // 2) + j // 2).astype(str), 3))
+        typequ = rng.choice(codes, rows)
+
+        frame = pd.DataFrame({
+            'AN': '2024',
+            'NOMRS': np.char.add('ETABLISSEMENT ', rng.integers(0, 10 ** 6, rows).astype(str)),
+            'CNOMRS': None,
+            'NUMVOIE': rng.integers(1, 200, rows).astype(str),
+            'TYPVOIE': rng.choice(['RUE', 'AV', 'BD', 'PL', 'CHE'], rows),
+            'LIBVOIE': rng.choice(['DE LA REPUBLIQUE', 'VICTOR HUGO', 'DES ECOLES', 'DU MOULIN'], rows),
+            'CODPOS': np.char.add(dep, '000'),
+            'DEPCOM': depcom,
+            'DEP': dep,
+            'DCIRIS': np.char.add(depcom, np.char.zfill((i * n + j).astype(str), 4)),
+            'EPCI': np.char.add(f"200{DEPARTEMENTS.index(dep):03d}", np.char.zfill((i * 10 // n).astype(str), 3)),
+            'DOM': np.array([code[0] for code in typequ]),
+            'SDOM': np.array([code[:2] for code in typequ]),
+            'TYPEQU': typequ,
+            'LAMBERT_X': x,
+            'LAMBERT_Y': y,
+            'QUALITE_XY': rng.choice(['Bonne', 'Acceptable', 'Mauvaise'], rows, p=[0.9, 0.08, 0.02]),
+        })
+        # Équipements non géolocalisés
+        frame.loc[rng.random(rows) < 0.01, ['LAMBERT_X', 'LAMBERT_Y']] = np.nan
+        frames.append(frame)
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def write_bpe(path: Path, departements: list, rows_per_departement: int = BPE_ROWS_PER_DEPARTEMENT,
+              iris_per_departement: int = IRIS_PER_DEPARTEMENT) -> int:
+    """
+    Écrit la BPE synthétique en parquet (groupes de BPE_ROW_GROUP_SIZE lignes)
+
+    Returns:
+        Nombre de lignes
+    """
+    bpe_df = bpe_frame(departements, rows_per_departement, iris_per_departement)
+    pq.write_table(pa.Table.from_pandas(bpe_df, preserve_index=False), path,
+                   row_group_size=BPE_ROW_GROUP_SIZE, compression='snappy')
+    return len(bpe_df)
+
+
+def write_iris_archive(path: Path, departements: list, iris_per_departement: int = IRIS_PER_DEPARTEMENT,
+                       vertices: int = IRIS_VERTICES) -> int:
+    """
+    Écrit les contours IRIS synthétiques en archive 7z, avec l'arborescence
+    de la livraison IGN
+
+    Returns:
+        Nombre d'IRIS
+    """
+    iris_gdf = iris_frame(departements, iris_per_departement, vertices)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir) / 'CONTOURS-IRIS'
+        delivery = root / '1_DONNEES_LIVRAISON_2021-06-00217'
+        metropole = delivery / 'CONTOURS-IRIS_2-1_SHP_LAMB93_FXX-2020'
+        dom = delivery / 'CONTOURS-IRIS_2-1_SHP_RGAF09UTM20_GLP-2020'
+        metropole.mkdir(parents=True)
+        dom.mkdir()
+
+        iris_gdf.to_file(metropole / 'CONTOURS-IRIS.shp', engine='pyogrio')
+        iris_gdf.head(20).to_file(dom / 'CONTOURS-IRIS.shp', engine='pyogrio')
+        (root / '2_METADONNEES_LIVRAISON_2021-06-00217').mkdir()
+        (root / '2_METADONNEES_LIVRAISON_2021-06-00217' / 'IGNF_CONTOURS-IRIS_2-1.xml').write_text(
+            '<metadata/>' * 5000)
+
+        tmp = Path(path).with_suffix('.tmp')
+        with py7zr.SevenZipFile(tmp, 'w') as archive:
+            archive.writeall(root, 'CONTOURS-IRIS')
+        shutil.move(tmp, path)
+
+    return len(iris_gdf)
@@ -7,32 +7,100 @@ from .settings import (
     PROJECT_ROOT,
     DATA_DIR,
     OUTPUT_DIR,
+    CACHE_DIR,
+    TILES_DIR,
+    DENSITY_DIR,
+    BUNDLE_DIR,
+    PROFILE_DIR,
+    SNAPSHOT_DIR,
+    NATIONAL_DIR,
+    PARTITIONS_DIR,
+    REGIONS_DIR,
+    OFFLINE_ASSETS_DIR,
+    BUNDLE_BASEMAP,
     OUTPUT_FILE,
     OUTPUT_PATH,
     BPE_PATH,
     IRIS_PATH,
     BPE_GEO_PATH,
+    IRIS_LEVELS_PATH,
+    BPE_IRIS_PATH,
+    IRIS_COUNTS_PATH,
+    ACCESS_IRIS_PATH,
+    ACCESS_GRID_PATH,
+    IRIS_GEOJSON_PATH,
+    BPE_GEOJSON_PATH,
+    BPE_NATIONAL_PATH,
+    IRIS_NATIONAL_PATH,
+    REGIONS_INDEX_PATH,
     
     # Zone géographique
     DEPARTEMENTS,
     MAP_ZOOM,
+    REGIONS,
     
     # URLs
     BPE_URL,
     IRIS_URL,
+    BPE_REMOTE_READ,
+    BPE_COLUMNS,
     
     # Paramètres
+    MAP_RENDER_MODE,
+    CLUSTER_THRESHOLD,
+    CLUSTER_MIN_ZOOM,
+    CLUSTER_MAX_ZOOM,
+    CLUSTER_RADIUS,
+    IRIS_LEVELS,
+    CHOROPLETH_COLUMN,
+    ACCESS_GRID_SIZE,
+    ACCESS_WORKERS,
+    ACCESS_MAP_CATEGORY,
+    MARKER_GROUPING,
+    MARKER_GROUPING_DECIMALS,
     MAX_MARKERS,
+    TILE_MIN_ZOOM,
+    TILE_MAX_ZOOM,
+    BPE_TILE_MIN_ZOOM,
+    DENSITY_LAYERS,
+    DENSITY_ZOOM,
+    DENSITY_MAX_PIXELS,
+    DENSITY_MIN_ZOOM,
+    DENSITY_MAX_ZOOM,
+    DENSITY_SMOOTHING,
+    DENSITY_OPACITY,
+    TILE_WORKERS,
+    BATCH_WORKERS,
+    GEO_BATCH_ROWS,
+    GEO_WORKERS,
+    SERVER_HOST,
+    SERVER_PORT,
+    SERVER_CACHE_SIZE,
+    LOADER_CACHE_SIZE,
+    LOADER_SNAPSHOTS,
+    LOADER_SNAPSHOT_MAX_BYTES,
+    TRACE_SAMPLE_INTERVAL,
     CHUNK_SIZE,
+    DOWNLOAD_MAX_CHUNK_SIZE,
+    DOWNLOAD_CONNECTIONS,
+    DOWNLOAD_SEGMENT_SIZE,
+    DOWNLOAD_RETRIES,
+    DOWNLOAD_RETRY_DELAY,
     REQUEST_TIMEOUT,
+    CACHE_MAX_BYTES,
+    RANGE_BLOCK_SIZE,
     CRS_LAMBERT93,
     CRS_WGS84,
 )
 
 from .categories import (
     CATEGORIES,
+    CATEGORY_NAMES,
+    OTHER_CATEGORY,
     get_category,
+    categorize,
     get_all_codes,
+    get_code_families,
 )
 
 __all__ = [
@@ -40,29 +108,97 @@ __all__ = [
     'PROJECT_ROOT',
     'DATA_DIR',
     'OUTPUT_DIR',
+    'CACHE_DIR',
+    'TILES_DIR',
+    'DENSITY_DIR',
+    'BUNDLE_DIR',
+    'PROFILE_DIR',
+    'SNAPSHOT_DIR',
+    'NATIONAL_DIR',
+    'PARTITIONS_DIR',
+    'REGIONS_DIR',
+    'OFFLINE_ASSETS_DIR',
+    'BUNDLE_BASEMAP',
     'OUTPUT_FILE',
     'OUTPUT_PATH',
     'BPE_PATH',
     'IRIS_PATH',
     'BPE_GEO_PATH',
+    'IRIS_LEVELS_PATH',
+    'BPE_IRIS_PATH',
+    'IRIS_COUNTS_PATH',
+    'ACCESS_IRIS_PATH',
+    'ACCESS_GRID_PATH',
+    'IRIS_GEOJSON_PATH',
+    'BPE_GEOJSON_PATH',
+    'BPE_NATIONAL_PATH',
+    'IRIS_NATIONAL_PATH',
+    'REGIONS_INDEX_PATH',
     
     # Zone géographique
     'DEPARTEMENTS',
     'MAP_ZOOM',
+    'REGIONS',
     
     # URLs
     'BPE_URL',
     'IRIS_URL',
+    'BPE_REMOTE_READ',
+    'BPE_COLUMNS',
     
     # Paramètres
+    'MAP_RENDER_MODE',
+    'CLUSTER_THRESHOLD',
+    'CLUSTER_MIN_ZOOM',
+    'CLUSTER_MAX_ZOOM',
+    'CLUSTER_RADIUS',
+    'IRIS_LEVELS',
+    'CHOROPLETH_COLUMN',
+    'ACCESS_GRID_SIZE',
+    'ACCESS_WORKERS',
+    'ACCESS_MAP_CATEGORY',
+    'MARKER_GROUPING',
+    'MARKER_GROUPING_DECIMALS',
     'MAX_MARKERS',
+    'TILE_MIN_ZOOM',
+    'TILE_MAX_ZOOM',
+    'BPE_TILE_MIN_ZOOM',
+    'DENSITY_LAYERS',
+    'DENSITY_ZOOM',
+    'DENSITY_MAX_PIXELS',
+    'DENSITY_MIN_ZOOM',
+    'DENSITY_MAX_ZOOM',
+    'DENSITY_SMOOTHING',
+    'DENSITY_OPACITY',
+    'TILE_WORKERS',
+    'BATCH_WORKERS',
+    'GEO_BATCH_ROWS',
+    'GEO_WORKERS',
+    'SERVER_HOST',
+    'SERVER_PORT',
+    'SERVER_CACHE_SIZE',
+    'LOADER_CACHE_SIZE',
+    'LOADER_SNAPSHOTS',
+    'LOADER_SNAPSHOT_MAX_BYTES',
+    'TRACE_SAMPLE_INTERVAL',
     'CHUNK_SIZE',
+    'DOWNLOAD_MAX_CHUNK_SIZE',
+    'DOWNLOAD_CONNECTIONS',
+    'DOWNLOAD_SEGMENT_SIZE',
+    'DOWNLOAD_RETRIES',
+    'DOWNLOAD_RETRY_DELAY',
     'REQUEST_TIMEOUT',
+    'CACHE_MAX_BYTES',
+    'RANGE_BLOCK_SIZE',
     'CRS_LAMBERT93',
     'CRS_WGS84',
     
     # Catégories
     'CATEGORIES',
+    'CATEGORY_NAMES',
+    'OTHER_CATEGORY',
     'get_category',
+    'categorize',
     'get_all_codes',
+    'get_code_families',
 ]
\ No newline at end of file
@@ -1,16 +1,18 @@
 """
 Configuration des catégories d'équipements BPE
+
+Les codes sont soit exacts ('D101'), soit des familles terminées par '*'
+('D2*' : tous les codes commençant par 'D2'). Un code exact l'emporte sur
+une famille, et la famille la plus spécifique sur la plus générale.
 """
 
+import pandas as pd
+
 CATEGORIES = {
     'Santé': {
         'codes': [
             # Professionnels de santé libéraux (D2)
-            'D265', 'D266', 'D267', 'D268', 'D269', 'D270', 'D271', 'D272', 
-            'D273', 'D274', 'D275', 'D276', 'D277', 'D278', 'D279', 'D280', 
-            'D281', 'D245', 'D247', 'D248', 'D249', 'D250', 'D251', 'D252',
-            'D253', 'D254', 'D255', 'D256', 'D257', 'D258', 'D259', 'D260',
-            'D261', 'D262',
+            'D2*',
             # Établissements de santé (D1)
             'D101', 'D102', 'D103', 'D104', 'D105', 'D106', 'D107', 'D108',
             'D109', 'D110', 'D111', 'D112', 'D113', 'D114', 'D115',
@@ -123,6 +125,34 @@ CATEGORIES = {
 }
 
 
+OTHER_CATEGORY = 'Autres'
+
+# Ordre des catégories (catégorie 'Autres' en dernier)
+CATEGORY_NAMES = list(CATEGORIES) + [OTHER_CATEGORY]
+
+
+def _compile_registry() -> tuple:
+    """
+    Construit une seule fois l'index inverse code -> catégorie et la liste
+    des règles de famille, triées de la plus spécifique à la plus générale
+    """
+    code_index = {}
+    prefix_rules = []
+    for cat_name, cat_info in CATEGORIES.items():
+        for code in cat_info['codes']:
+            if code.endswith('*'):
+                prefix_rules.append((code[:-1], cat_name))
+            else:
+                # En cas de doublon, la première catégorie déclarée l'emporte
+                code_index.setdefault(code, cat_name)
+
+    prefix_rules.sort(key=lambda rule: len(rule[0]), reverse=True)
+    return code_index, tuple(prefix_rules)
+
+
+_CODE_INDEX, _PREFIX_RULES = _compile_registry()
+
+
 def get_category(typequ: str) -> str:
     """
     Retourne la catégorie d'un type d'équipement
@@ -133,15 +163,54 @@ def get_category(typequ: str) -> str:
     Returns:
         Nom de la catégorie ou 'Autres'
     """
-    for cat_name, cat_info in CATEGORIES.items():
-        if typequ in cat_info['codes']:
-            return cat_name
-    return 'Autres'
+    category = _CODE_INDEX.get(typequ)
+    if category is not None:
+        return category
+    if isinstance(typequ, str):
+        for prefix, cat_name in _PREFIX_RULES:
+            if typequ.startswith(prefix):
+                return cat_name
+    return OTHER_CATEGORY
+
+
+def categorize(typequ: pd.Series) -> pd.Categorical:
+    """
+    Classe une série de codes TYPEQU en catégories
+
+    Seules les valeurs distinctes (quelques centaines) passent par
+    get_category ; le résultat est redistribué par leurs codes entiers.
+
+    Args:
+        typequ: Série de codes type équipement
+
+    Returns:
+        Categorical dont les modalités suivent CATEGORY_NAMES
+    """
+    codes, uniques = pd.factorize(typequ, use_na_sentinel=True)
+    unique_codes = pd.Index([CATEGORY_NAMES.index(get_category(code)) for code in uniques]
+                            + [CATEGORY_NAMES.index(OTHER_CATEGORY)])
+    # Le sentinel -1 (valeurs manquantes) pointe sur la dernière entrée : 'Autres'
+    return pd.Categorical.from_codes(unique_codes.to_numpy()[codes], categories=CATEGORY_NAMES)
 
 
 def get_all_codes() -> list:
-    """Retourne tous les codes d'équipements catégorisés"""
+    """
+    Retourne tous les codes d'équipements catégorisés
+
+    Seuls les codes exacts sont renvoyés ; les familles ('D2*') le sont
+    par get_code_families.
+    """
     all_codes = []
     for cat_info in CATEGORIES.values():
-        all_codes.extend(cat_info['codes'])
-    return all_codes
\ No newline at end of file
+        all_codes.extend(code for code in cat_info['codes'] if not code.endswith('*'))
+    return all_codes
+
+
+def get_code_families() -> dict:
+    """
+    Retourne les familles de codes et leur catégorie
+
+    Returns:
+        {préfixe: catégorie}, ex: {'D2': 'Santé'} pour la famille 'D2*'
+    """
+    return {prefix: cat_name for prefix, cat_name in _PREFIX_RULES}
\ No newline at end of file
@@ -2,6 +2,7 @@
 Configuration générale du projet mobiTIC
 """
 
+import os
 from pathlib import Path
 
 # ============================================================================
@@ -11,9 +12,27 @@ from pathlib import Path
 # Racine du projet
 PROJECT_ROOT = Path(__file__).parent.parent.parent
 
-# Dossiers de données
-DATA_DIR = PROJECT_ROOT / "data"
+# Dossiers de données (MOBITIC_DATA_DIR : autre dossier, p. ex. pour les benchmarks)
+DATA_DIR = Path(os.environ.get("MOBITIC_DATA_DIR", PROJECT_ROOT / "data"))
 OUTPUT_DIR = DATA_DIR / "lyon"
+CACHE_DIR = DATA_DIR / "cache"
+TILES_DIR = OUTPUT_DIR / "tiles"
+DENSITY_DIR = OUTPUT_DIR / "density"  # Tuiles de densité des équipements
+BUNDLE_DIR = OUTPUT_DIR / "bundle"
+PROFILE_DIR = OUTPUT_DIR / "profiles"  # Profils cProfile par étape (--profile)
+SNAPSHOT_DIR = DATA_DIR / "snapshots"  # Tables chargées, en Arrow IPC (lues par mmap)
+NATIONAL_DIR = DATA_DIR / "france"    # Données nationales partagées (--batch)
+PARTITIONS_DIR = DATA_DIR / "departements"  # BPE et IRIS partitionnés par département
+REGIONS_DIR = DATA_DIR / "regions"    # Une carte par région (--batch)
+
+# Ressources web embarquées (Leaflet, MarkerCluster...)
+OFFLINE_ASSETS_DIR = PROJECT_ROOT / "offline_assets"
+
+# Fond de carte de la carte autonome (--bundle) :
+#  - None   : aucun fond (aucune requête réseau), couleur unie
+#  - dossier local de tuiles z/x/y.png : copié dans le bundle
+#  - URL de tuiles ('https://.../{z}/{x}/{y}.png') : chargées en ligne
+BUNDLE_BASEMAP = None
 
 # Créer les dossiers si nécessaire
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
@@ -23,14 +42,39 @@ OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 # ============================================================================
 
 OUTPUT_FILE = "carte_lyon_interactive.html"
-BPE_FILE = "bpe_lyon.parquet"
-IRIS_FILE = "iris_lyon.geojson"
-BPE_GEO_FILE = "bpe_lyon.geojson"
+# Intermédiaires partitionnés par département (<dataset>/dep=XX/part-0.parquet),
+# communs à toutes les zones : seuls les départements manquants sont traités
+BPE_DATASET = "bpe"
+IRIS_DATASET = "iris"                    # GeoParquet (géométries WKB)
+BPE_GEO_DATASET = "bpe_geo"              # GeoParquet (géométries WKB)
+IRIS_LEVELS_FILE = "iris_lyon_levels.parquet"  # Contours simplifiés par zoom
+BPE_IRIS_FILE = "bpe_lyon_iris.parquet"  # BPE géolocalisé + code_iris
+IRIS_COUNTS_FILE = "iris_categories.parquet"   # Équipements par IRIS et catégorie
+ACCESS_IRIS_FILE = "access_iris.parquet"        # Distance à l'équipement le plus proche (IRIS)
+ACCESS_GRID_FILE = "access_grid.parquet"        # Idem sur une grille régulière
+
+# Données nationales en Arrow IPC non compressé (lues par mmap, --batch)
+BPE_NATIONAL_FILE = "bpe_france.arrow"
+IRIS_NATIONAL_FILE = "iris_france.arrow"
+
+# Exports GeoJSON (sur demande uniquement, --export-geojson)
+IRIS_GEOJSON_FILE = "iris_lyon.geojson"
+BPE_GEOJSON_FILE = "bpe_lyon.geojson"
 
 # Chemins complets
-BPE_PATH = OUTPUT_DIR / BPE_FILE
-IRIS_PATH = OUTPUT_DIR / IRIS_FILE
-BPE_GEO_PATH = OUTPUT_DIR / BPE_GEO_FILE
+BPE_PATH = PARTITIONS_DIR / BPE_DATASET
+IRIS_PATH = PARTITIONS_DIR / IRIS_DATASET
+BPE_GEO_PATH = PARTITIONS_DIR / BPE_GEO_DATASET
+IRIS_LEVELS_PATH = OUTPUT_DIR / IRIS_LEVELS_FILE
+BPE_IRIS_PATH = OUTPUT_DIR / BPE_IRIS_FILE
+IRIS_COUNTS_PATH = OUTPUT_DIR / IRIS_COUNTS_FILE
+ACCESS_IRIS_PATH = OUTPUT_DIR / ACCESS_IRIS_FILE
+ACCESS_GRID_PATH = OUTPUT_DIR / ACCESS_GRID_FILE
+IRIS_GEOJSON_PATH = OUTPUT_DIR / IRIS_GEOJSON_FILE
+BPE_GEOJSON_PATH = OUTPUT_DIR / BPE_GEOJSON_FILE
+BPE_NATIONAL_PATH = NATIONAL_DIR / BPE_NATIONAL_FILE
+IRIS_NATIONAL_PATH = NATIONAL_DIR / IRIS_NATIONAL_FILE
+REGIONS_INDEX_PATH = REGIONS_DIR / "index.json"
 OUTPUT_PATH = PROJECT_ROOT / OUTPUT_FILE
 
 # ============================================================================
@@ -41,33 +85,165 @@ OUTPUT_PATH = PROJECT_ROOT / OUTPUT_FILE
 # DEPARTEMENTS = ['69']  # Rhône/Métropole de Lyon
 DEPARTEMENTS = ['69', '01', '42', '38'] # Pour élargir
 
+# Départements imposés par l'environnement (MOBITIC_DEPARTEMENTS=69,01)
+if os.environ.get("MOBITIC_DEPARTEMENTS"):
+    DEPARTEMENTS = os.environ["MOBITIC_DEPARTEMENTS"].split(",")
+
 # Centre de la carte (Lyon)
 MAP_ZOOM = 11
 
+# Cartes régionales produites par --batch (ou lues dans un fichier JSON :
+# --batch regions.json). Chaque région a un nom (fichier <nom>.html dans
+# REGIONS_DIR) et une liste de départements ou d'EPCI (SIREN).
+REGIONS = [
+    {'name': 'lyon', 'departements': ['69']},
+    {'name': 'metropole-de-lyon', 'epci': ['200046977']},
+    {'name': 'auvergne-rhone-alpes', 'departements': ['01', '03', '07', '15', '26', '38',
+                                                      '42', '43', '63', '69', '73', '74']},
+]
+
 # ============================================================================
 # URLS DE TÉLÉCHARGEMENT
 # ============================================================================
 
 # Base Permanente des Équipements
-BPE_URL = "https://www.insee.fr/fr/statistiques/fichier/8217525/BPE24.parquet"
+BPE_URL = os.environ.get("MOBITIC_BPE_URL",
+                         "https://www.insee.fr/fr/statistiques/fichier/8217525/BPE24.parquet")
+
+# Lecture distante de la BPE par requêtes Range (seuls les groupes de lignes
+# et colonnes utiles sont transférés). Repli sur un téléchargement complet
+# si le serveur ne gère pas les Range.
+BPE_REMOTE_READ = True
+
+# Colonnes BPE conservées (None = toutes)
+BPE_COLUMNS = [
+    'DEP', 'DEPCOM', 'DCIRIS', 'TYPEQU', 'DOM', 'SDOM', 'NOMRS',
+    'LAMBERT_X', 'LAMBERT_Y', 'QUALITE_XY',
+]
 
 # Contours IRIS
-IRIS_URL = "https://data.geopf.fr/telechargement/download/CONTOURS-IRIS/CONTOURS-IRIS_2-1__SHP__FRA_2020-01-01/CONTOURS-IRIS_2-1__SHP__FRA_2020-01-01.7z"
+IRIS_URL = os.environ.get("MOBITIC_IRIS_URL", "https://data.geopf.fr/telechargement/download/CONTOURS-IRIS/CONTOURS-IRIS_2-1__SHP__FRA_2020-01-01/CONTOURS-IRIS_2-1__SHP__FRA_2020-01-01.7z")
 
 
 # ============================================================================
 # PARAMÈTRES DE CARTOGRAPHIE
 # ============================================================================
 
-# Nombre maximum de marqueurs à afficher (performance)
+# Rendu des équipements :
+#  - 'bulk'     : tous les points, marqueurs créés dans le navigateur
+#                 et regroupés par MarkerCluster
+#  - 'clusters' : groupes précalculés par zoom, points isolés au-delà
+#                 de CLUSTER_MAX_ZOOM
+#  - 'markers'  : un folium.Marker par point, échantillon de MAX_MARKERS
+#  - 'auto'     : 'bulk' jusqu'à CLUSTER_THRESHOLD points, 'clusters' au-delà
+MAP_RENDER_MODE = 'auto'
+CLUSTER_THRESHOLD = 50000
+
+# Groupes précalculés : zooms couverts et maille de regroupement (pixels)
+CLUSTER_MIN_ZOOM = 6
+CLUSTER_MAX_ZOOM = 15
+CLUSTER_RADIUS = 60
+
+# Niveaux de simplification des contours IRIS de la carte :
+# (zoom minimal, tolérance en mètres (Lambert-93), décimales WGS84 conservées)
+IRIS_LEVELS = [
+    (0, 60.0, 4),
+    (12, 15.0, 5),
+    (14, 2.0, 5),
+]
+
+# Choroplèthe du nombre d'équipements par IRIS : 'total', un nom de
+# catégorie, ou None pour ne pas ajouter la couche
+CHOROPLETH_COLUMN = 'total'
+
+# Accessibilité : distance (m) de chaque IRIS et, sur demande, de chaque
+# maille d'une grille régulière à l'équipement le plus proche de chaque
+# catégorie. La carte n'utilise que la table des IRIS : la grille
+# (access_loader(grid=True)) n'est calculée que si sa taille est renseignée
+ACCESS_GRID_SIZE = None         # Côté des mailles en mètres, p. ex. 200 (None = IRIS seulement)
+ACCESS_WORKERS = None           # Threads (une catégorie chacun), None = nombre de CPU
+ACCESS_MAP_CATEGORY = 'Santé'   # Catégorie affichée sur la carte (None = aucune)
+
+# Regroupement des équipements situés au même endroit (coordonnées
+# arrondies à MARKER_GROUPING_DECIMALS décimales) en un seul marqueur :
+#  - 'category' : un marqueur par emplacement et par catégorie
+#  - 'location' : un marqueur par emplacement, toutes catégories confondues
+#                 (dans la couche de la catégorie majoritaire)
+#  - None       : un marqueur par équipement
+MARKER_GROUPING = 'category'
+MARKER_GROUPING_DECIMALS = 5    # 1e-5 degré ~ 1 m
+
+# Nombre maximum de marqueurs (emplacements) à afficher en mode 'markers' (performance)
 MAX_MARKERS = 5000
 
-# Taille des chunks pour le téléchargement
-CHUNK_SIZE = 8192
+# Pyramide de tuiles (--tiles) : niveaux de zoom générés
+TILE_MIN_ZOOM = 8
+TILE_MAX_ZOOM = 14
+BPE_TILE_MIN_ZOOM = 10
+
+# Couches de densité des équipements (tous les équipements, sans
+# échantillonnage, comptés par pixel Web Mercator), masquées par défaut :
+#  - 'overlay' : une image par catégorie au zoom DENSITY_ZOOM (réduit tant
+#                que l'image dépasse DENSITY_MAX_PIXELS de côté)
+#  - 'tiles'   : tuiles PNG de DENSITY_MIN_ZOOM à DENSITY_MAX_ZOOM (étape density)
+#  - None      : pas de couche de densité
+DENSITY_LAYERS = 'overlay'
+DENSITY_ZOOM = 12
+DENSITY_MAX_PIXELS = 1536
+DENSITY_MIN_ZOOM = 8
+DENSITY_MAX_ZOOM = 14
+DENSITY_SMOOTHING = 1.5         # Écart type du lissage gaussien (pixels, 0 = aucun)
+DENSITY_OPACITY = 0.8           # Opacité des pixels les plus denses
+
+# Nombre de processus pour le découpage en tuiles (None = nombre de CPU)
+TILE_WORKERS = None
+
+# Nombre de processus construisant les cartes régionales (None = nombre de CPU)
+BATCH_WORKERS = None
+
+# Géolocalisation de la BPE (étape geo), lot par lot : lignes par lot et
+# threads (un département chacun, None = nombre de CPU)
+GEO_BATCH_ROWS = 65_536
+GEO_WORKERS = 1
+
+# Serveur local de données (--serve)
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8000
+SERVER_CACHE_SIZE = 512         # Réponses conservées en mémoire (LRU)
+
+# Cache des loaders (data_manager) : tables gardées en mémoire (LRU, 0 =
+# aucune) et instantanés Arrow IPC sur disque pour les processus suivants,
+# les moins récemment utilisés supprimés au-delà de LOADER_SNAPSHOT_MAX_BYTES
+LOADER_CACHE_SIZE = 4
+LOADER_SNAPSHOTS = True
+LOADER_SNAPSHOT_MAX_BYTES = 1024 ** 3
+
+# Traces (--trace) : période d'échantillonnage de la mémoire résidente (s)
+TRACE_SAMPLE_INTERVAL = 0.05
+
+# Taille initiale (et minimale) des chunks de téléchargement, ajustée au
+# débit jusqu'à DOWNLOAD_MAX_CHUNK_SIZE
+CHUNK_SIZE = 64 * 1024
+DOWNLOAD_MAX_CHUNK_SIZE = 4 * 1024 ** 2
+
+# Téléchargements par requêtes Range parallèles (serveurs qui les
+# acceptent) : connexions, taille minimale d'un segment, tentatives après
+# une coupure (le transfert reprend là où il s'est arrêté) et délai avant
+# la première (doublé ensuite, s)
+DOWNLOAD_CONNECTIONS = 4
+DOWNLOAD_SEGMENT_SIZE = 16 * 1024 ** 2
+DOWNLOAD_RETRIES = 5
+DOWNLOAD_RETRY_DELAY = 0.5
 
 # Timeout pour les requêtes HTTP (en secondes)
 REQUEST_TIMEOUT = 180
 
+# Taille maximale du cache de téléchargement (toutes versions confondues)
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# Taille minimale d'une requête Range (lecture anticipée)
+RANGE_BLOCK_SIZE = 64 * 1024
+
 # ============================================================================
 # SYSTÈMES DE COORDONNÉES
 # ============================================================================
@@ -1,8 +1,29 @@
 import logging
 import argparse
+from functools import partial
+from pathlib import Path
 
-from utils.data_downloader import download_bpe, download_IRIS, geodataframe
-from config.settings import OUTPUT_FILE
+from utils.data_downloader import download_bpe, download_IRIS, geodataframe, export_geojson, download_national
+from utils.pipeline import Pipeline, Stage
+from utils.simplify import simplify_iris
+from utils.spatial_join import join_bpe_iris
+from utils.accessibility import compute_accessibility
+from utils.partitions import partition_paths
+from utils.tracing import start_tracing, stop_tracing
+from config.settings import OUTPUT_FILE, BPE_PATH, IRIS_PATH, BPE_GEO_PATH, MAX_MARKERS, MAP_RENDER_MODE
+from config.settings import IRIS_LEVELS_PATH, IRIS_LEVELS
+from config.settings import BPE_IRIS_PATH, IRIS_COUNTS_PATH, CHOROPLETH_COLUMN
+from config.settings import ACCESS_IRIS_PATH, ACCESS_GRID_PATH, ACCESS_GRID_SIZE, ACCESS_MAP_CATEGORY
+from config.settings import CLUSTER_THRESHOLD, CLUSTER_MIN_ZOOM, CLUSTER_MAX_ZOOM, CLUSTER_RADIUS
+from config.settings import MARKER_GROUPING, MARKER_GROUPING_DECIMALS
+from config.settings import IRIS_GEOJSON_PATH, BPE_GEOJSON_PATH, TILES_DIR, BUNDLE_DIR
+from config.settings import TILE_MIN_ZOOM, TILE_MAX_ZOOM, BPE_TILE_MIN_ZOOM
+from config.settings import SERVER_HOST, SERVER_PORT, PROFILE_DIR
+from config.settings import BPE_NATIONAL_PATH, IRIS_NATIONAL_PATH, REGIONS, REGIONS_INDEX_PATH
+from config.settings import DEPARTEMENTS
+from config.settings import DENSITY_DIR, DENSITY_LAYERS, DENSITY_ZOOM, DENSITY_MAX_PIXELS
+from config.settings import DENSITY_MIN_ZOOM, DENSITY_MAX_ZOOM, DENSITY_SMOOTHING, DENSITY_OPACITY
+from config.categories import CATEGORIES
 
 logging.basicConfig(
     level=logging.INFO,
@@ -10,6 +31,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+DOWNLOAD_STAGES = ['bpe', 'iris', 'geo']
+MAP_STAGES = ['simplify', 'join', 'access'] + (['density'] if DENSITY_LAYERS == 'tiles' else []) + ['map']
+
 
 def parse_arguments() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
@@ -20,38 +44,171 @@ def parse_arguments() -> argparse.Namespace:
                         help='Télécharger les données')
     parser.add_argument('--map', action='store_true',
                         help='Créer la carte')
+    parser.add_argument('--export-geojson', action='store_true',
+                        help='Exporter aussi les données en GeoJSON')
+    parser.add_argument('--tiles', action='store_true',
+                        help='Générer la pyramide de tuiles et sa visionneuse')
+    parser.add_argument('--bundle', action='store_true',
+                        help='Écrire la carte en dossier autonome (ressources locales, données compressées)')
+    parser.add_argument('--batch', nargs='?', const='', default=None, metavar='REGIONS_JSON',
+                        help='Construire une carte par région (REGIONS ou fichier JSON de régions)')
+    parser.add_argument('--serve', action='store_true',
+                        help='Servir une carte dynamique interrogeant les données en local')
+    parser.add_argument('--port', type=int, default=SERVER_PORT,
+                        help='Port du serveur local (--serve)')
+    parser.add_argument('--jobs', '-j', type=int, default=2,
+                        help='Nombre d\'étapes exécutées en parallèle')
+    parser.add_argument('--force', action='store_true',
+                        help='Reconstruire même les étapes à jour')
+    parser.add_argument('--trace', type=Path, default=None, metavar='OUT_JSON',
+                        help='Tracer les étapes et sous-étapes (format Chrome trace-event)')
+    parser.add_argument('--profile', nargs='?', type=Path, const=PROFILE_DIR, default=None, metavar='DIR',
+                        help='Profiler chaque étape avec cProfile (<DIR>/<étape>.prof)')
     
     return parser.parse_args()
 
 
+def create_map():
+    from utils.map_generator import create_interactive_map
+    create_interactive_map()
+    logger.info(f"Map created: {OUTPUT_FILE}")
+
+
+def create_bundle():
+    from utils.map_generator import create_interactive_map
+    create_interactive_map(bundle_dir=BUNDLE_DIR)
+
+
+def create_regional_maps(regions: list):
+    from utils.batch import run_batch
+    run_batch(regions)
+
+
+def create_tiles():
+    from utils.tiling import export_tiles
+    export_tiles()
+
+
+def create_density_tiles():
+    from utils.density import export_density_tiles
+    export_density_tiles()
+
+
+def build_pipeline(regions: list = REGIONS) -> Pipeline:
+    """
+    Graphe des étapes :
+    bpe -> geo -> join/access <- iris, puis map/bundle <- (geo, join, access, simplify <- iris,
+    density <- geo si DENSITY_LAYERS vaut 'tiles')
+    et, indépendamment, national -> batch (cartes des `regions`)
+    """
+    # Intermédiaires partitionnés : une partition (fichier) par département
+    bpe, iris, bpe_geo = (partition_paths(path, DEPARTEMENTS) for path in (BPE_PATH, IRIS_PATH, BPE_GEO_PATH))
+
+    density_index = DENSITY_DIR / 'index.json'
+    density_params = {'layers': DENSITY_LAYERS, 'zoom': [DENSITY_ZOOM, DENSITY_MAX_PIXELS],
+                      'zooms': [DENSITY_MIN_ZOOM, DENSITY_MAX_ZOOM],
+                      'smoothing': DENSITY_SMOOTHING, 'opacity': DENSITY_OPACITY}
+
+    map_inputs = [IRIS_LEVELS_PATH, *bpe_geo, IRIS_COUNTS_PATH, ACCESS_IRIS_PATH]
+    map_deps = ['simplify', 'geo', 'join', 'access']
+    if DENSITY_LAYERS == 'tiles':
+        map_inputs.append(density_index)
+        map_deps.append('density')
+    map_params = {'max_markers': MAX_MARKERS, 'render_mode': MAP_RENDER_MODE,
+                  'clusters': [CLUSTER_THRESHOLD, CLUSTER_MIN_ZOOM, CLUSTER_MAX_ZOOM, CLUSTER_RADIUS],
+                  'iris_levels': IRIS_LEVELS, 'choropleth': CHOROPLETH_COLUMN,
+                  'access': ACCESS_MAP_CATEGORY,
+                  'grouping': [MARKER_GROUPING, MARKER_GROUPING_DECIMALS], 'categories': CATEGORIES,
+                  'density': density_params}
+
+    return Pipeline([
+        Stage('bpe', download_bpe, outputs=bpe,
+              always_run=True, forceable=True),
+        Stage('iris', download_IRIS, outputs=iris,
+              always_run=True, forceable=True),
+        Stage('geo', geodataframe, inputs=bpe, outputs=bpe_geo,
+              deps=['bpe'], params={'categories': CATEGORIES}, forceable=True),
+        Stage('simplify', simplify_iris, inputs=iris, outputs=[IRIS_LEVELS_PATH],
+              deps=['iris'], params={'levels': IRIS_LEVELS}),
+        Stage('join', join_bpe_iris, inputs=iris + bpe_geo,
+              outputs=[BPE_IRIS_PATH, IRIS_COUNTS_PATH], deps=['iris', 'geo'],
+              params={'categories': CATEGORIES}),
+        Stage('access', compute_accessibility, inputs=iris + bpe_geo,
+              outputs=[ACCESS_IRIS_PATH] + ([ACCESS_GRID_PATH] if ACCESS_GRID_SIZE else []),
+              deps=['iris', 'geo'], params={'grid': ACCESS_GRID_SIZE, 'categories': CATEGORIES}),
+        Stage('map', create_map, inputs=map_inputs, outputs=[OUTPUT_FILE],
+              deps=map_deps, params=map_params),
+        Stage('bundle', create_bundle, inputs=map_inputs, outputs=[BUNDLE_DIR / 'index.html'],
+              deps=map_deps, params=map_params),
+        Stage('national', download_national, outputs=[BPE_NATIONAL_PATH, IRIS_NATIONAL_PATH],
+              always_run=True, forceable=True),
+        Stage('batch', partial(create_regional_maps, regions),
+              inputs=[BPE_NATIONAL_PATH, IRIS_NATIONAL_PATH], outputs=[REGIONS_INDEX_PATH],
+              deps=['national'], params={**map_params, 'regions': regions}),
+        Stage('geojson', export_geojson, inputs=iris + bpe_geo,
+              outputs=[IRIS_GEOJSON_PATH, BPE_GEOJSON_PATH], deps=['iris', 'geo']),
+        Stage('tiles', create_tiles, inputs=iris + bpe_geo,
+              outputs=[TILES_DIR / 'index.html'], deps=['iris', 'geo'],
+              params={'zooms': [TILE_MIN_ZOOM, TILE_MAX_ZOOM, BPE_TILE_MIN_ZOOM],
+                      'categories': CATEGORIES}),
+        Stage('density', create_density_tiles, inputs=bpe_geo, outputs=[density_index],
+              deps=['geo'], params={**density_params, 'categories': CATEGORIES}),
+    ])
+
+
 def main():
     args = parse_arguments()
     logger.info(f"Main called with arguments: {args}")
 
     # Default mode:
-    if not args.download and not args.map:
+    if not any([args.download, args.map, args.export_geojson, args.tiles, args.bundle, args.serve,
+                args.batch is not None]):
         args.download = True
         args.map = True
+
+    targets = []
+    if args.download:
+        targets += DOWNLOAD_STAGES
+    if args.map:
+        targets += MAP_STAGES
+    if args.export_geojson:
+        targets.append('geojson')
+    if args.tiles:
+        targets.append('tiles')
+    if args.bundle:
+        targets += MAP_STAGES[:-1] + ['bundle']
+    if args.batch is not None:
+        targets += ['national', 'batch']
+    if args.serve and targets:
+        targets.append('simplify')
         
+    if args.trace is not None:
+        start_tracing()
+
     try:
-        if args.download:
-            logger.info("Data downloading")
-            download_bpe()
-            download_IRIS()
-            geodataframe()
-        
-        if args.map:
-            logger.info("Map creation")
-            
-            from utils.map_generator import create_interactive_map
-            create_interactive_map()
-            
-            logger.info(f"Map created: {OUTPUT_FILE}")
+        if targets:
+            regions = REGIONS
+            if args.batch:
+                from utils.batch import load_regions
+                regions = load_regions(args.batch)
+            results = build_pipeline(regions).run(targets, jobs=args.jobs, force=args.force,
+                                                  profile_dir=args.profile)
+            logger.info(f"Stages run: {[name for name, ran in results.items() if ran]}")
+            if args.profile is not None:
+                logger.info(f"Profiles saved: {args.profile}/<stage>.prof (python -m pstats)")
+
+        if args.serve:
+            from utils.server import serve
+            serve(SERVER_HOST, args.port)
 
     except Exception as e:
         logger.error(f"Error: {e}")
         raise 
 
+    finally:
+        if args.trace is not None:
+            stop_tracing(args.trace)
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,172 @@
+"""
+Accessibilité : distance à l'équipement le plus proche de chaque catégorie
+
+Les équipements de chaque catégorie sont indexés une fois (arbre k-d de
+scipy s'il est installé, sinon STRtree de shapely), puis tous les points
+cibles (IRIS ou mailles d'une grille régulière) sont interrogés en un seul
+appel vectorisé par catégorie. Les catégories sont traitées en parallèle.
+Les distances sont euclidiennes, en mètres (Lambert-93).
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from config import (ACCESS_IRIS_PATH, ACCESS_GRID_PATH, ACCESS_GRID_SIZE, ACCESS_WORKERS,
+                    CRS_LAMBERT93)
+from utils.data_manager import iris_loader, bpe_loader
+from utils.spatial_join import locate_points
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # scipy est optionnel
+    cKDTree = None
+
+logger = logging.getLogger(__name__)
+
+
+class NearestIndex:
+    """
+    Index des équipements d'une catégorie pour la recherche du plus proche
+
+    Args:
+        xy: Coordonnées Lambert-93 des équipements, tableau (n, 2)
+    """
+
+    def __init__(self, xy: np.ndarray):
+        self.size = len(xy)
+        if self.size == 0:
+            self._tree = None
+        elif cKDTree is not None:
+            self._tree = cKDTree(xy)
+        else:
+            self._tree = shapely.STRtree(shapely.points(xy))
+
+    def query(self, xy: np.ndarray) -> tuple:
+        """
+        Plus proche équipement de chaque point de `xy`
+
+        Returns:
+            (distances, indices) ; NaN et -1 si la catégorie est vide
+        """
+        distances = np.full(len(xy), np.nan)
+        indices = np.full(len(xy), -1, dtype='int64')
+        if self.size == 0 or len(xy) == 0:
+            return distances, indices
+
+        if cKDTree is not None:
+            distances, indices = self._tree.query(xy, k=1)
+            return distances, indices.astype('int64')
+
+        pairs, found = self._tree.query_nearest(shapely.points(xy), return_distance=True,
+                                                all_matches=False)
+        distances[pairs[0]] = found
+        indices[pairs[0]] = pairs[1]
+        return distances, indices
+
+
+def equipment_coordinates(bpe_gdf: pd.DataFrame) -> dict:
+    """Coordonnées Lambert-93 des équipements, par catégorie"""
+    groups = bpe_gdf.groupby('categorie', observed=False)
+    return {cat: np.column_stack([points['LAMBERT_X'].to_numpy('float64'),
+                                  points['LAMBERT_Y'].to_numpy('float64')])
+            for cat, points in groups}
+
+
+def nearest_distances(targets: np.ndarray, equipments: dict, workers: int = ACCESS_WORKERS) -> pd.DataFrame:
+    """
+    Distance de chaque cible à l'équipement le plus proche de chaque catégorie
+
+    Args:
+        targets: Coordonnées Lambert-93 des cibles, tableau (n, 2)
+        equipments: {catégorie: coordonnées (m, 2)} (voir equipment_coordinates)
+        workers: Nombre de catégories traitées simultanément
+
+    Returns:
+        DataFrame (une ligne par cible, une colonne par catégorie), en mètres
+    """
+    def query(cat):
+        return cat, NearestIndex(equipments[cat]).query(targets)[0].astype('float32')
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        distances = dict(executor.map(query, equipments))
+
+    return pd.DataFrame({cat: distances[cat] for cat in equipments})
+
+
+def iris_targets(iris_gdf: gpd.GeoDataFrame) -> np.ndarray:
+    """Point intérieur de chaque IRIS, en Lambert-93"""
+    points = iris_gdf.geometry.to_crs(CRS_LAMBERT93).representative_point()
+    return shapely.get_coordinates(points.to_numpy())
+
+
+def grid_targets(iris_gdf: gpd.GeoDataFrame, cell_size: float) -> pd.DataFrame:
+    """
+    Centres des mailles d'une grille régulière (Lambert-93) situés dans un IRIS
+
+    Returns:
+        DataFrame des colonnes x, y et code_iris
+    """
+    iris_l93 = iris_gdf.to_crs(CRS_LAMBERT93)
+    xmin, ymin, xmax, ymax = iris_l93.total_bounds
+    xs = np.arange(np.floor(xmin / cell_size), np.ceil(xmax / cell_size)) * cell_size + cell_size / 2
+    ys = np.arange(np.floor(ymin / cell_size), np.ceil(ymax / cell_size)) * cell_size + cell_size / 2
+    x, y = (values.ravel() for values in np.meshgrid(xs, ys))
+
+    located = locate_points(gpd.GeoSeries(gpd.points_from_xy(x, y)), iris_l93.geometry)
+    inside = located >= 0
+    return pd.DataFrame({
+        'x': x[inside],
+        'y': y[inside],
+        'code_iris': iris_l93['code_iris'].to_numpy()[located[inside]],
+    })
+
+
+def iris_accessibility(iris_gdf: gpd.GeoDataFrame, equipments: dict) -> pd.DataFrame:
+    """
+    Distance de chaque IRIS à l'équipement le plus proche de chaque catégorie
+
+    Returns:
+        DataFrame des colonnes code_iris et une par catégorie (mètres)
+    """
+    access_iris = nearest_distances(iris_targets(iris_gdf), equipments)
+    access_iris.insert(0, 'code_iris', iris_gdf['code_iris'].to_numpy())
+    return access_iris
+
+
+def compute_accessibility(grid_size: float = ACCESS_GRID_SIZE):
+    """
+    Calcule les tables d'accessibilité par IRIS (et sur une grille)
+
+    Écrit ACCESS_IRIS_PATH (une ligne par IRIS) et, si `grid_size` est
+    renseigné, ACCESS_GRID_PATH (une ligne par maille de `grid_size` mètres).
+    """
+    try:
+        iris_gdf = iris_loader(['code_iris'])
+        bpe_gdf = bpe_loader(['LAMBERT_X', 'LAMBERT_Y', 'categorie'], geometry=False)
+        bpe_gdf = bpe_gdf.dropna(subset=['LAMBERT_X', 'LAMBERT_Y'])
+        equipments = equipment_coordinates(bpe_gdf)
+
+        start = time.perf_counter()
+        access_iris = iris_accessibility(iris_gdf, equipments)
+        access_iris.to_parquet(ACCESS_IRIS_PATH, index=False)
+        logger.info(f"Accessibilité de {len(access_iris):,} IRIS calculée "
+                    f"({time.perf_counter() - start:.1f}s) : {ACCESS_IRIS_PATH}")
+
+        if grid_size:
+            start = time.perf_counter()
+            grid = grid_targets(iris_gdf, grid_size)
+            access_grid = pd.concat([grid, nearest_distances(grid[['x', 'y']].to_numpy(), equipments)],
+                                    axis=1)
+            access_grid.to_parquet(ACCESS_GRID_PATH, index=False)
+            logger.info(f"Accessibilité de {len(access_grid):,} mailles de {grid_size:g} m calculée "
+                        f"({time.perf_counter() - start:.1f}s) : {ACCESS_GRID_PATH}")
+
+    except Exception as e:
+        logger.info(f"Erreur lors du calcul de l'accessibilité : {e}")
+        raise
@@ -0,0 +1,192 @@
+"""
+Cartes régionales en lot (--batch)
+
+La BPE et les contours IRIS de toute la France sont préparés une seule fois
+en Arrow IPC non compressé (voir download_national). Chaque processus du
+pool ouvre ces fichiers par mmap : les colonnes sont lues directement dans
+le cache de pages du système, partagé entre processus, sans copie ni
+désérialisation. Seules les lignes d'une région sont converties en
+GeoDataFrame, puis ses contours simplifiés, comptages, distances et sa
+carte sont calculés en mémoire.
+
+Une région est définie par des départements (préfixe du code IRIS) ou par
+des EPCI (colonne EPCI de la BPE ; ses IRIS sont ceux des communes où la
+BPE recense au moins un équipement).
+"""
+
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import reduce
+from pathlib import Path
+
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from config import BPE_NATIONAL_PATH, IRIS_NATIONAL_PATH, REGIONS, REGIONS_DIR, REGIONS_INDEX_PATH
+from config import BATCH_WORKERS, CHOROPLETH_COLUMN, ACCESS_MAP_CATEGORY, CRS_WGS84
+from utils.simplify import simplify_levels
+from utils.spatial_join import attach_iris, category_counts
+from utils.accessibility import equipment_coordinates, iris_accessibility
+from utils.map_generator import build_map
+
+logger = logging.getLogger(__name__)
+
+# Tables nationales ouvertes par mmap, une fois par processus
+_national = {}
+
+
+def load_regions(path: Path) -> list:
+    """Lit une liste de régions au format de REGIONS depuis un fichier JSON"""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def validate_regions(regions: list):
+    """
+    Vérifie les définitions de régions
+
+    Raises:
+        ValueError: Nom absent, en double ou inutilisable comme nom de
+            fichier, ou région sans exactement un critère parmi
+            'departements' et 'epci'
+    """
+    names = set()
+    for region in regions:
+        name = region.get('name')
+        if not name or os.sep in name or name.startswith('.'):
+            raise ValueError(f"Invalid region name: {name!r}")
+        if name in names:
+            raise ValueError(f"Duplicate region name: {name!r}")
+        names.add(name)
+        if ('departements' in region) == ('epci' in region):
+            raise ValueError(f"Region {name!r} needs either 'departements' or 'epci'")
+
+
+def open_national():
+    """Ouvre par mmap les tables BPE et IRIS nationales (initialisation d'un processus)"""
+    for name, path in (('bpe', BPE_NATIONAL_PATH), ('iris', IRIS_NATIONAL_PATH)):
+        if not path.exists():
+            raise FileNotFoundError(f"File located {path} does not exist")
+        _national[name] = pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+
+
+def region_masks(bpe: pa.Table, iris: pa.Table, region: dict) -> tuple:
+    """
+    Lignes BPE et IRIS d'une région
+
+    Returns:
+        (masque BPE, masque IRIS), tableaux booléens Arrow
+    """
+    codes = iris['code_iris'].cast(pa.string())
+
+    if 'departements' in region:
+        departements = [str(dep) for dep in region['departements']]
+        bpe_mask = pc.is_in(bpe['DEP'].cast(pa.string()), value_set=pa.array(departements))
+        iris_mask = reduce(pc.or_, [pc.starts_with(codes, dep) for dep in departements])
+        return bpe_mask, iris_mask
+
+    if 'EPCI' not in bpe.column_names:
+        raise ValueError(f"Region {region['name']!r}: no EPCI column in the national BPE")
+    epcis = pa.array([str(epci) for epci in region['epci']])
+    bpe_mask = pc.is_in(bpe['EPCI'].cast(pa.string()), value_set=epcis)
+    communes = pc.unique(bpe.filter(bpe_mask)['DEPCOM'].cast(pa.string()))
+    iris_mask = pc.is_in(pc.utf8_slice_codeunits(codes, 0, 5), value_set=communes)
+    return bpe_mask, iris_mask
+
+
+def region_data(region: dict) -> tuple:
+    """
+    BPE et IRIS d'une région, extraites des tables nationales
+
+    Returns:
+        (bpe_gdf, iris_gdf), GeoDataFrames WGS84
+    """
+    if not _national:
+        open_national()
+    bpe_mask, iris_mask = region_masks(_national['bpe'], _national['iris'], region)
+
+    bpe_df = _national['bpe'].filter(bpe_mask).to_pandas()
+    bpe_gdf = gpd.GeoDataFrame(bpe_df.drop(columns=['lon', 'lat']),
+                               geometry=gpd.points_from_xy(bpe_df['lon'], bpe_df['lat']),
+                               crs=CRS_WGS84)
+    iris_gdf = gpd.GeoDataFrame.from_arrow(_national['iris'].filter(iris_mask))
+    return bpe_gdf, iris_gdf
+
+
+def build_region(region: dict, output_dir: Path = REGIONS_DIR) -> dict:
+    """
+    Construit et enregistre la carte d'une région
+
+    Returns:
+        Résumé : nom, fichier, nombres d'équipements et d'IRIS, durée (s)
+    """
+    start = time.perf_counter()
+    bpe_gdf, iris_gdf = region_data(region)
+    if iris_gdf.empty:
+        raise ValueError(f"Region {region['name']!r}: no IRIS found")
+
+    counts = access = None
+    if CHOROPLETH_COLUMN is not None:
+        counts = category_counts(attach_iris(bpe_gdf.copy(), iris_gdf), iris_gdf['code_iris'])
+    if ACCESS_MAP_CATEGORY is not None:
+        equipments = equipment_coordinates(bpe_gdf.dropna(subset=['LAMBERT_X', 'LAMBERT_Y']))
+        access = iris_accessibility(iris_gdf, equipments).set_index('code_iris')
+
+    # Density images next to the map (<nom>-density/)
+    density = f"{region['name']}-density"
+    m = build_map(simplify_levels(iris_gdf), bpe_gdf, counts, access, fit_bounds=True,
+                  density_images=(density, Path(output_dir) / density))
+    path = Path(output_dir) / f"{region['name']}.html"
+    m.save(path)
+
+    return {
+        'name': region['name'],
+        'file': path.name,
+        'equipments': len(bpe_gdf),
+        'iris': len(iris_gdf),
+        'seconds': round(time.perf_counter() - start, 2),
+    }
+
+
+def run_batch(regions: list = REGIONS, workers: int = BATCH_WORKERS):
+    """
+    Construit la carte de chaque région dans un pool de processus
+
+    Les cartes sont écrites dans REGIONS_DIR (<nom>.html), avec un index
+    REGIONS_INDEX_PATH récapitulant les régions produites. Une région en
+    erreur n'interrompt pas les autres ; l'exception est levée à la fin.
+    """
+    try:
+        validate_regions(regions)
+        REGIONS_DIR.mkdir(parents=True, exist_ok=True)
+
+        start = time.perf_counter()
+        results, failed = {}, []
+        with ProcessPoolExecutor(max_workers=workers, initializer=open_national) as executor:
+            futures = {executor.submit(build_region, region): region['name'] for region in regions}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    logger.error(f"Region {name!r} failed: {e}")
+                    failed.append(name)
+                    continue
+                logger.info(f"Region {name!r}: {results[name]['equipments']:,} equipments, "
+                            f"{results[name]['iris']:,} IRIS ({results[name]['seconds']:.1f}s)")
+
+        index = [results[region['name']] for region in regions if region['name'] in results]
+        with open(REGIONS_INDEX_PATH, 'w', encoding='utf-8') as f:
+            json.dump({'regions': index}, f, ensure_ascii=False, indent=2)
+        logger.info(f"{len(index)} regional maps built in {time.perf_counter() - start:.1f}s: {REGIONS_DIR}")
+
+        if failed:
+            raise RuntimeError(f"Regions failed: {', '.join(failed)}")
+
+    except Exception as e:
+        logger.info(f"Erreur lors de la construction des cartes régionales : {e}")
+        raise
@@ -0,0 +1,343 @@
+"""
+Export de la carte en dossier autonome (--bundle)
+
+Le dossier contient une page HTML réduite à la structure de la carte, les
+bibliothèques de `offline_assets` (au lieu des CDN) et un fichier de
+données par couche, précompressé :
+
+    bundle/
+    ├── index.html
+    ├── assets/                 # Leaflet, MarkerCluster, Bootstrap...
+    └── data/
+        ├── <couche>.json.gz    # chargé par fetch + DecompressionStream
+        └── <couche>.js         # repli sans serveur (file://)
+
+Les données d'une couche ne sont téléchargées qu'à son premier affichage
+(cochée dans le contrôle des couches).
+
+La carte s'ouvre sans réseau : les légendes des échelles de couleurs sont
+des SVG statiques (au lieu du script d3 de branca), les marqueurs des
+épingles CSS (au lieu des images et polices d'icônes d'awesome-markers),
+et le fond de carte est celui de BUNDLE_BASEMAP (aucun par défaut).
+"""
+
+import gzip
+import html
+import json
+import logging
+import shutil
+from collections import OrderedDict
+from pathlib import Path
+
+import folium
+from branca.colormap import ColorMap, StepColormap
+from branca.element import Element, MacroElement
+from folium.elements import JSCSSMixin
+from folium.template import Template
+
+from config import BUNDLE_DIR, OFFLINE_ASSETS_DIR, BUNDLE_BASEMAP
+from utils.map_layers import BundledPayload
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Ressources folium (nom du lien) -> fichier de offline_assets
+OFFLINE_LINKS = {
+    'leaflet': 'js/leaflet.js',
+    'jquery': 'js/jquery.min.js',
+    'bootstrap': 'js/bootstrap.bundle.min.js',
+    'awesome_markers': 'js/leaflet.awesome-markers.js',
+    'markerclusterjs': 'js/leaflet.markercluster.js',
+    'leaflet_css': 'css/leaflet.css',
+    'bootstrap_css': 'css/bootstrap.min.css',
+    'glyphicons_css': 'css/bootstrap-glyphicons.css',
+    'awesome_markers_font_css': 'css/fontawesome.min.css',
+    'awesome_markers_css': 'css/leaflet.awesome-markers.css',
+    'awesome_rotate_css': 'css/leaflet.awesome.rotate.min.css',
+    'markerclustercss': 'css/MarkerCluster.css',
+    'markerclusterdefaultcss': 'css/MarkerCluster.Default.css',
+}
+
+# Feuilles de style inutiles hors ligne (polices et images d'icônes,
+# remplacées par OFFLINE_ICONS_JS)
+OFFLINE_DROPPED_LINKS = {'glyphicons_css', 'awesome_markers_font_css', 'awesome_markers_css'}
+
+# Couleurs des marqueurs awesome-markers
+MARKER_COLORS = {
+    'red': '#d63e2a', 'darkred': '#a23336', 'lightred': '#ff8e7f', 'orange': '#f69730',
+    'beige': '#ffcb92', 'green': '#72b026', 'darkgreen': '#728224', 'lightgreen': '#bbf970',
+    'blue': '#38aadd', 'darkblue': '#0067a3', 'lightblue': '#8adaff', 'purple': '#d252b9',
+    'darkpurple': '#5b396b', 'pink': '#ff91ea', 'cadetblue': '#436978', 'white': '#fbfbfb',
+    'gray': '#575757', 'lightgray': '#a3a3a3', 'black': '#303030',
+}
+
+# Marqueurs sans police ni image : L.AwesomeMarkers.icon crée une épingle CSS
+OFFLINE_ICONS_CSS = """
+<style>
+.mobitic-pin span {
+    display: block; width: 22px; height: 22px; margin: 1px 0 0 1px;
+    border-radius: 50% 50% 50% 0; transform: rotate(-45deg);
+    border: 2px solid white; box-shadow: 0 0 3px rgba(0, 0, 0, 0.6);
+}
+.leaflet-container { background: #f2efe9; }
+</style>
+"""
+OFFLINE_ICONS_JS = """
+L.AwesomeMarkers.icon = function(options) {
+    var colors = %s;
+    var color = colors[options.markerColor] || options.markerColor || colors.blue;
+    return L.divIcon({
+        className: 'mobitic-pin',
+        html: '<span style="background:' + color + '"></span>',
+        iconSize: [24, 32], iconAnchor: [12, 32], popupAnchor: [0, -28]
+    });
+};
+"""
+
+# Niveau de compression gzip des données : les niveaux supérieurs gagnent
+# peu en taille pour un temps d'écriture bien plus long
+PAYLOAD_GZIP_LEVEL = 6
+
+# Chargement des fichiers de données (voir map_layers.LOAD_PAYLOAD_JS)
+BUNDLE_LOADER_JS = """
+var mobiticBundle = (function() {
+    var pending = {}, loaded = {};
+
+    function fromScript(name) {
+        return new Promise(function(resolve, reject) {
+            pending[name] = resolve;
+            var script = document.createElement('script');
+            script.src = 'data/' + name + '.js';
+            script.onerror = reject;
+            document.head.appendChild(script);
+        });
+    }
+
+    function fromGzip(name) {
+        return fetch('data/' + name + '.json.gz').then(function(response) {
+            if (!response.ok) throw new Error(response.status);
+            return new Response(response.body.pipeThrough(new DecompressionStream('gzip'))).json();
+        });
+    }
+
+    function load(name) {
+        if (!loaded[name]) {
+            loaded[name] = location.protocol !== 'file:' && window.DecompressionStream
+                ? fromGzip(name).catch(function() { return fromScript(name); })
+                : fromScript(name);
+        }
+        return loaded[name];
+    }
+
+    return {
+        load: load,
+        resolve: function(name, data) {
+            pending[name](data);
+            delete pending[name];
+        },
+        onShow: function(layer, map, name, callback) {
+            var started = false;
+            function start() {
+                if (started) return;
+                started = true;
+                load(name).then(callback);
+            }
+            if (map.hasLayer(layer)) start(); else layer.on('add', start);
+        }
+    };
+})();
+"""
+
+
+def _walk(element):
+    yield element
+    for child in element._children.values():
+        yield from _walk(child)
+
+
+def localize_links(m: folium.Map, prefix: str = 'assets'):
+    """
+    Remplace les liens CDN des éléments de la carte par les fichiers
+    locaux et retire ceux inutiles hors ligne (OFFLINE_DROPPED_LINKS)
+    """
+    for element in _walk(m):
+        if isinstance(element, JSCSSMixin):
+            # Listes redéfinies sur l'instance : celles de la classe sont partagées
+            element.default_js = [(name, f"{prefix}/{OFFLINE_LINKS[name]}" if name in OFFLINE_LINKS else url)
+                                  for name, url in element.default_js if name not in OFFLINE_DROPPED_LINKS]
+            element.default_css = [(name, f"{prefix}/{OFFLINE_LINKS[name]}" if name in OFFLINE_LINKS else url)
+                                   for name, url in element.default_css if name not in OFFLINE_DROPPED_LINKS]
+
+
+def remote_links(m: folium.Map) -> list:
+    """Liens réseau (http, https) restant dans les éléments de la carte"""
+    links = []
+    for element in _walk(m):
+        if isinstance(element, JSCSSMixin):
+            links += [url for _, url in element.default_js + element.default_css if '//' in url]
+        if isinstance(element, folium.TileLayer) and '//' in element.tiles:
+            links.append(element.tiles)
+    return links
+
+
+def legend_svg(colormap: ColorMap, width: int = 300) -> str:
+    """Légende SVG statique d'une échelle de couleurs (pas de script d3)"""
+    vmin, vmax = colormap.vmin, colormap.vmax
+
+    def x(value):
+        return round((value - vmin) / (vmax - vmin) * width, 1) if vmax > vmin else 0
+
+    if isinstance(colormap, StepColormap):
+        ticks = colormap.index
+        bar = ''.join(f'<rect x="{x(ticks[i])}" y="16" width="{x(ticks[i + 1]) - x(ticks[i])}" '
+                      f'height="10" fill="{colormap.rgb_hex_str(ticks[i])}"/>'
+                      for i in range(len(ticks) - 1))
+    else:
+        ticks = [vmin, vmax]
+        stops = ''.join(f'<stop offset="{x(value) / width:.3f}" stop-color="{colormap.rgb_hex_str(value)}"/>'
+                        for value in colormap.index)
+        # Identifiant propre à l'échelle : plusieurs légendes dans la page
+        gradient = colormap.get_name()
+        bar = (f'<defs><linearGradient id="{gradient}">{stops}</linearGradient></defs>'
+               f'<rect x="0" y="16" width="{width}" height="10" fill="url(#{gradient})"/>')
+
+    labels = ''.join(f'<text x="{min(max(x(value), 8), width - 8)}" y="38" text-anchor="middle">{value:g}</text>'
+                     for value in ticks)
+    caption = f'<text x="0" y="11">{html.escape(colormap.caption)}</text>' if colormap.caption else ''
+    return (f'<svg width="{width}" height="42" style="font: 11px sans-serif; overflow: visible">'
+            f'{caption}{bar}{labels}</svg>')
+
+
+class StaticLegend(MacroElement):
+    """Légende d'une échelle de couleurs, en SVG statique, dans un contrôle Leaflet"""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.control({position: 'topright'});
+            {{ this.get_name() }}.onAdd = function() {
+                var div = L.DomUtil.create('div');
+                div.style.cssText = 'background: rgba(255, 255, 255, 0.8); padding: 4px 8px;';
+                div.innerHTML = {{ this.svg|tojson }};
+                return div;
+            };
+            {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+    """)
+
+    def __init__(self, colormap: ColorMap):
+        super().__init__()
+        self._name = 'StaticLegend'
+        self.svg = legend_svg(colormap)
+
+
+def offline_legends(m: folium.Map) -> int:
+    """Remplace les légendes branca (d3 chargé depuis un CDN) par des SVG statiques"""
+    replaced = 0
+    for element in list(_walk(m)):
+        if isinstance(element, ColorMap) and element._parent is not None:
+            parent = element._parent
+            parent._children = OrderedDict(
+                (name, StaticLegend(child) if child is element else child)
+                for name, child in parent._children.items())
+            for child in parent._children.values():
+                child._parent = parent
+            replaced += 1
+    return replaced
+
+
+def offline_basemap(m: folium.Map, bundle_dir: Path, basemap=BUNDLE_BASEMAP):
+    """
+    Remplace les fonds de carte en ligne de `m` par `basemap`
+
+    Args:
+        basemap: None (aucun fond), dossier de tuiles z/x/y.png (copié
+            dans `bundle_dir`/basemap) ou URL de tuiles (conservée en ligne)
+    """
+    for element in list(_walk(m)):
+        if isinstance(element, folium.TileLayer) and not element.overlay and '//' in element.tiles:
+            element._parent._children = OrderedDict(
+                (name, child) for name, child in element._parent._children.items() if child is not element)
+
+    if basemap is None:
+        logger.info("Bundle without basemap (BUNDLE_BASEMAP)")
+        return
+    if '//' in str(basemap):
+        folium.TileLayer(str(basemap), attr='Fond de carte', name='Fond de carte').add_to(m)
+        return
+
+    target = bundle_dir / 'basemap'
+    shutil.rmtree(target, ignore_errors=True)
+    shutil.copytree(basemap, target)
+    zooms = sorted(int(path.name) for path in target.iterdir() if path.name.isdigit())
+    if not zooms:
+        raise FileNotFoundError(f"No z/x/y tiles in basemap directory {basemap}")
+    folium.TileLayer('basemap/{z}/{x}/{y}.png', attr='Fond de carte local', name='Fond de carte',
+                     min_native_zoom=zooms[0], max_native_zoom=zooms[-1]).add_to(m)
+    logger.info(f"Local basemap copied: {target} (zooms {zooms[0]}-{zooms[-1]})")
+
+
+def write_payload(data_dir: Path, name: str, payload) -> int:
+    """
+    Écrit les fichiers de données d'une couche
+
+    Returns:
+        Taille du fichier .json.gz (octets)
+    """
+    text = json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+    raw = text.encode('utf-8')
+
+    compressed = gzip.compress(raw, compresslevel=PAYLOAD_GZIP_LEVEL)
+    (data_dir / f"{name}.json.gz").write_bytes(compressed)
+    (data_dir / f"{name}.js").write_text(f"mobiticBundle.resolve({json.dumps(name)}, {text});\n",
+                                         encoding='utf-8')
+    return len(compressed)
+
+
+def write_bundle(m: folium.Map, bundle_dir: Path = BUNDLE_DIR) -> Path:
+    """
+    Écrit la carte `m` sous forme de dossier autonome
+
+    Returns:
+        Chemin de la page index.html
+    """
+    bundle_dir = Path(bundle_dir)
+    data_dir = bundle_dir / 'data'
+    shutil.rmtree(data_dir, ignore_errors=True)
+    data_dir.mkdir(parents=True)
+
+    assets_dir = bundle_dir / 'assets'
+    shutil.copytree(OFFLINE_ASSETS_DIR, assets_dir, dirs_exist_ok=True)
+    # Leaflet cherche ses images dans css/images
+    shutil.copytree(OFFLINE_ASSETS_DIR / 'images', assets_dir / 'css' / 'images', dirs_exist_ok=True)
+    localize_links(m)
+    offline_legends(m)
+    offline_basemap(m, bundle_dir)
+    for link in remote_links(m):
+        logger.warning(f"Bundle still loads a network resource: {link}")
+
+    elements = [element for element in _walk(m) if isinstance(element, BundledPayload)]
+    total = 0
+    with span('payload write', cat='io', layers=len(elements)) as s:
+        for element in elements:
+            if getattr(element, 'source', None) is None:
+                element.bundle_name = element.get_name()
+                total += write_payload(data_dir, element.bundle_name, element.payload)
+        s.set(bytes=total)
+    for element in elements:
+        if getattr(element, 'source', None) is not None:
+            element.bundle_name = element.source.bundle_name
+
+    m.get_root().header.add_child(Element(f"<script>{BUNDLE_LOADER_JS}</script>"),
+                                  name='mobitic_bundle')
+    m.get_root().header.add_child(Element(OFFLINE_ICONS_CSS), name='mobitic_icons_css')
+    # En tête des scripts de la carte : avant la création des marqueurs
+    m.get_root().script.add_child(Element(OFFLINE_ICONS_JS % json.dumps(MARKER_COLORS)),
+                                  name='mobitic_icons', index=0)
+    index_path = bundle_dir / 'index.html'
+    with span('html save', cat='io') as s:
+        m.save(index_path)
+        s.set(bytes=index_path.stat().st_size)
+
+    logger.info(f"Bundle saved: {index_path} ({index_path.stat().st_size / 1024:,.0f} KB page, "
+                f"{len(elements)} layers, {total / 1024:,.0f} KB of compressed data)")
+    return index_path
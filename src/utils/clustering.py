@@ -0,0 +1,123 @@
+"""
+Regroupement hiérarchique des équipements par niveau de zoom
+
+Les points sont projetés en Web Mercator puis regroupés sur une grille
+dont la maille vaut CLUSTER_RADIUS pixels au zoom considéré. Chaque niveau
+est calculé à partir des groupes du niveau supérieur (pondérés par leurs
+effectifs) : un groupe au zoom z est exactement l'union de groupes du
+zoom z + 1.
+"""
+
+import logging
+
+import numpy as np
+
+from config import CLUSTER_MIN_ZOOM, CLUSTER_MAX_ZOOM, CLUSTER_RADIUS
+from utils.colocation import location_table
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256
+
+
+def lonlat_to_world(lon, lat) -> tuple:
+    """Coordonnées Web Mercator normalisées dans [0, 1] (vectorisé)"""
+    lat = np.clip(np.asarray(lat, dtype='float64'), -85.0511, 85.0511)
+    x = (np.asarray(lon, dtype='float64') + 180.0) / 360.0
+    y = (1.0 - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2.0
+    return x, y
+
+
+def world_to_lonlat(x, y) -> tuple:
+    """Inverse de lonlat_to_world"""
+    lon = np.asarray(x) * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1.0 - 2.0 * np.asarray(y)))))
+    return lon, lat
+
+
+def _merge_level(x: np.ndarray, y: np.ndarray, count: np.ndarray, size: np.ndarray,
+                 first: np.ndarray, zoom: int, radius: int) -> tuple:
+    """
+    Regroupe des centres pondérés sur la grille du zoom `zoom`
+
+    Returns:
+        (x, y, effectifs, nombre de points, indice du premier point) des
+        groupes, positionnés au barycentre pondéré de leurs membres
+    """
+    cells = 2 ** zoom * TILE_SIZE / radius
+    cx = np.floor(x * cells).astype('int64')
+    cy = np.floor(y * cells).astype('int64')
+    keys = cx * (int(cells) + 1) + cy
+
+    _, inverse = np.unique(keys, return_inverse=True)
+    total = np.bincount(inverse, weights=count)
+
+    merged_first = np.full(len(total), np.iinfo('int64').max)
+    np.minimum.at(merged_first, inverse, first)
+
+    return (np.bincount(inverse, weights=x * count) / total,
+            np.bincount(inverse, weights=y * count) / total,
+            total, np.bincount(inverse, weights=size), merged_first)
+
+
+def cluster_points(lon, lat, min_zoom: int = CLUSTER_MIN_ZOOM,
+                   max_zoom: int = CLUSTER_MAX_ZOOM, radius: int = CLUSTER_RADIUS,
+                   weights=None) -> dict:
+    """
+    Calcule les groupes de points pour chaque zoom de `min_zoom` à `max_zoom`
+
+    Args:
+        lon, lat: Coordonnées WGS84 des points
+        min_zoom, max_zoom: Niveaux de zoom à calculer
+        radius: Maille de la grille en pixels
+        weights: Effectif de chaque point (1 par défaut), par exemple le
+            nombre d'équipements d'un emplacement
+
+    Returns:
+        {zoom: {'lon', 'lat', 'count', 'point'}} où 'count' est la somme des
+        effectifs et 'point' l'indice du point d'un groupe réduit à un seul
+        point (-1 pour les autres)
+    """
+    x, y = lonlat_to_world(lon, lat)
+    size = np.ones(len(x), dtype='float64')
+    count = size if weights is None else np.asarray(weights, dtype='float64')
+    first = np.arange(len(x), dtype='int64')
+
+    levels = {}
+    for zoom in range(max_zoom, min_zoom - 1, -1):
+        if len(x):
+            x, y, count, size, first = _merge_level(x, y, count, size, first, zoom, radius)
+        level_lon, level_lat = world_to_lonlat(x, y)
+        levels[zoom] = {
+            'lon': level_lon,
+            'lat': level_lat,
+            'count': count.astype('int64'),
+            'point': np.where(size == 1, first, -1),
+        }
+
+    return levels
+
+
+def cluster_categories(bpe_gdf, min_zoom: int = CLUSTER_MIN_ZOOM,
+                       max_zoom: int = CLUSTER_MAX_ZOOM, radius: int = CLUSTER_RADIUS) -> dict:
+    """
+    Groupes par catégorie et par zoom des équipements d'un GeoDataFrame WGS84
+
+    Les équipements regroupés par emplacement (voir group_colocated) sont
+    répartis selon leur couche et comptent chacun dans l'effectif des groupes.
+
+    Returns:
+        {catégorie: {zoom: {'lon', 'lat', 'count', 'point'}}}, les indices
+        'point' étant relatifs aux emplacements de la catégorie
+        (voir location_table)
+    """
+    clusters = {}
+    for cat, points in bpe_gdf.groupby(bpe_gdf.get('layer', bpe_gdf['categorie']), observed=True):
+        locations, _ = location_table(points)
+        clusters[cat] = cluster_points(locations['lon'].to_numpy(), locations['lat'].to_numpy(),
+                                       min_zoom, max_zoom, radius, weights=locations['count'].to_numpy())
+
+    n_clusters = sum(len(level['count']) for levels in clusters.values() for level in levels.values())
+    logger.info(f"{n_clusters:,} clusters computed for {len(bpe_gdf):,} equipments "
+                f"(zooms {min_zoom}-{max_zoom})")
+    return clusters
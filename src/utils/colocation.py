@@ -0,0 +1,113 @@
+"""
+Regroupement des équipements situés au même endroit
+
+Une part importante des équipements BPE partage les mêmes coordonnées
+(praticiens d'un centre médical, commerces d'un centre commercial). Ils
+sont regroupés, de façon vectorisée, sur leurs coordonnées arrondies : la
+carte affiche un seul marqueur par emplacement, dont la popup liste tous
+les types d'équipements (TYPEQU) présents.
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+from config import MARKER_GROUPING, MARKER_GROUPING_DECIMALS
+
+logger = logging.getLogger(__name__)
+
+
+def location_ids(points, grouping: str = MARKER_GROUPING,
+                 decimals: int = MARKER_GROUPING_DECIMALS) -> np.ndarray:
+    """
+    Identifiant de l'emplacement de chaque équipement
+
+    Args:
+        points: GeoDataFrame WGS84 des équipements (colonne categorie)
+        grouping: 'category' (emplacement et catégorie), 'location'
+            (emplacement seul) ou None (un emplacement par équipement)
+        decimals: Décimales des coordonnées arrondies (5 ~ 1 m)
+
+    Returns:
+        Entiers de 0 au nombre d'emplacements - 1, dans l'ordre de première
+        apparition
+    """
+    if grouping is None:
+        return np.arange(len(points))
+    if grouping not in ('category', 'location'):
+        raise ValueError(f"Unknown marker grouping: {grouping}")
+
+    scale = 10 ** decimals
+    keys = {
+        'x': np.round(points.geometry.x.to_numpy() * scale),
+        'y': np.round(points.geometry.y.to_numpy() * scale),
+    }
+    if grouping == 'category':
+        keys['categorie'] = points['categorie'].array
+
+    frame = pd.DataFrame(keys)
+    return frame.groupby(list(keys), sort=False, observed=True, dropna=False).ngroup().to_numpy()
+
+
+def group_colocated(bpe_gdf, grouping: str = MARKER_GROUPING,
+                    decimals: int = MARKER_GROUPING_DECIMALS):
+    """
+    Ajoute à la BPE l'emplacement (`location`) et la couche (`layer`) de
+    chaque équipement
+
+    La couche est la catégorie de l'équipement ; avec le regroupement
+    'location', c'est la catégorie majoritaire de son emplacement, pour que
+    tous les équipements d'un emplacement soient dans la même couche.
+    """
+    ids = location_ids(bpe_gdf, grouping, decimals)
+    layer = bpe_gdf['categorie']
+
+    if grouping == 'location':
+        sizes = (pd.DataFrame({'location': ids, 'categorie': layer.array})
+                 .groupby(['location', 'categorie'], observed=True).size())
+        dominant = (sizes.sort_values(ascending=False, kind='stable').reset_index()
+                    .drop_duplicates('location').set_index('location')['categorie'])
+        layer = pd.Series(pd.Categorical(dominant.reindex(ids).to_numpy(),
+                                         categories=layer.cat.categories), index=bpe_gdf.index)
+
+    n_locations = int(ids.max()) + 1 if len(ids) else 0
+    logger.info(f"{len(bpe_gdf):,} equipments at {n_locations:,} locations (grouping: {grouping})")
+    return bpe_gdf.assign(location=ids, layer=layer)
+
+
+def location_table(points) -> tuple:
+    """
+    Emplacements d'un ensemble d'équipements et leur contenu
+
+    Sans colonne `location` (voir group_colocated), chaque équipement est
+    son propre emplacement.
+
+    Returns:
+        (locations, entries) : `locations` a une ligne par emplacement, dans
+        l'ordre de première apparition (lon, lat du premier équipement,
+        count, layer, DEPCOM si disponible) ; `entries` a une ligne par
+        emplacement, catégorie et TYPEQU (location, categorie, TYPEQU,
+        count), triée par emplacement
+    """
+    ids = points['location'].to_numpy() if 'location' in points.columns else np.arange(len(points))
+    codes, _ = pd.factorize(ids)
+    first = np.unique(codes, return_index=True)[1]
+
+    entries = (pd.DataFrame({'location': codes,
+                             'categorie': points['categorie'].array,
+                             'TYPEQU': points['TYPEQU'].to_numpy()})
+               .groupby(['location', 'categorie', 'TYPEQU'], observed=True, sort=True, dropna=False)
+               .size().rename('count').reset_index())
+
+    layer = points['layer'] if 'layer' in points.columns else points['categorie']
+    locations = pd.DataFrame({
+        'lon': points.geometry.x.to_numpy()[first],
+        'lat': points.geometry.y.to_numpy()[first],
+        'count': np.bincount(codes, minlength=len(first)),
+        'layer': layer.to_numpy()[first],
+    })
+    if 'DEPCOM' in points.columns:
+        locations['DEPCOM'] = points['DEPCOM'].to_numpy()[first]
+
+    return locations, entries
@@ -3,192 +3,573 @@ Script de téléchargement et préparation des données pour cartographie Lyon
 Base Permanente des Équipements (BPE) + Contours IRIS
 """
 
-import requests
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 from pathlib import Path
-import io
 from tqdm import tqdm
+import json
 import logging
+import os
+import struct
 import py7zr
+import pyogrio
 import tempfile
+import fastparquet
+from fastparquet.api import filter_row_groups
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+import pyproj
+import shapely
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
-from config import OUTPUT_DIR, DEPARTEMENTS, BPE_URL, IRIS_URL, CHUNK_SIZE, REQUEST_TIMEOUT, CRS_LAMBERT93, CRS_WGS84
+from config import DEPARTEMENTS, BPE_URL, IRIS_URL, CRS_LAMBERT93, CRS_WGS84
+from config import BPE_REMOTE_READ, BPE_COLUMNS, BPE_PATH, IRIS_PATH, BPE_GEO_PATH
+from config import IRIS_GEOJSON_PATH, BPE_GEOJSON_PATH, categorize
+from config import CATEGORIES, BPE_NATIONAL_PATH, IRIS_NATIONAL_PATH, GEO_BATCH_ROWS, GEO_WORKERS
+from utils.http_client import HTTPRangeFile, RangeNotSupported
+from utils.download_cache import get_cache, processing_key
+from utils.partitions import PartitionedDataset, partition_path
+from utils.tracing import span
 
 logger = logging.getLogger(__name__)
 
 
-def download_bpe():
-    try:
-        response = requests.get(BPE_URL, stream=True)
-        response.raise_for_status()
-        
-        total_size = int(response.headers.get('content-length', 0))
-        
-        content = io.BytesIO()
-        with tqdm(total=total_size, unit='B', unit_scale=True, desc="BPE") as pbar:
-            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
-                content.write(chunk)
-                pbar.update(len(chunk))
-        
-        content.seek(0)
-        bpe_df = pd.read_parquet(content)
-        
+def _bpe_columns(available: list) -> list:
+    """Colonnes BPE à lire parmi celles présentes dans le fichier"""
+    if BPE_COLUMNS is None:
+        return None
+    return [col for col in BPE_COLUMNS if col in available]
+
+
+def _read_bpe_remote(departements: list = DEPARTEMENTS) -> tuple:
+    """
+    Lit la BPE distante de `departements` en ne transférant que les groupes
+    de lignes et les colonnes utiles (pied de page parquet lu par requêtes Range)
+
+    Returns:
+        (DataFrame filtré, en-têtes HTTP du fichier distant)
+
+    Raises:
+        RangeNotSupported: Si le serveur ne gère pas les requêtes Range
+    """
+    with HTTPRangeFile(BPE_URL) as remote:
+        pf = fastparquet.ParquetFile(remote)
+        columns = _bpe_columns(pf.columns)
+        logger.info(f"BPE remote file: {remote.size:,} bytes, "
+                    f"{len(pf.row_groups)} row groups, {pf.count():,} rows")
+
+        with span('row group selection', row_groups=len(pf.row_groups)) as s:
+            # 1) Élagage par les statistiques min/max de DEP
+            candidates = filter_row_groups(pf, [('DEP', 'in', departements)], as_idx=True)
+
+            # 2) Vérification sur la seule colonne DEP (quelques octets par ligne)
+            #    lorsque les statistiques ne suffisent pas à trancher
+            selected = []
+            for idx in tqdm(candidates, desc="BPE row groups", unit='rg'):
+                deps = pf[idx].to_pandas(columns=['DEP'])['DEP']
+                if deps.isin(departements).any():
+                    selected.append(idx)
+            s.set(selected=len(selected))
+
+        logger.info(f"{len(selected)}/{len(pf.row_groups)} row groups selected "
+                    f"for {', '.join(departements)}")
+
+        # Filtrage groupe par groupe : la mémoire reste à l'échelle de la région
+        parts = []
+        with span('filter', row_groups=len(selected)) as s:
+            for idx in selected:
+                part = pf[idx].to_pandas(columns=columns)
+                parts.append(part[part['DEP'].isin(departements)])
+            s.set(rows=sum(len(part) for part in parts))
+
+        logger.info(f"BPE transferred: {remote.bytes_transferred:,} bytes "
+                    f"in {remote.requests_count} requests")
+
+    if not parts:
+        return pd.DataFrame(columns=columns or pf.columns), remote.headers
+    return pd.concat(parts, ignore_index=True), remote.headers
+
+
+def _read_bpe_local(path: Path, departements: list = DEPARTEMENTS) -> pd.DataFrame:
+    """Lit la BPE nationale depuis le cache local puis filtre sur `departements`"""
+    with span('filter', cat='io', bytes=path.stat().st_size) as s:
+        pf = fastparquet.ParquetFile(str(path))
+        bpe_df = pf.to_pandas(columns=_bpe_columns(pf.columns),
+                              filters=[('DEP', 'in', departements)])
+
         logger.info(f"{len(bpe_df):,} equipements loaded")
-        
-        bpe_lyon = bpe_df[bpe_df['DEP'].isin(DEPARTEMENTS)].copy()
 
-        logger.info(f"{len(bpe_lyon):,} equipments in {', '.join(DEPARTEMENTS)}")
+        bpe_df = bpe_df[bpe_df['DEP'].isin(departements)]
+        s.set(rows=len(bpe_df))
+    return bpe_df
+
+
+def _stale_partitions(dataset: PartitionedDataset, artifact, key: str, force: bool) -> list:
+    """
+    Départements de DEPARTEMENTS à (re)construire : tous si `force` ou si la
+    source a changé sans version identifiable, sinon ceux dont la partition
+    manque ou a été produite avec une autre clé
+    """
+    if force or (artifact.changed and not artifact.version):
+        return list(DEPARTEMENTS)
+    return dataset.stale(DEPARTEMENTS, key)
+
+
+def download_bpe(force: bool = False):
+    """
+    Met à jour les partitions BPE (BPE_PATH) des départements de DEPARTEMENTS
+
+    Seuls les départements sans partition à jour pour la version courante
+    de la source sont lus (et transférés, en lecture distante).
+    """
+    try:
+        cache = get_cache()
+        dataset = PartitionedDataset(BPE_PATH)
+
+        # Revalidation : HEAD en lecture distante, GET conditionnel sinon.
+        # Le fichier est local si le serveur refuse HEAD ou s'il est déjà
+        # en cache (téléchargé par download_national) : pas de lecture distante
+        if BPE_REMOTE_READ:
+            artifact = cache.revalidate(BPE_URL, desc="BPE")
+        else:
+            artifact = cache.fetch(BPE_URL, desc="BPE")
+
+        key = processing_key(artifact.version, BPE_COLUMNS)
+        missing = _stale_partitions(dataset, artifact, key, force)
+        if not missing:
+            logger.info(f"BPE partitions up to date for {', '.join(DEPARTEMENTS)}: {BPE_PATH}")
+            return
+        logger.info(f"BPE partitions to build: {', '.join(missing)}")
 
-        bpe_lyon_path = OUTPUT_DIR / "bpe_lyon.parquet"
-        bpe_lyon.to_parquet(bpe_lyon_path, index=False)
-        logger.info(f"Data saved: {bpe_lyon_path}")
+        if BPE_REMOTE_READ and artifact.path is None:
+            try:
+                bpe_df, headers = _read_bpe_remote(missing)
+                cache.remember(BPE_URL, headers)
+            except RangeNotSupported as e:
+                logger.info(f"Range requests not supported ({e}), full download")
+                artifact = cache.fetch(BPE_URL, desc="BPE")
+                key = processing_key(artifact.version, BPE_COLUMNS)
+                bpe_df = _read_bpe_local(artifact.path, missing)
+        else:
+            bpe_df = _read_bpe_local(artifact.path, missing)
+
+        logger.info(f"{len(bpe_df):,} equipments in {', '.join(missing)}")
+
+        dataset.write_many(bpe_df, bpe_df['DEP'], missing, key, artifact.version)
+        logger.info(f"Data saved: {BPE_PATH}")
         
     except Exception as e:
         logger.info(f"Error during the loading of BPE datas : {e}")
         raise
 
 
-def download_IRIS():
-    try:
-        response = requests.get(IRIS_URL, stream=True, timeout=REQUEST_TIMEOUT)
-        response.raise_for_status()
+SHAPEFILE_SIDECARS = ('.shp', '.shx', '.dbf', '.prj', '.cpg')
+
+
+def _shapefile_members(names: list) -> dict:
+    """
+    Regroupe les membres d'une archive par shapefile
+
+    Returns:
+        {chemin sans extension: {extension: membre}} pour les shapefiles
+        disposant au moins d'un .shp et d'un .dbf
+    """
+    shapefiles = {}
+    for name in names:
+        stem, ext = os.path.splitext(name)
+        if ext.lower() in SHAPEFILE_SIDECARS:
+            shapefiles.setdefault(stem, {})[ext.lower()] = name
+
+    return {stem: members for stem, members in shapefiles.items()
+            if '.shp' in members and '.dbf' in members}
+
+
+def _extract_members(archive_path: Path, targets: list, dest: Path):
+    """Extrait uniquement `targets` de l'archive 7z vers `dest`"""
+    with span('7z extraction', cat='io', members=len(targets)) as s:
+        with py7zr.SevenZipFile(archive_path, mode='r') as archive:
+            archive.extract(path=dest, targets=targets)
+        s.set(bytes=sum((dest / target).stat().st_size for target in targets if (dest / target).is_file()))
+
+
+def _record_count(root: Path, members: dict) -> int:
+    """
+    Nombre d'enregistrements d'un shapefile lu dans l'en-tête de son index
+    .shx (longueur du fichier en mots de 16 bits, octets 24-27 big-endian)
+    ou, à défaut, de son .dbf (octets 4-7 little-endian)
+    """
+    if '.shx' in members:
+        with open(root / members['.shx'], 'rb') as f:
+            header = f.read(100)
+        file_length = struct.unpack('>i', header[24:28])[0] * 2
+        return (file_length - 100) // 8
+
+    with open(root / members['.dbf'], 'rb') as f:
+        header = f.read(8)
+    return struct.unpack('<I', header[4:8])[0]
+
+
+def read_iris_archive(archive_path: Path, departements: list = DEPARTEMENTS) -> gpd.GeoDataFrame:
+    """
+    Lit les contours IRIS du shapefile le plus complet de l'archive 7z
+
+    Args:
+        archive_path: Archive des contours IRIS
+        departements: Départements conservés (None = France entière)
+
+    Returns:
+        GeoDataFrame WGS84
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_path = Path(temp_dir)
         
-        total_size = int(response.headers.get('content-length', 0))
+        logger.info("Recherche de fichiers géospatiaux dans l'archive...")
+
+        # Inventaire de l'archive sans rien décompresser
+        with py7zr.SevenZipFile(archive_path, mode='r') as archive:
+            shapefiles = _shapefile_members(archive.getnames())
         
-        archive_content = io.BytesIO()
-        with tqdm(total=total_size, unit='B', unit_scale=True, desc="IRIS") as pbar:
-            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
-                archive_content.write(chunk)
-                pbar.update(len(chunk))
+        logger.info(f"Trouvé {len(shapefiles)} fichier(s) .shp:")
+
+        # Classement des candidats par nombre d'enregistrements lu dans
+        # l'en-tête .shx (ou .dbf) : seuls ces petits fichiers sont extraits
+        headers = [members.get('.shx') or members['.dbf'] for members in shapefiles.values()]
+        _extract_members(archive_path, headers, temp_path)
+
+        best_file = None
+        max_features = 0
+
+        for stem, members in shapefiles.items():
+            try:
+                n_features = _record_count(temp_path, members)
+                logger.info(f"  - {members['.shp']}: {n_features} features")
+
+                # Garder le fichier avec le plus de features
+                if n_features > max_features:
+                    max_features = n_features
+                    best_file = stem
+            
+            except Exception as e:
+                logger.warning(f"  - {members['.shp']}: Erreur lecture ({e})")
         
-        archive_content.seek(0)
+        if not best_file:
+            raise Exception("Aucun fichier shapefile valide trouvé")
         
-        with tempfile.TemporaryDirectory() as temp_dir:
-            temp_path = Path(temp_dir)
-            
-            with py7zr.SevenZipFile(archive_content, mode='r') as archive:
-                archive.extractall(path=temp_path)
-            
-            logger.info("Recherche de fichiers géospatiaux dans l'archive...")
-            
-            # ✅ MODIFICATION : Chercher TOUS les shapefiles (y compris sous-dossiers)
-            shp_files = list(temp_path.rglob("*.shp"))
-            
-            logger.info(f"Trouvé {len(shp_files)} fichier(s) .shp:")
-            
-            # Analyser chaque shapefile pour trouver celui avec le plus d'IRIS
-            best_file = None
-            max_features = 0
-            
-            for shp_file in shp_files:
-                # Lire juste le nombre de features (rapide)
-                try:
-                    gdf_test = gpd.read_file(shp_file)
-                    n_features = len(gdf_test)
-                    
-                    # Afficher pour debug
-                    logger.info(f"  - {shp_file.relative_to(temp_path)}: {n_features} features")
-                    
-                    # Garder le fichier avec le plus de features
-                    if n_features > max_features:
-                        max_features = n_features
-                        best_file = shp_file
-                    
-                    del gdf_test  # Libérer la mémoire
-                    
-                except Exception as e:
-                    logger.warning(f"  - {shp_file.name}: Erreur lecture ({e})")
-            
-            if not best_file:
-                raise Exception("Aucun fichier shapefile valide trouvé")
-            
-            logger.info(f"✅ Fichier sélectionné : {best_file.relative_to(temp_path)} ({max_features:,} features)")
-            
-            # Charger le meilleur fichier
-            logger.info("Lecture du fichier SHP...")
-            iris_gdf = gpd.read_file(best_file)
-            logger.info(f"✅ {len(iris_gdf):,} IRIS chargés")
-            
-            # Afficher le CRS pour vérification
-            logger.info(f"CRS : {iris_gdf.crs}")
-            
-            # Reprojeter en WGS84
-            if iris_gdf.crs and iris_gdf.crs != CRS_WGS84:
-                logger.info("Reprojection en WGS84...")
-                iris_gdf = iris_gdf.to_crs(CRS_WGS84)
-                logger.info("✅ Reprojection terminée")
-            
-            # Trouver la colonne code IRIS
-            possible_code_cols = ['code_iris', 'CODE_IRIS', 'DCOMIRIS', 'IRIS']
-            code_col = None
-            
-            for col in possible_code_cols:
-                if col in iris_gdf.columns:
-                    code_col = col
-                    logger.info(f"Colonne code IRIS trouvée : {code_col}")
-                    break
-            
-            if not code_col:
-                logger.warning(f"Colonnes disponibles : {list(iris_gdf.columns)}")
-                raise Exception(f"Impossible de trouver la colonne code IRIS")
-            
-            # ✅ DEBUG : Afficher quelques codes IRIS pour vérifier
-            sample_codes = iris_gdf[code_col].head(10).tolist()
-            logger.info(f"Exemples de codes IRIS : {sample_codes}")
-            
-            # Filtrer sur les départements
+        logger.info(f"✅ Fichier sélectionné : {shapefiles[best_file]['.shp']} ({max_features:,} features)")
+
+        # Extraction des seuls fichiers compagnons du shapefile retenu
+        _extract_members(archive_path, list(shapefiles[best_file].values()), temp_path)
+        
+        shp_path = temp_path / shapefiles[best_file]['.shp']
+        info = pyogrio.read_info(shp_path)
+
+        # Afficher le CRS pour vérification
+        logger.info(f"CRS : {info['crs']}")
+        
+        # Trouver la colonne code IRIS (en-tête .dbf uniquement)
+        possible_code_cols = ['code_iris', 'CODE_IRIS', 'DCOMIRIS', 'IRIS']
+        code_col = None
+        
+        for col in possible_code_cols:
+            if col in info['fields']:
+                code_col = col
+                logger.info(f"Colonne code IRIS trouvée : {code_col}")
+                break
+        
+        if not code_col:
+            logger.warning(f"Colonnes disponibles : {list(info['fields'])}")
+            raise Exception(f"Impossible de trouver la colonne code IRIS")
+
+        # Charger uniquement les IRIS des départements : le filtre attributaire
+        # est évalué par GDAL pendant la lecture (lecteur Arrow)
+        logger.info("Lecture du fichier SHP...")
+        where = None
+        if departements is not None:
+            where = " OR ".join(f"\"{code_col}\" LIKE '{dep}%'" for dep in departements)
+        with span('shapefile read', cat='io', bytes=shp_path.stat().st_size) as s:
+            iris_gdf = gpd.read_file(shp_path, engine='pyogrio', use_arrow=True, where=where)
+            s.set(rows=len(iris_gdf))
+        logger.info(f"✅ {len(iris_gdf):,} IRIS chargés (sur {info['features']:,})")
+        
+        # ✅ DEBUG : Afficher quelques codes IRIS pour vérifier
+        sample_codes = iris_gdf[code_col].head(10).tolist()
+        logger.info(f"Exemples de codes IRIS : {sample_codes}")
+        
+        # Filtrer sur les départements
+        iris_lyon = iris_gdf
+        if departements is not None:
             iris_gdf['dep'] = iris_gdf[code_col].astype(str).str[:2]
-            
-            # ✅ DEBUG : Afficher tous les départements présents
-            deps_present = sorted(iris_gdf['dep'].unique())
-            logger.info(f"Départements présents dans le fichier ({len(deps_present)}): {deps_present[:20]}...")  # Premiers 20
-            
-            iris_lyon = iris_gdf[iris_gdf['dep'].isin(DEPARTEMENTS)].copy()
-            logger.info(f"✅ {len(iris_lyon):,} IRIS dans les départements {', '.join(DEPARTEMENTS)}")
-            
+
+            with span('filter', rows=len(iris_gdf)):
+                iris_lyon = iris_gdf[iris_gdf['dep'].isin(departements)].copy()
+            logger.info(f"✅ {len(iris_lyon):,} IRIS dans les départements {', '.join(departements)}")
+
             # ✅ VÉRIFICATION : Si 0 IRIS trouvés, il y a un problème
             if len(iris_lyon) == 0:
-                logger.error(f"❌ AUCUN IRIS trouvé pour les départements {DEPARTEMENTS}")
+                # Diagnostic : relire la seule colonne code, sans géométries
+                codes = pyogrio.read_dataframe(shp_path, columns=[code_col], read_geometry=False)
+                deps_present = sorted(codes[code_col].astype(str).str[:2].unique())
+                logger.error(f"❌ AUCUN IRIS trouvé pour les départements {departements}")
                 logger.error(f"Départements disponibles : {deps_present}")
-                raise Exception(f"Aucun IRIS trouvé pour les départements {DEPARTEMENTS}")
-            
-            # Sauvegarder en GeoJSON
-            iris_lyon_path = OUTPUT_DIR / "iris_lyon.geojson"
-            iris_lyon.to_file(iris_lyon_path, driver='GeoJSON')
-            logger.info(f"✅ IRIS sauvegardés : {iris_lyon_path}")
-            
-            return iris_lyon
+                raise Exception(f"Aucun IRIS trouvé pour les départements {departements}")
+
+        # Reprojeter en WGS84 les seuls IRIS retenus
+        if iris_lyon.crs and iris_lyon.crs != CRS_WGS84:
+            logger.info("Reprojection en WGS84...")
+            with span('reprojection', rows=len(iris_lyon)):
+                iris_lyon = iris_lyon.to_crs(CRS_WGS84)
+            logger.info("✅ Reprojection terminée")
+
+        return iris_lyon
+
+
+def download_IRIS(force: bool = False):
+    """Met à jour les partitions IRIS (IRIS_PATH) des départements de DEPARTEMENTS"""
+    try:
+        cache = get_cache()
+        dataset = PartitionedDataset(IRIS_PATH)
+        artifact = cache.fetch(IRIS_URL, desc="IRIS")
+
+        key = processing_key(artifact.version)
+        missing = _stale_partitions(dataset, artifact, key, force)
+        if not missing:
+            logger.info(f"IRIS partitions up to date for {', '.join(DEPARTEMENTS)}: {IRIS_PATH}")
+            return None
+        logger.info(f"IRIS partitions to build: {', '.join(missing)}")
+
+        iris_gdf = read_iris_archive(artifact.path, missing)
+
+        # Sauvegarder en GeoParquet, une partition par département
+        dataset.write_many(iris_gdf, iris_gdf['dep'], missing, key, artifact.version)
+        logger.info(f"✅ IRIS sauvegardés : {IRIS_PATH}")
+
+        return iris_gdf
         
     except Exception as e:
         logger.error(f"❌ Erreur lors du téléchargement des IRIS : {e}")
         raise
 
-def geodataframe():
+# Colonnes BPE des données nationales : EPCI en plus, pour les régions
+# définies par EPCI (--batch)
+NATIONAL_BPE_EXTRA_COLUMNS = ['EPCI']
+
+# Projections des coordonnées BPE des DOM (Lambert 93 en métropole)
+BPE_DOM_CRS = {
+    '971': 'EPSG:5490',  # Guadeloupe (UTM 20N)
+    '972': 'EPSG:5490',  # Martinique (UTM 20N)
+    '973': 'EPSG:2972',  # Guyane (UTM 22N)
+    '974': 'EPSG:2975',  # La Réunion (UTM 40S)
+    '976': 'EPSG:4471',  # Mayotte (UTM 38S)
+}
+
+# Clé des métadonnées Arrow mémorisant la version source d'un fichier national
+NATIONAL_SOURCE_KEY = b'mobitic_source'
+
+
+def _national_source(path: Path) -> str:
+    """Version source enregistrée dans un fichier national (None si absent)"""
+    if not path.exists():
+        return None
+    with pa.memory_map(str(path)) as source:
+        metadata = pa.ipc.open_file(source).schema.metadata or {}
+    return metadata.get(NATIONAL_SOURCE_KEY, b'').decode() or None
+
+
+def _write_national(table: pa.Table, path: Path, key: str):
+    """Écrit une table en Arrow IPC non compressé (lisible par mmap sans copie)"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), NATIONAL_SOURCE_KEY: key.encode()})
+    tmp = path.with_suffix('.tmp')
+    with span('arrow write', cat='io', rows=table.num_rows, bytes=table.nbytes):
+        feather.write_feather(table, tmp, compression='uncompressed')
+    os.replace(tmp, path)
+    logger.info(f"Données nationales sauvegardées : {path} ({path.stat().st_size / 1024 ** 2:,.0f} Mo)")
+
+
+@lru_cache(maxsize=None)
+def _transformer(crs: str) -> pyproj.Transformer:
+    """Transformation `crs` -> WGS84 (x = longitude), construite une seule fois par projection"""
+    return pyproj.Transformer.from_crs(crs, CRS_WGS84, always_xy=True)
+
+
+def _bpe_lonlat(bpe_df: pd.DataFrame) -> tuple:
+    """Longitudes et latitudes WGS84 des équipements (Lambert 93, UTM pour les DOM)"""
+    lon = np.full(len(bpe_df), np.nan)
+    lat = np.full(len(bpe_df), np.nan)
+    dom = bpe_df['DEP'].astype(str).map(BPE_DOM_CRS).fillna(CRS_LAMBERT93).to_numpy()
+    for crs in pd.unique(dom):
+        rows = dom == crs
+        lon[rows], lat[rows] = _transformer(crs).transform(bpe_df['LAMBERT_X'].to_numpy(float)[rows],
+                                                           bpe_df['LAMBERT_Y'].to_numpy(float)[rows])
+    return lon, lat
+
+
+def download_national(force: bool = False):
+    """
+    Prépare la BPE et les contours IRIS de toute la France pour --batch
+
+    Les fichiers BPE_NATIONAL_PATH (coordonnées Lambert 93 et WGS84 en
+    colonnes, catégorie) et IRIS_NATIONAL_PATH (géométries WKB) ne sont
+    réécrits que si la source ou les paramètres ont changé.
+    """
     try:
-        # Charger la BPE filtrée
-        bpe_lyon = pd.read_parquet(OUTPUT_DIR / "bpe_lyon.parquet")
-        
-        # Supprimer les lignes sans coordonnées
-        bpe_lyon = bpe_lyon.dropna(subset=['LAMBERT_X', 'LAMBERT_Y'])
-        
-        logger.info(f"{len(bpe_lyon):,} équipements avec coordonnées")
-        
-        # Créer un GeoDataFrame à partir des coordonnées Lambert 93
-        bpe_gdf = gpd.GeoDataFrame(
-            bpe_lyon,
-            geometry=gpd.points_from_xy(bpe_lyon.LAMBERT_X, bpe_lyon.LAMBERT_Y),
-            crs=CRS_LAMBERT93  # Lambert 93
-        )
-        
-        # Reprojeter en WGS84 pour la compatibilité avec les cartes web
-        bpe_gdf = bpe_gdf.to_crs(CRS_WGS84)
-        
-        # Sauvegarder en GeoJSON
-        bpe_geo_path = OUTPUT_DIR / "bpe_lyon.geojson"
-        bpe_gdf.to_file(bpe_geo_path, driver='GeoJSON')
-        logger.info(f"GeoDataFrame sauvegardé : {bpe_geo_path}")
+        cache = get_cache()
+
+        artifact = cache.fetch(BPE_URL, desc="BPE")
+        pf = fastparquet.ParquetFile(str(artifact.path))
+        wanted = None if BPE_COLUMNS is None else BPE_COLUMNS + NATIONAL_BPE_EXTRA_COLUMNS
+        columns = None if wanted is None else [col for col in wanted if col in pf.columns]
+        key = processing_key(artifact.version, columns, CATEGORIES)
+
+        if not force and _national_source(BPE_NATIONAL_PATH) == key:
+            logger.info(f"BPE unchanged since last run, keeping {BPE_NATIONAL_PATH}")
+        else:
+            bpe_df = pf.to_pandas(columns=columns)
+            bpe_df = bpe_df.dropna(subset=['LAMBERT_X', 'LAMBERT_Y']).reset_index(drop=True)
+            bpe_df['lon'], bpe_df['lat'] = _bpe_lonlat(bpe_df)
+            bpe_df['categorie'] = categorize(bpe_df['TYPEQU'])
+            logger.info(f"{len(bpe_df):,} équipements avec coordonnées (France entière)")
+            _write_national(pa.Table.from_pandas(bpe_df, preserve_index=False), BPE_NATIONAL_PATH, key)
+
+        artifact = cache.fetch(IRIS_URL, desc="IRIS")
+        key = processing_key(artifact.version)
+
+        if not force and _national_source(IRIS_NATIONAL_PATH) == key:
+            logger.info(f"IRIS unchanged since last run, keeping {IRIS_NATIONAL_PATH}")
+        else:
+            iris_gdf = read_iris_archive(artifact.path, departements=None)
+            _write_national(pa.table(iris_gdf.to_arrow(geometry_encoding='WKB')), IRIS_NATIONAL_PATH, key)
+
+    except Exception as e:
+        logger.info(f"Erreur lors de la préparation des données nationales : {e}")
+        raise
+
+
+# Métadonnées GeoParquet des partitions BPE géolocalisées (points WKB en WGS84)
+BPE_GEO_METADATA = {b'geo': json.dumps({
+    'version': '1.0.0',
+    'primary_column': 'geometry',
+    'columns': {'geometry': {'encoding': 'WKB', 'geometry_types': ['Point'],
+                             'crs': pyproj.CRS(CRS_WGS84).to_json_dict()}},
+}).encode()}
+
+
+def _geolocate_batch(batch: pa.RecordBatch) -> pa.Table:
+    """
+    Géolocalise un lot de la BPE : lignes sans coordonnées écartées,
+    points WGS84 (WKB) et catégorie ajoutés
+
+    La reprojection opère directement sur les tableaux NumPy des
+    coordonnées Lambert 93, sans objets géométriques intermédiaires.
+    """
+    batch = batch.filter(pc.and_(pc.is_valid(batch['LAMBERT_X']), pc.is_valid(batch['LAMBERT_Y'])))
+    lon, lat = _transformer(CRS_LAMBERT93).transform(
+        batch['LAMBERT_X'].to_numpy(zero_copy_only=False).astype(float),
+        batch['LAMBERT_Y'].to_numpy(zero_copy_only=False).astype(float))
+
+    table = pa.Table.from_batches([batch])
+    # Catégorie calculée une fois pour toutes (stockée comme dictionnaire)
+    table = table.append_column('categorie', pa.array(categorize(batch['TYPEQU'].to_pandas())))
+    return table.append_column('geometry', pa.array(shapely.to_wkb(shapely.points(lon, lat)), pa.binary()))
+
+
+def _geolocate_partition(source: PartitionedDataset, dataset: PartitionedDataset,
+                         dep: str, key: str, sha256: str) -> int:
+    """
+    Géolocalise la partition BPE d'un département lot par lot (GEO_BATCH_ROWS
+    lignes) : chaque lot est lu, reprojeté puis ajouté au fichier de sortie,
+    la mémoire ne dépend pas de la taille de la partition
+
+    Returns:
+        Nombre d'équipements avec coordonnées
+    """
+    pf = pq.ParquetFile(partition_path(source.root, dep))
+    tmp = dataset.temporary_path(dep)
+    rows = 0
+
+    with span('geolocation', dep=dep, rows=pf.metadata.num_rows) as s:
+        writer = None
+        try:
+            for batch in pf.iter_batches(batch_size=GEO_BATCH_ROWS):
+                table = _geolocate_batch(batch)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp, table.schema.with_metadata(BPE_GEO_METADATA))
+                writer.write_table(table)
+                rows += table.num_rows
+            if writer is None:
+                # Partition vide (département sans équipement) : schéma seul
+                table = _geolocate_batch(pa.RecordBatch.from_pylist([], schema=pf.schema_arrow))
+                writer = pq.ParquetWriter(tmp, table.schema.with_metadata(BPE_GEO_METADATA))
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+        s.set(bytes=tmp.stat().st_size)
+
+    dataset.commit(dep, tmp, key, sha256, rows)
+    logger.info(f"{dep}: {rows:,} équipements avec coordonnées (sur {pf.metadata.num_rows:,})")
+    return rows
+
+
+def geodataframe(force: bool = False, workers: int = GEO_WORKERS):
+    """
+    Géolocalise les partitions BPE en WGS84 (BPE_GEO_PATH)
+
+    Seules les partitions dont la partition BPE source a changé (empreinte
+    du manifeste) sont recalculées, chacune lot par lot (voir
+    _geolocate_partition).
+
+    Args:
+        workers: Départements traités en parallèle (None = nombre de CPU)
+    """
+    try:
+        source = PartitionedDataset(BPE_PATH)
+        dataset = PartitionedDataset(BPE_GEO_PATH)
+
+        sources = {}
+        for dep in DEPARTEMENTS:
+            entry = source.entry(dep)
+            if entry is None:
+                raise FileNotFoundError(f"BPE partition missing for departement {dep} (run --download)")
+            sources[dep] = entry['sha256']
+        keys = {dep: processing_key(sha, CATEGORIES) for dep, sha in sources.items()}
+
+        missing = list(DEPARTEMENTS) if force else dataset.stale(DEPARTEMENTS, keys)
+        if not missing:
+            logger.info(f"Geolocated BPE partitions up to date: {BPE_GEO_PATH}")
+            return
+
+        def geolocate(dep):
+            return _geolocate_partition(source, dataset, dep, keys[dep], sources[dep])
+
+        if workers == 1 or len(missing) == 1:
+            rows = [geolocate(dep) for dep in missing]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                rows = list(executor.map(geolocate, missing))
+
+        logger.info(f"GeoDataFrame sauvegardé : {BPE_GEO_PATH} ({sum(rows):,} équipements, "
+                    f"{len(missing)} partition(s))")
         
     except Exception as e:
         logger.info(f"Erreur lors de la création du GeoDataFrame : {e}")
-        raise
\ No newline at end of file
+        raise
+
+
+def export_geojson():
+    """Exporte les intermédiaires GeoParquet (IRIS, BPE) en GeoJSON"""
+    try:
+        for source, target in [(IRIS_PATH, IRIS_GEOJSON_PATH), (BPE_GEO_PATH, BPE_GEOJSON_PATH)]:
+            gdf = gpd.read_parquet(source, **PartitionedDataset(source).read_options(DEPARTEMENTS))
+            with span('geojson write', cat='io', rows=len(gdf)) as s:
+                gdf.to_file(target, driver='GeoJSON')
+                s.set(bytes=target.stat().st_size)
+            logger.info(f"GeoJSON exporté : {target}")
+
+    except Exception as e:
+        logger.info(f"Erreur lors de l'export GeoJSON : {e}")
+        raise
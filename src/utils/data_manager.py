@@ -1,30 +1,391 @@
+import functools
+import hashlib
+import inspect
+import json
 import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
 import geopandas as gpd
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+from pathlib import Path
 
-from config.settings import IRIS_PATH, BPE_GEO_PATH
-from config.categories import get_category
+from config.settings import IRIS_PATH, BPE_GEO_PATH, IRIS_LEVELS_PATH, BPE_IRIS_PATH, IRIS_COUNTS_PATH
+from config.settings import ACCESS_IRIS_PATH, ACCESS_GRID_PATH, DEPARTEMENTS
+from config.settings import SNAPSHOT_DIR, LOADER_CACHE_SIZE, LOADER_SNAPSHOTS, LOADER_SNAPSHOT_MAX_BYTES
+from config.categories import categorize
+from utils.partitions import PartitionedDataset, partition_paths
+from utils.tracing import span
 
 logger = logging.getLogger(__name__)
 
+# Schéma compact des données chargées : colonnes de codes (peu de valeurs
+# distinctes, répétées) en catégories, c'est-à-dire un dictionnaire et des
+# indices entiers, et coordonnées Lambert 93 en float32 (erreur < 0,5 m)
+BPE_CODE_COLUMNS = ['DEP', 'DEPCOM', 'DCIRIS', 'TYPEQU', 'DOM', 'SDOM', 'QUALITE_XY', 'EPCI', 'code_iris', 'dep']
+IRIS_CODE_COLUMNS = ['insee_com', 'nom_com', 'typ_iris', 'dep']
+FLOAT32_COLUMNS = ['LAMBERT_X', 'LAMBERT_Y']
 
-def iris_loader() -> gpd:
+# Estimation de la mémoire des géométries (objets shapely / GEOS), que
+# pandas ne compte que comme des pointeurs
+GEOMETRY_BYTES = 200
+COORDINATE_BYTES = 24
+
+
+def compact_frame(frame: pd.DataFrame, code_columns: list = BPE_CODE_COLUMNS) -> pd.DataFrame:
+    """Applique en place le schéma compact aux colonnes présentes de `frame`"""
+    for col in code_columns:
+        if col in frame.columns and not isinstance(frame[col].dtype, pd.CategoricalDtype):
+            frame[col] = frame[col].astype('category')
+    for col in FLOAT32_COLUMNS:
+        if col in frame.columns:
+            frame[col] = frame[col].astype('float32')
+    return frame
+
+
+def memory_report(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Mémoire occupée par chaque colonne d'un (Geo)DataFrame
+
+    La taille des géométries est estimée d'après leur nombre et leur nombre
+    de sommets.
+
+    Returns:
+        DataFrame indexé par colonne (dtype, Mo), avec une ligne 'total'
+    """
+    sizes = frame.memory_usage(deep=True)
+    for col in frame.columns:
+        if isinstance(frame[col].dtype, gpd.array.GeometryDtype):
+            geometries = frame[col].to_numpy()
+            n_coords = int(shapely.get_num_coordinates(geometries).sum())
+            sizes[col] += GEOMETRY_BYTES * int(frame[col].notna().sum()) + COORDINATE_BYTES * n_coords
+
+    dtypes = {'Index': str(frame.index.dtype), **{col: str(dtype) for col, dtype in frame.dtypes.items()}}
+    report = pd.DataFrame({'dtype': pd.Series(dtypes), 'MB': sizes / 1024 ** 2})
+    report.loc['total'] = ['', report['MB'].sum()]
+    logger.info(f"{len(frame):,} rows, {report.loc['total', 'MB']:,.1f} MB")
+    return report.round({'MB': 2})
+
+
+def _read_compact(path, columns: list, code_columns: list, geometry: bool = True,
+                  departements: list = None) -> pd.DataFrame:
+    """
+    Lit un (Geo)Parquet avec le schéma compact
+
+    Les colonnes de codes sont lues directement en dictionnaires Arrow,
+    sans passer par une chaîne Python par ligne. Sans `geometry`, la colonne
+    WKB n'est pas lue et un DataFrame est renvoyé. Avec `departements`,
+    `path` est un jeu partitionné dont seules ces partitions sont lues.
+    """
+    options = {}
+    if departements is None:
+        available = pq.read_schema(path).names
+    else:
+        dataset = PartitionedDataset(path)
+        options = dataset.read_options(departements)
+        available = dataset.columns()
+    columns = available if columns is None else columns
+    dictionary = [col for col in code_columns if col in available and col in columns]
+
+    with span('parquet read', cat='io', path=Path(path).name, columns=len(columns)) as s:
+        if geometry:
+            frame = gpd.read_parquet(path, columns=columns, read_dictionary=dictionary, **options)
+        else:
+            frame = pd.read_parquet(path, columns=[col for col in columns if col != 'geometry'],
+                                    read_dictionary=dictionary, **options)
+        # Tampons Arrow intermédiaires rendus au système (sinon conservés par l'allocateur)
+        pa.default_memory_pool().release_unused()
+        s.set(rows=len(frame))
+        return compact_frame(frame, code_columns)
+
+
+def _with_columns(columns: list, *required: str) -> list:
+    """Ajoute à une projection de colonnes celles indispensables au loader"""
+    if columns is None:
+        return None
+    return list(columns) + [col for col in required if col not in columns]
+
+
+# ----------------------------------------------------------------------------
+# Cache des loaders
+# ----------------------------------------------------------------------------
+#
+# Chaque appel d'un loader mémoïsé est identifié par ses arguments et par
+# l'état (chemin, mtime, taille) des fichiers qu'il lit. Le résultat est
+# gardé en mémoire (LRU de LOADER_CACHE_SIZE tables) et écrit en Arrow IPC
+# dans SNAPSHOT_DIR : un nouveau processus (notebook relancé, étape
+# suivante) le relit par mmap au lieu de relire et préparer les parquet.
+# Un fichier source réécrit change la clé : l'entrée en mémoire n'est plus
+# trouvée et l'instantané, d'une autre version, est reconstruit. Les
+# instantanés les moins récemment utilisés (mtime, mis à jour à chaque
+# lecture) sont supprimés au-delà de LOADER_SNAPSHOT_MAX_BYTES.
+
+# À incrémenter si la préparation des tables change (instantanés périmés)
+SNAPSHOT_VERSION = 1
+SNAPSHOT_KEY = b'mobitic.snapshot'
+SNAPSHOT_FRAME = b'mobitic.frame'
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _files_state(paths: list) -> list:
+    """(chemin, mtime, taille) des fichiers ; FileNotFoundError si l'un manque"""
+    states = []
+    for path in paths:
+        stat = os.stat(path)
+        states.append([str(path), stat.st_mtime_ns, stat.st_size])
+    return states
+
+
+def _digest(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _to_arrow(frame: pd.DataFrame) -> pa.Table:
+    """Table Arrow d'un (Geo)DataFrame (géométries en WKB), type du frame en métadonnée"""
+    if isinstance(frame, gpd.GeoDataFrame):
+        table = pa.table(frame.to_arrow(geometry_encoding='WKB'))
+    else:
+        table = pa.Table.from_pandas(frame)
+    return table.replace_schema_metadata({**(table.schema.metadata or {}), SNAPSHOT_FRAME: type(frame).__name__})
+
+
+def _from_arrow(table: pa.Table) -> pd.DataFrame:
+    if table.schema.metadata.get(SNAPSHOT_FRAME) == b'GeoDataFrame':
+        return gpd.GeoDataFrame.from_arrow(table)
+    return table.to_pandas()
+
+
+def _read_snapshot(path: Path, key: str) -> pd.DataFrame:
+    """Table de l'instantané `path` s'il a été produit pour `key`, sinon None"""
+    if not path.exists():
+        return None
+    try:
+        with span('snapshot read', cat='io', path=path.name) as s:
+            table = pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+            if (table.schema.metadata or {}).get(SNAPSHOT_KEY) != key.encode():
+                return None
+            frame = _from_arrow(table)
+            s.set(rows=len(frame), bytes=path.stat().st_size)
+    except (OSError, ValueError, pa.ArrowException) as e:
+        logger.warning(f"Snapshot {path.name} unreadable, rebuilt ({e})")
+        return None
+    # Date d'utilisation (éviction des moins récemment utilisés)
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return frame
+
+
+def _write_snapshot(path: Path, key: str, frame: pd.DataFrame):
+    """Écrit l'instantané (fichier temporaire puis renommage : lecteurs concurrents préservés)"""
+    try:
+        with span('snapshot write', cat='io', path=path.name, rows=len(frame)) as s:
+            table = _to_arrow(frame)
+            table = table.replace_schema_metadata({**table.schema.metadata, SNAPSHOT_KEY: key})
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.', suffix='.arrow')
+            with os.fdopen(fd, 'wb') as f, pa.ipc.new_file(f, table.schema) as writer:
+                writer.write_table(table)
+            os.replace(tmp, path)
+            s.set(bytes=path.stat().st_size)
+    except (OSError, ValueError, TypeError, pa.ArrowException) as e:
+        logger.warning(f"Snapshot {path.name} not written ({e})")
+
+
+def _evict_snapshots(keep: Path, max_bytes: int = LOADER_SNAPSHOT_MAX_BYTES):
+    """
+    Supprime les instantanés les moins récemment utilisés au-delà de
+    `max_bytes` ; `keep` (celui qui vient d'être écrit) n'est jamais supprimé
+    """
+    snapshots = []
+    for path in SNAPSHOT_DIR.glob('*.arrow'):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        snapshots.append((stat.st_mtime_ns, stat.st_size, path))
+    total = sum(size for _, size, _ in snapshots)
+
+    for _, size, path in sorted(snapshots):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        path.unlink(missing_ok=True)
+        total -= size
+        logger.info(f"Snapshot evicted: {path.name} ({size / 1024 ** 2:.1f} MB)")
+
+
+def cached_loader(sources):
+    """
+    Mémoïse un loader (mémoire et instantané Arrow IPC, voir ci-dessus)
+
+    La table renvoyée est une copie profonde de celle du cache : la
+    modifier (colonne, valeurs en place...) n'altère pas le cache, que
+    Copy-on-Write soit actif ou non (pandas < 3).
+
+    Args:
+        sources: Fonction des arguments du loader donnant les fichiers
+            qu'il lit (clé d'invalidation)
+    """
+    def decorator(loader):
+        signature = inspect.signature(loader)
+
+        @functools.wraps(loader)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            try:
+                files = _files_state(sources(**bound.arguments))
+            except FileNotFoundError:
+                # Le loader signale lui-même le fichier manquant
+                return loader(*args, **kwargs)
+
+            query = _digest({'loader': loader.__name__, 'arguments': bound.arguments,
+                             'version': SNAPSHOT_VERSION})
+            key = _digest({'query': query, 'files': files})
+
+            with _cache_lock:
+                if key in _cache:
+                    _cache.move_to_end(key)
+                    return _cache[key].copy(deep=True)
+
+            snapshot = SNAPSHOT_DIR / f"{loader.__name__}-{query[:16]}.arrow"
+            frame = _read_snapshot(snapshot, key) if LOADER_SNAPSHOTS else None
+            if frame is not None:
+                logger.info(f"{len(frame):,} rows loaded from snapshot {snapshot.name} ({loader.__name__})")
+            else:
+                frame = loader(*args, **kwargs)
+                if LOADER_SNAPSHOTS:
+                    _write_snapshot(snapshot, key, frame)
+                    _evict_snapshots(keep=snapshot)
+
+            if LOADER_CACHE_SIZE > 0:
+                with _cache_lock:
+                    _cache[key] = frame
+                    while len(_cache) > LOADER_CACHE_SIZE:
+                        _cache.popitem(last=False)
+            return frame.copy(deep=True)
+
+        return wrapper
+    return decorator
+
+
+def clear_cache(snapshots: bool = True):
+    """
+    Vide le cache des loaders
+
+    Args:
+        snapshots: Supprimer aussi les instantanés sur disque (sinon seul
+            le cache en mémoire est vidé)
+    """
+    with _cache_lock:
+        _cache.clear()
+    removed = 0
+    if snapshots and SNAPSHOT_DIR.exists():
+        for path in SNAPSHOT_DIR.glob('*.arrow'):
+            path.unlink(missing_ok=True)
+            removed += 1
+    logger.info(f"Loader cache cleared ({removed} snapshots removed)")
+
+
+@cached_loader(lambda departements, **_: partition_paths(IRIS_PATH, departements))
+def iris_loader(columns: list = None, departements: list = DEPARTEMENTS) -> gpd.GeoDataFrame:
+    """Contours IRIS des départements `departements` (partitions lues seules)"""
     if not IRIS_PATH.exists():
-        logger.error(f"IRIS file not found: {IRIS_PATH}")
-        raise FileNotFoundError(f"File located {IRIS_PATH} does not exist")
+        logger.error(f"IRIS dataset not found: {IRIS_PATH}")
+        raise FileNotFoundError(f"Directory located {IRIS_PATH} does not exist")
     
-    iris_gdf = gpd.read_file(IRIS_PATH)
+    iris_gdf = _read_compact(IRIS_PATH, _with_columns(columns, 'geometry'), IRIS_CODE_COLUMNS,
+                             departements=departements)
     logger.info(f"{len(iris_gdf):,} IRIS loaded")
     return iris_gdf
 
 
-def bpe_loader() -> gpd:
+@cached_loader(lambda: [IRIS_LEVELS_PATH])
+def iris_levels_loader() -> gpd.GeoDataFrame:
+    """Contours IRIS simplifiés, un jeu de géométries par niveau de zoom"""
+    if not IRIS_LEVELS_PATH.exists():
+        logger.error(f"IRIS levels file not found: {IRIS_LEVELS_PATH}")
+        raise FileNotFoundError(f"File located {IRIS_LEVELS_PATH} does not exist")
+
+    iris_levels = gpd.read_parquet(IRIS_LEVELS_PATH)
+    logger.info(f"{iris_levels['zoom'].nunique()} IRIS levels loaded")
+    return iris_levels
+
+
+@cached_loader(lambda departements, **_: partition_paths(BPE_GEO_PATH, departements))
+def bpe_loader(columns: list = None, geometry: bool = True,
+               departements: list = DEPARTEMENTS) -> gpd.GeoDataFrame:
+    """
+    BPE géolocalisée, au schéma compact (voir compact_frame)
+
+    Args:
+        columns: Colonnes à lire (None = toutes) ; la catégorie est toujours lue
+        geometry: Lire les points WGS84. Sans géométrie, un DataFrame est
+            renvoyé, bien plus léger (les coordonnées restent disponibles
+            dans LAMBERT_X / LAMBERT_Y)
+        departements: Départements lus (partitions), DEPARTEMENTS par défaut
+    """
     if not BPE_GEO_PATH.exists():
-        logger.error(f"BPE file not found: {BPE_GEO_PATH}")
-        raise FileNotFoundError(f"File located {BPE_GEO_PATH} does not exist")
+        logger.error(f"BPE dataset not found: {BPE_GEO_PATH}")
+        raise FileNotFoundError(f"Directory located {BPE_GEO_PATH} does not exist")
+
+    # La catégorie est calculée au téléchargement ; TYPEQU n'est requis
+    # que pour les fichiers produits avant son ajout
+    available = PartitionedDataset(BPE_GEO_PATH).columns()
+    required = ('categorie', 'geometry') if 'categorie' in available else ('TYPEQU', 'geometry')
 
-    bpe_gdf = gpd.read_file(BPE_GEO_PATH)
+    bpe_gdf = _read_compact(BPE_GEO_PATH, _with_columns(columns, *required), BPE_CODE_COLUMNS, geometry,
+                            departements)
     logger.info(f"{len(bpe_gdf):,} equipments loaded")
 
-    bpe_gdf['categorie'] = bpe_gdf['TYPEQU'].apply(get_category)
+    if 'categorie' not in bpe_gdf.columns:
+        bpe_gdf['categorie'] = categorize(bpe_gdf['TYPEQU'])
+
+    return bpe_gdf
+
+
+@cached_loader(lambda **_: [BPE_IRIS_PATH])
+def bpe_iris_loader(columns: list = None) -> gpd.GeoDataFrame:
+    """BPE géolocalisée avec le code de l'IRIS de chaque équipement"""
+    if not BPE_IRIS_PATH.exists():
+        logger.error(f"BPE / IRIS join not found: {BPE_IRIS_PATH}")
+        raise FileNotFoundError(f"File located {BPE_IRIS_PATH} does not exist")
 
+    bpe_gdf = _read_compact(BPE_IRIS_PATH, _with_columns(columns, 'code_iris', 'geometry'), BPE_CODE_COLUMNS)
+    logger.info(f"{len(bpe_gdf):,} equipments loaded (with code_iris)")
     return bpe_gdf
+
+
+def iris_counts_loader() -> pd.DataFrame:
+    """Nombre d'équipements par IRIS (index code_iris) et par catégorie"""
+    if not IRIS_COUNTS_PATH.exists():
+        logger.error(f"IRIS counts file not found: {IRIS_COUNTS_PATH}")
+        raise FileNotFoundError(f"File located {IRIS_COUNTS_PATH} does not exist")
+
+    return pd.read_parquet(IRIS_COUNTS_PATH).set_index('code_iris')
+
+
+def access_loader(grid: bool = False) -> pd.DataFrame:
+    """
+    Distance (m) à l'équipement le plus proche de chaque catégorie
+
+    Args:
+        grid: Table de la grille régulière (x, y, code_iris) plutôt que
+            celle des IRIS (indexée par code_iris)
+    """
+    path = ACCESS_GRID_PATH if grid else ACCESS_IRIS_PATH
+    if not path.exists():
+        logger.error(f"Accessibility file not found: {path}")
+        raise FileNotFoundError(f"File located {path} does not exist")
+
+    access = pd.read_parquet(path)
+    return access if grid else access.set_index('code_iris')
@@ -0,0 +1,299 @@
+"""
+Couches de densité des équipements (rasters Web Mercator)
+
+Tous les équipements, sans échantillonnage, sont comptés par pixel Web
+Mercator (histogramme NumPy), le compte est lissé par un noyau gaussien
+puis converti en image RGBA : teinte de la catégorie, opacité croissante
+avec la densité (échelle logarithmique). Le coût d'affichage dépend du
+nombre de pixels, pas du nombre d'équipements.
+
+Deux sorties (DENSITY_LAYERS) :
+ - 'overlay' : une image PNG par catégorie au zoom DENSITY_ZOOM, écrite à
+   côté de la carte (ImageOverlay, voir map_generator)
+ - 'tiles'   : pyramide de tuiles PNG z/x/y par catégorie dans DENSITY_DIR
+   (étape 'density'), chargée par la carte comme TileLayer
+"""
+
+import json
+import logging
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import shapely
+from branca.colormap import LinearColormap
+from folium.utilities import write_png
+
+from config import CATEGORIES, CATEGORY_NAMES, DENSITY_DIR, DENSITY_ZOOM, DENSITY_MIN_ZOOM, DENSITY_MAX_ZOOM
+from config import DENSITY_SMOOTHING, DENSITY_MAX_PIXELS, DENSITY_OPACITY, TILE_WORKERS
+from utils.data_manager import bpe_loader
+from utils.tiling import TILE_SIZE, category_slug
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+DENSITY_INDEX = 'index.json'
+
+
+# ----------------------------------------------------------------------------
+# Grille de pixels Web Mercator
+# ----------------------------------------------------------------------------
+
+def lonlat_to_pixel(lon, lat, zoom: int) -> tuple:
+    """Coordonnées pixel (réelles) des points dans le monde au zoom `zoom` (vectorisé)"""
+    size = TILE_SIZE * 2 ** zoom
+    lat = np.clip(np.asarray(lat, dtype='float64'), -85.0511, 85.0511)
+    x = (np.asarray(lon, dtype='float64') + 180.0) / 360.0 * size
+    y = (1.0 - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2.0 * size
+    return x, y
+
+
+def pixel_to_lonlat(x, y, zoom: int) -> tuple:
+    """Longitude et latitude d'un coin de pixel (inverse de lonlat_to_pixel)"""
+    size = TILE_SIZE * 2 ** zoom
+    lon = np.asarray(x, dtype='float64') / size * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.asarray(y, dtype='float64') / size))))
+    return lon, lat
+
+
+def histogram(x: np.ndarray, y: np.ndarray, x0: int, y0: int, width: int, height: int) -> np.ndarray:
+    """
+    Nombre de points par pixel de la fenêtre [x0, x0 + width) x [y0, y0 + height)
+
+    Returns:
+        Tableau (height, width) ; les points hors fenêtre sont ignorés
+    """
+    ix = np.floor(x).astype('int64') - x0
+    iy = np.floor(y).astype('int64') - y0
+    inside = (ix >= 0) & (ix < width) & (iy >= 0) & (iy < height)
+    counts = np.bincount(iy[inside] * width + ix[inside], minlength=width * height)
+    return counts.reshape(height, width).astype('float64')
+
+
+def kernel_radius(sigma: float) -> int:
+    """Rayon (pixels) du noyau gaussien d'écart type `sigma` (0 : pas de lissage)"""
+    return int(np.ceil(3 * sigma)) if sigma > 0 else 0
+
+
+def smooth(grid: np.ndarray, sigma: float = DENSITY_SMOOTHING) -> np.ndarray:
+    """
+    Lissage gaussien séparable (convolution par FFT sur chaque axe)
+
+    Le résultat a la taille de `grid` ; le noyau est normalisé, le
+    nombre total de points est conservé à l'intérieur de la grille.
+    """
+    radius = kernel_radius(sigma)
+    if radius == 0:
+        return grid
+    offsets = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 * (offsets / sigma) ** 2)
+    kernel /= kernel.sum()
+
+    for axis in (0, 1):
+        n = grid.shape[axis] + 2 * radius
+        spectrum = np.fft.rfft(grid, n=n, axis=axis)
+        shape = [1, 1]
+        shape[axis] = -1
+        spectrum *= np.fft.rfft(kernel, n=n).reshape(shape)
+        grid = np.fft.irfft(spectrum, n=n, axis=axis)
+        grid = np.take(grid, np.arange(radius, radius + n - 2 * radius), axis=axis)
+    return np.clip(grid, 0, None)
+
+
+# ----------------------------------------------------------------------------
+# Couleurs
+# ----------------------------------------------------------------------------
+
+def palette(color: str, opacity: float = DENSITY_OPACITY) -> np.ndarray:
+    """
+    Table de 256 couleurs RGBA d'une catégorie : du blanc transparent à sa
+    teinte, l'opacité croissant avec la densité (0 : transparent)
+    """
+    colormap = LinearColormap(['white', color], vmin=0, vmax=1)
+    levels = np.linspace(0, 1, 256)
+    lut = np.array([colormap.rgba_bytes_tuple(level) for level in levels], dtype='uint8')
+    lut[:, 3] = np.round(255 * opacity * np.sqrt(levels))
+    return lut
+
+
+def colorize(grid: np.ndarray, vmax: float, lut: np.ndarray) -> np.ndarray:
+    """Image RGBA (uint8) d'une grille de densité, échelle logarithmique jusqu'à `vmax`"""
+    levels = np.log1p(grid) / np.log1p(vmax)
+    return lut[np.clip(np.round(levels * 255), 0, 255).astype('int64')]
+
+
+def category_points(bpe_gdf) -> dict:
+    """{catégorie: (longitudes, latitudes)} des équipements, dans l'ordre de CATEGORY_NAMES"""
+    coordinates = shapely.get_coordinates(bpe_gdf.geometry.to_numpy())
+    categories = bpe_gdf['categorie'].astype(str).to_numpy()
+    points = {}
+    for cat_name in CATEGORY_NAMES:
+        rows = categories == cat_name
+        if rows.any():
+            points[cat_name] = (coordinates[rows, 0], coordinates[rows, 1])
+    return points
+
+
+def _color(cat_name: str) -> str:
+    return CATEGORIES.get(cat_name, {}).get('color', 'gray')
+
+
+# ----------------------------------------------------------------------------
+# Image unique par catégorie (ImageOverlay)
+# ----------------------------------------------------------------------------
+
+def overlay_zoom(lon: np.ndarray, lat: np.ndarray, zoom: int = DENSITY_ZOOM,
+                 max_pixels: int = DENSITY_MAX_PIXELS) -> int:
+    """Zoom le plus proche de `zoom` dont l'image couvrant les points tient dans `max_pixels` de côté"""
+    while zoom > 0:
+        x, y = lonlat_to_pixel([lon.min(), lon.max()], [lat.max(), lat.min()], zoom)
+        if max(x[1] - x[0], y[1] - y[0]) + 2 * kernel_radius(DENSITY_SMOOTHING) + 2 <= max_pixels:
+            break
+        zoom -= 1
+    return zoom
+
+
+def density_overlays(bpe_gdf, zoom: int = DENSITY_ZOOM) -> tuple:
+    """
+    Images de densité de chaque catégorie, sur une même fenêtre de pixels
+
+    Returns:
+        ({catégorie: image RGBA uint8}, emprise [[sud, ouest], [nord, est]], zoom retenu)
+    """
+    points = category_points(bpe_gdf)
+    if not points:
+        return {}, None, zoom
+    lon = np.concatenate([p[0] for p in points.values()])
+    lat = np.concatenate([p[1] for p in points.values()])
+    zoom = overlay_zoom(lon, lat, zoom)
+
+    # Fenêtre commune, élargie du rayon du noyau pour ne pas couper le lissage
+    radius = kernel_radius(DENSITY_SMOOTHING)
+    x, y = lonlat_to_pixel(lon, lat, zoom)
+    x0, y0 = int(np.floor(x.min())) - radius, int(np.floor(y.min())) - radius
+    width, height = int(np.floor(x.max())) + radius + 1 - x0, int(np.floor(y.max())) + radius + 1 - y0
+    west, north = pixel_to_lonlat(x0, y0, zoom)
+    east, south = pixel_to_lonlat(x0 + width, y0 + height, zoom)
+
+    images = {}
+    for cat_name, (cat_lon, cat_lat) in points.items():
+        counts = histogram(*lonlat_to_pixel(cat_lon, cat_lat, zoom), x0, y0, width, height)
+        grid = smooth(counts)
+        images[cat_name] = colorize(grid, grid.max(), palette(_color(cat_name)))
+
+    logger.info(f"Density overlays: {len(images)} categories, {width}x{height} px at zoom {zoom} "
+                f"({len(lon):,} equipments)")
+    return images, [[float(south), float(west)], [float(north), float(east)]], zoom
+
+
+# ----------------------------------------------------------------------------
+# Pyramide de tuiles PNG (étape 'density')
+# ----------------------------------------------------------------------------
+
+def _tiles(x: np.ndarray, y: np.ndarray):
+    """
+    Grilles lissées des tuiles touchées par les points, une à la fois
+
+    Seules les tuiles contenant un point, ou à moins du rayon du noyau
+    d'un point, sont calculées : le temps et la mémoire dépendent du nombre
+    de tuiles occupées, pas de l'emprise. Chaque tuile est comptée avec
+    une marge du rayon du noyau (points des tuiles voisines) pour lisser
+    sans raccord visible.
+
+    Yields:
+        (tx, ty, grille (TILE_SIZE, TILE_SIZE))
+    """
+    radius = kernel_radius(DENSITY_SMOOTHING)
+    home = np.stack([np.floor(x / TILE_SIZE), np.floor(y / TILE_SIZE)], axis=1).astype('int64')
+
+    # Points regroupés par tuile
+    keys, inverse = np.unique(home, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.searchsorted(inverse[order], np.arange(len(keys) + 1))
+    members = {(int(tx), int(ty)): order[bounds[i]:bounds[i + 1]] for i, (tx, ty) in enumerate(keys)}
+
+    # Tuiles à calculer : celles des points et, si le noyau déborde, leurs voisines
+    reach = -(-radius // TILE_SIZE)
+    neighbours = [(dx, dy) for dx in range(-reach, reach + 1) for dy in range(-reach, reach + 1)]
+    targets = sorted({(tx + dx, ty + dy) for tx, ty in members for dx, dy in neighbours})
+    for tx, ty in targets:
+        rows = np.concatenate([members[(tx + dx, ty + dy)] for dx, dy in neighbours
+                               if (tx + dx, ty + dy) in members])
+        counts = histogram(x[rows], y[rows], tx * TILE_SIZE - radius, ty * TILE_SIZE - radius,
+                           TILE_SIZE + 2 * radius, TILE_SIZE + 2 * radius)
+        if counts.any():
+            yield tx, ty, smooth(counts)[radius:radius + TILE_SIZE, radius:radius + TILE_SIZE]
+
+
+def _write_category_tiles(layer_dir: Path, lon: np.ndarray, lat: np.ndarray, zoom: int,
+                          lut: np.ndarray) -> int:
+    """Écrit les tuiles non vides d'une catégorie à un zoom (nombre de tuiles écrites)"""
+    x, y = lonlat_to_pixel(lon, lat, zoom)
+
+    # Échelle commune à toutes les tuiles du zoom : un premier passage
+    # calcule la densité maximale
+    vmax = max(grid.max() for _, _, grid in _tiles(x, y))
+
+    n_tiles = 0
+    for tx, ty, grid in _tiles(x, y):
+        tile = colorize(grid, vmax, lut)
+        if not tile[:, :, 3].any():
+            continue
+        path = layer_dir / str(zoom) / str(tx) / f"{ty}.png"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(write_png(tile))
+        n_tiles += 1
+    return n_tiles
+
+
+def export_density_tiles(bpe_gdf=None, density_dir: Path = DENSITY_DIR,
+                         zooms: range = range(DENSITY_MIN_ZOOM, DENSITY_MAX_ZOOM + 1),
+                         workers: int = TILE_WORKERS) -> Path:
+    """
+    Génère la pyramide de tuiles de densité (une couche par catégorie) et
+    son index (catégories, dossiers, zooms, emprise)
+
+    Args:
+        workers: Processus (une catégorie à un zoom par tâche, None = nombre de CPU)
+
+    Returns:
+        Chemin de l'index
+    """
+    try:
+        if bpe_gdf is None:
+            bpe_gdf = bpe_loader(columns=['categorie'])
+
+        density_dir = Path(density_dir)
+        shutil.rmtree(density_dir, ignore_errors=True)
+        density_dir.mkdir(parents=True)
+
+        layers, tasks = [], []
+        for cat_name, (lon, lat) in category_points(bpe_gdf).items():
+            slug = category_slug(cat_name)
+            lut = palette(_color(cat_name))
+            layers.append({'name': cat_name, 'id': slug})
+            tasks += [(density_dir / slug, lon, lat, zoom, lut) for zoom in zooms]
+
+        logger.info(f"Density tiling: {len(tasks)} tasks, zooms {zooms.start}-{zooms.stop - 1}")
+        with span('density tiles', tasks=len(tasks), rows=len(bpe_gdf)) as s, \
+                ProcessPoolExecutor(max_workers=workers) as executor:
+            counts = list(executor.map(_write_category_tiles, *zip(*tasks)))
+            s.set(tiles=sum(counts))
+        for i, layer in enumerate(layers):
+            layer['tiles'] = sum(counts[i * len(zooms):(i + 1) * len(zooms)])
+        n_tiles = sum(counts)
+
+        west, south, east, north = bpe_gdf.total_bounds
+        index_path = density_dir / DENSITY_INDEX
+        with open(index_path, 'w', encoding='utf-8') as f:
+            json.dump({'layers': layers, 'minzoom': zooms.start, 'maxzoom': zooms.stop - 1,
+                       'bounds': [[south, west], [north, east]]}, f, ensure_ascii=False, indent=2)
+
+        logger.info(f"{n_tiles:,} density tiles written in {density_dir} (zooms {zooms.start}-{zooms.stop - 1})")
+        return index_path
+
+    except Exception as e:
+        logger.error(f"Error during density tiling: {e}")
+        raise
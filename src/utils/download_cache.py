@@ -0,0 +1,332 @@
+"""
+Cache de téléchargement adressé par contenu
+
+Chaque artefact brut (BPE, archive IRIS) est stocké sous son empreinte
+SHA-256 avec l'ETag et le Last-Modified renvoyés par le serveur. Les
+téléchargements suivants sont conditionnels (If-None-Match /
+If-Modified-Since) : un 304 ou une empreinte inchangée évitent à la fois
+le transfert et le post-traitement. Les artefacts servis avec Range sont
+transférés par segments parallèles, reprenables après une coupure (voir
+range_download).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+
+from config import CACHE_DIR, CACHE_MAX_BYTES, REQUEST_TIMEOUT, DOWNLOAD_CONNECTIONS
+from utils.range_download import download_ranges, read_adaptive, supports_ranges
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class CachedArtifact:
+    """
+    Résultat d'un passage par le cache
+
+    Attributes:
+        url: URL de l'artefact
+        path: Chemin local de l'artefact (None si seuls les validateurs sont connus)
+        sha256: Empreinte du contenu (None si seuls les validateurs sont connus)
+        version: Identifiant de version, stable tant que le contenu ne change
+            pas (voir _version)
+        changed: False si le contenu est identique à la version en cache
+    """
+
+    def __init__(self, url: str, path: Path, sha256: str, version: str, changed: bool):
+        self.url = url
+        self.path = path
+        self.sha256 = sha256
+        self.version = version
+        self.changed = changed
+
+    def __repr__(self) -> str:
+        return f"CachedArtifact({self.url!r}, version={self.version!r}, changed={self.changed})"
+
+
+def _new_version(headers, sha256: str = None) -> str:
+    """Version d'un contenu vu pour la première fois : ETag, sinon Last-Modified, sinon empreinte"""
+    return headers.get('ETag') or headers.get('Last-Modified') or sha256 or ''
+
+
+def _version(entry: dict) -> str:
+    """
+    Version enregistrée d'une entrée
+
+    Fixée à la première observation d'un contenu (_new_version), elle est
+    conservée tant que l'empreinte ou les validateurs restent les mêmes :
+    une lecture par Range (validateurs seuls) puis un téléchargement
+    complet du même contenu donnent la même version, donc les mêmes clés
+    de post-traitement.
+    """
+    if 'version' in entry:
+        return entry['version']
+    # Index antérieur au champ 'version'
+    return entry.get('etag') or entry.get('last_modified') or entry.get('sha256') or ''
+
+
+def _same_validators(entry: dict, headers) -> bool:
+    etag, last_modified = headers.get('ETag'), headers.get('Last-Modified')
+    return bool(etag or last_modified) and \
+        (etag, last_modified) == (entry.get('etag'), entry.get('last_modified'))
+
+
+def processing_key(version: str, *params) -> str:
+    """Empreinte d'un post-traitement : version de l'artefact + paramètres"""
+    payload = json.dumps([version, *params], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class DownloadCache:
+    """
+    Cache des artefacts téléchargés sous `cache_dir`
+
+    Args:
+        cache_dir: Dossier racine du cache
+        max_bytes: Taille maximale des objets conservés (éviction LRU)
+    """
+
+    def __init__(self, cache_dir: Path = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.objects_dir = self.cache_dir / "objects"
+        self.partial_dir = self.cache_dir / "partial"
+        self.index_path = self.cache_dir / "index.json"
+        self.max_bytes = max_bytes
+        self.session = requests.Session()
+        # Une connexion conservée par segment téléchargé en parallèle
+        adapter = HTTPAdapter(pool_maxsize=DOWNLOAD_CONNECTIONS)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._lock = threading.Lock()
+
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self._index = self._load_index()
+
+    # ------------------------------------------------------------------
+    # Index
+    # ------------------------------------------------------------------
+
+    def _load_index(self) -> dict:
+        if self.index_path.exists():
+            try:
+                with open(self.index_path, encoding='utf-8') as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Cache index unreadable, reset ({e})")
+        return {'entries': {}, 'objects': {}}
+
+    def _save_index(self):
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.json')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f, indent=2)
+        os.replace(tmp, self.index_path)
+
+    def object_path(self, sha256: str) -> Path:
+        return self.objects_dir / sha256[:2] / sha256
+
+    def entry(self, url: str) -> dict:
+        return dict(self._index['entries'].get(url, {}))
+
+    # ------------------------------------------------------------------
+    # Téléchargements
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _conditional_headers(entry: dict) -> dict:
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def fetch(self, url: str, desc: str = None) -> CachedArtifact:
+        """
+        Télécharge `url` dans le cache si nécessaire
+
+        Returns:
+            CachedArtifact pointant vers le fichier local
+        """
+        entry = self.entry(url)
+        cached_sha = entry.get('sha256')
+        has_object = bool(cached_sha) and self.object_path(cached_sha).exists()
+
+        headers = self._conditional_headers(entry) if has_object else {}
+        response = self.session.get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT)
+
+        try:
+            if response.status_code == 304:
+                logger.info(f"Cache hit (304 Not Modified): {url}")
+                self._touch(url, cached_sha)
+                return CachedArtifact(url, self.object_path(cached_sha), cached_sha,
+                                      _version(entry), changed=False)
+
+            response.raise_for_status()
+            ranged = supports_ranges(response.headers)
+            if not ranged:
+                sha256, tmp_path = self._stream_to_disk(response, desc or url)
+        finally:
+            response.close()
+
+        if ranged:
+            # Corps de la réponse abandonné : segments parallèles, reprenables
+            sha256, tmp_path = download_ranges(self.session, url, response.headers,
+                                               self.partial_dir, desc or url)
+
+        final_path = self.object_path(sha256)
+        final_path.parent.mkdir(parents=True, exist_ok=True)
+        if final_path.exists():
+            tmp_path.unlink()
+        else:
+            os.replace(tmp_path, final_path)
+
+        # Même contenu : même empreinte, ou mêmes validateurs pour une entrée
+        # connue jusqu'ici par ses seuls validateurs (lecture par Range)
+        changed = not entry or not (sha256 == cached_sha or
+                                    (cached_sha is None and _same_validators(entry, response.headers)))
+        version = _new_version(response.headers, sha256) if changed else _version(entry)
+        logger.info(f"Cache {'miss' if changed else 'hit (same content)'}: {url}")
+
+        with self._lock:
+            self._index['objects'][sha256] = {
+                'url': url,
+                'size': final_path.stat().st_size,
+                'last_used': time.time(),
+            }
+            self._index['entries'][url] = {
+                **(entry if not changed else {}),
+                'sha256': sha256,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'version': version,
+                'fetched_at': time.time(),
+            }
+            self._evict(keep={sha256})
+            self._save_index()
+
+        return CachedArtifact(url, final_path, sha256, version, changed)
+
+    def _stream_to_disk(self, response: requests.Response, desc: str) -> tuple:
+        total_size = int(response.headers.get('content-length', 0))
+        digest = hashlib.sha256()
+
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.part')
+        with span('http transfer', cat='http', url=response.url) as s, os.fdopen(fd, 'wb') as f, \
+                tqdm(total=total_size, unit='B', unit_scale=True, desc=desc) as pbar:
+            response.raw.decode_content = True
+            for chunk in read_adaptive(response.raw):
+                f.write(chunk)
+                digest.update(chunk)
+                pbar.update(len(chunk))
+            s.set(bytes=pbar.n)
+
+        return digest.hexdigest(), Path(tmp)
+
+    def revalidate(self, url: str, desc: str = None) -> CachedArtifact:
+        """
+        Vérifie par une requête HEAD si `url` a changé depuis le dernier passage,
+        sans transférer le contenu (cas des lectures partielles par Range)
+
+        Si les validateurs n'ont pas changé et que le contenu est déjà en
+        cache (téléchargé par fetch), son `path` est renseigné. Si le
+        serveur refuse HEAD (405, 403...), l'artefact est obtenu par GET
+        conditionnel (fetch) : son `path` est alors renseigné aussi.
+        """
+        entry = self.entry(url)
+        response = self.session.head(url, allow_redirects=True, timeout=REQUEST_TIMEOUT)
+        if not response.ok:
+            logger.warning(f"HEAD {url} refused ({response.status_code}), conditional GET instead")
+            return self.fetch(url, desc=desc)
+
+        known = bool(entry) and _same_validators(entry, response.headers)
+        if not known:
+            logger.info(f"Cache miss: {url}")
+            return CachedArtifact(url, None, None, _new_version(response.headers), changed=True)
+
+        sha256 = entry.get('sha256')
+        path = self.object_path(sha256) if sha256 and self.object_path(sha256).exists() else None
+        if path is not None:
+            self._touch(url, sha256)
+        logger.info(f"Cache hit (validators unchanged{', content cached' if path else ''}): {url}")
+        return CachedArtifact(url, path, sha256 if path else None, _version(entry), changed=False)
+
+    def remember(self, url: str, headers: dict):
+        """
+        Enregistre les validateurs d'un artefact lu sans être stocké
+
+        Si les validateurs n'ont pas changé, l'entrée (empreinte, objet en
+        cache, version) est conservée.
+        """
+        with self._lock:
+            entry = self._index['entries'].get(url)
+            if entry and _same_validators(entry, headers):
+                entry['fetched_at'] = time.time()
+            else:
+                self._index['entries'][url] = {
+                    'sha256': None,
+                    'etag': headers.get('ETag'),
+                    'last_modified': headers.get('Last-Modified'),
+                    'version': _new_version(headers),
+                    'fetched_at': time.time(),
+                }
+            self._save_index()
+
+    # ------------------------------------------------------------------
+    # Éviction
+    # ------------------------------------------------------------------
+
+    def _touch(self, url: str, sha256: str):
+        with self._lock:
+            if sha256 in self._index['objects']:
+                self._index['objects'][sha256]['last_used'] = time.time()
+            self._save_index()
+
+    def _evict(self, keep: set):
+        """
+        Supprime les objets les moins récemment utilisés au-delà de `max_bytes`.
+        Les anciennes versions (vintages) partent d'abord, puis les versions
+        courantes des autres URL ; les objets de `keep` ne sont jamais supprimés.
+        """
+        objects = self._index['objects']
+        total = sum(obj['size'] for obj in objects.values())
+        if total <= self.max_bytes:
+            return
+
+        current = {e.get('sha256') for e in self._index['entries'].values()}
+        candidates = sorted(
+            (sha for sha in objects if sha not in keep),
+            key=lambda sha: (sha in current, objects[sha]['last_used'])
+        )
+
+        for sha in candidates:
+            if total <= self.max_bytes:
+                break
+            self.object_path(sha).unlink(missing_ok=True)
+            total -= objects.pop(sha)['size']
+            for url, entry in self._index['entries'].items():
+                if entry.get('sha256') == sha:
+                    entry['sha256'] = None
+            logger.info(f"Cache eviction: {sha[:12]}")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> DownloadCache:
+    """Instance partagée du cache de téléchargement"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DownloadCache()
+    return _cache
@@ -0,0 +1,156 @@
+"""
+Accès HTTP par plages d'octets (Range requests)
+
+Permet de lire un fichier distant comme un fichier local ouvert en 'rb' :
+seules les plages effectivement lues sont transférées.
+"""
+
+import io
+import logging
+import re
+import time
+
+import requests
+
+from config import REQUEST_TIMEOUT, RANGE_BLOCK_SIZE, DOWNLOAD_RETRIES, DOWNLOAD_RETRY_DELAY
+from utils.range_download import TRANSIENT_ERRORS
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+_CONTENT_RANGE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+
+class RangeNotSupported(Exception):
+    """Le serveur ne répond pas aux requêtes Range par un 206"""
+
+
+class HTTPRangeFile(io.RawIOBase):
+    """
+    Fichier distant en lecture seule, adressé par requêtes HTTP Range
+
+    Les petites lectures sont regroupées dans un bloc de `block_size` octets
+    (lecture anticipée) ; les grosses lectures sont transférées telles quelles.
+
+    Args:
+        url: URL du fichier distant
+        session: Session requests à réutiliser (une nouvelle sinon)
+        block_size: Taille minimale d'une requête Range
+
+    Raises:
+        RangeNotSupported: Si le serveur ignore l'en-tête Range
+    """
+
+    def __init__(self, url: str, session: requests.Session = None,
+                 block_size: int = RANGE_BLOCK_SIZE):
+        super().__init__()
+        self.url = url
+        self.session = session or requests.Session()
+        self.block_size = block_size
+        self.bytes_transferred = 0
+        self.requests_count = 0
+        self.headers = {}
+        self._pos = 0
+        self._block_start = 0
+        self._block = b''
+
+        # Premier appel : la fin du fichier (pied de page parquet, index...)
+        # renseigne aussi la taille totale via Content-Range
+        tail = self._fetch_range(f'bytes=-{block_size}', probe=True)
+        self.size = self._total_size
+        self._block_start = self.size - len(tail)
+        self._block = tail
+
+    def _fetch_range(self, range_header: str, probe: bool = False) -> bytes:
+        with span('http range', cat='http', range=range_header) as s:
+            for attempt in range(DOWNLOAD_RETRIES + 1):
+                try:
+                    data = self._get_range(range_header, probe)
+                    break
+                except TRANSIENT_ERRORS as e:
+                    if attempt == DOWNLOAD_RETRIES:
+                        raise
+                    delay = DOWNLOAD_RETRY_DELAY * 2 ** attempt
+                    logger.warning(f"Range {range_header} of {self.url} interrupted ({e}), "
+                                   f"retry in {delay:.1f}s ({attempt + 1}/{DOWNLOAD_RETRIES})")
+                    time.sleep(delay)
+            s.set(bytes=len(data))
+
+        self.bytes_transferred += len(data)
+        self.requests_count += 1
+        return data
+
+    def _get_range(self, range_header: str, probe: bool) -> bytes:
+        response = self.session.get(
+            self.url,
+            headers={'Range': range_header, 'Accept-Encoding': 'identity'},
+            stream=True,
+            timeout=REQUEST_TIMEOUT
+        )
+        try:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise RangeNotSupported(
+                    f"{self.url} answered {response.status_code} to a Range request"
+                )
+            if probe:
+                match = _CONTENT_RANGE.match(response.headers.get('Content-Range', ''))
+                if not match or match.group(3) == '*':
+                    raise RangeNotSupported(f"{self.url} sent no usable Content-Range")
+                self._total_size = int(match.group(3))
+                self.headers = dict(response.headers)
+            return response.content
+        finally:
+            response.close()
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if pos < 0:
+            raise ValueError(f"Negative seek position: {pos}")
+        self._pos = pos
+        return pos
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.size - self._pos
+        size = min(size, self.size - self._pos)
+        if size <= 0:
+            return b''
+
+        start, end = self._pos, self._pos + size
+        block_end = self._block_start + len(self._block)
+
+        if not (self._block_start <= start and end <= block_end):
+            if size >= self.block_size:
+                # Gros morceau (colonne entière) : pas de mise en cache
+                data = self._fetch_range(f'bytes={start}-{end - 1}')
+                self._pos = end
+                return data
+            fetch_end = min(start + self.block_size, self.size)
+            self._block = self._fetch_range(f'bytes={start}-{fetch_end - 1}')
+            self._block_start = start
+
+        offset = start - self._block_start
+        self._pos = end
+        return self._block[offset:offset + size]
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
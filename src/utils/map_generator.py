@@ -1,89 +1,299 @@
 import folium
 from folium import plugins
+from branca.colormap import linear
 import pandas as pd
 import logging 
+import json
+import os
+import shutil
+from pathlib import Path
 
-from utils.data_manager import iris_loader, bpe_loader
+from utils.data_manager import iris_levels_loader, bpe_loader, iris_counts_loader, access_loader
+from utils.map_layers import BulkMarkers, PrecomputedClusters, MultiLevelGeoJson, LinkedImageOverlay
+from utils.clustering import cluster_categories
+from utils.colocation import group_colocated, location_table
+from utils.bundle import write_bundle
+from utils.tracing import span
 from config.categories import CATEGORIES
-from config.settings import OUTPUT_FILE, MAX_MARKERS
+from config.settings import OUTPUT_FILE, MAX_MARKERS, MAP_RENDER_MODE, CLUSTER_THRESHOLD, IRIS_LEVELS
+from config.settings import CHOROPLETH_COLUMN, ACCESS_MAP_CATEGORY, MAP_ZOOM
+from config.settings import DENSITY_LAYERS, DENSITY_DIR
 
 logger = logging.getLogger(__name__)
 
 
-def create_interactive_map():
-    iris_gdf, bpe_gdf = iris_loader(), bpe_loader()
+def _marker_style(cat: str) -> tuple:
+    """Couleur et icône d'une catégorie"""
+    if cat in CATEGORIES:
+        return CATEGORIES[cat]['color'], CATEGORIES[cat]['icon']
+    return 'gray', 'info-sign'
+
+
+def add_bulk_markers(bpe_gdf, feature_groups: dict):
+    """Ajoute tous les équipements, une couche compacte par catégorie"""
+    for cat, points in bpe_gdf.groupby('layer', observed=True):
+        color, icon = _marker_style(cat)
+        feature_groups[cat].add_child(BulkMarkers(points, cat, color, icon))
+
+    logger.info(f"{len(bpe_gdf):,} equipments added (bulk rendering)")
+
+
+def add_precomputed_clusters(bpe_gdf, feature_groups: dict):
+    """Ajoute les groupes précalculés par zoom de chaque catégorie"""
+    clusters = cluster_categories(bpe_gdf)
+    for cat, points in bpe_gdf.groupby('layer', observed=True):
+        color, icon = _marker_style(cat)
+        feature_groups[cat].add_child(PrecomputedClusters(points, clusters[cat], cat, color, icon))
+
+    logger.info(f"{len(bpe_gdf):,} equipments added (precomputed clusters)")
+
+
+def _location_popup(entries: pd.DataFrame, location: pd.Series) -> str:
+    """Popup d'un emplacement : type et catégorie, ou liste de ses équipements"""
+    if location['count'] == 1:
+        popup_html = f"""
+        <b>Type:</b> {entries['TYPEQU'].iloc[0]}<br>
+        <b>Catégorie:</b> {entries['categorie'].iloc[0]}<br>
+        """
+    else:
+        single_category = entries['categorie'].nunique() == 1
+        popup_html = f"<b>{location['count']} équipements</b><br>"
+        if single_category:
+            popup_html += f"<b>Catégorie:</b> {entries['categorie'].iloc[0]}<br>"
+        for entry in entries.itertuples():
+            popup_html += entry.TYPEQU + (f" ×{entry.count}" if entry.count > 1 else "")
+            popup_html += ("" if single_category else f" ({entry.categorie})") + "<br>"
+
+    # Add others informations if available
+    if 'DEPCOM' in location and pd.notna(location['DEPCOM']):
+        popup_html += f"<b>Commune:</b> {location['DEPCOM']}<br>"
+    return popup_html
+
+
+def add_markers(bpe_gdf, feature_groups: dict):
+    """Ajoute un folium.Marker par emplacement, sur un échantillon de MAX_MARKERS"""
+    locations, entries = location_table(bpe_gdf)
+
+    # Sample the locations to display only a subsample if necessary
+    sample = locations if len(locations) <= MAX_MARKERS else locations.sample(MAX_MARKERS)
+    if len(locations) > MAX_MARKERS:
+        logger.info(f"Display of a subsample of {MAX_MARKERS:,} locations (on {len(locations):,})")
+
+    entries_by_location = entries.groupby('location', sort=False)
+    for idx, location in sample.iterrows():
+        cat = location['layer']
+        color, icon = _marker_style(cat)
+        location_entries = entries_by_location.get_group(idx)
+
+        if location['count'] == 1:
+            tooltip = f"{cat} - {location_entries['TYPEQU'].iloc[0]}"
+        else:
+            tooltip = f"{cat} - {location['count']} équipements"
+
+        folium.Marker(
+            location=[location['lat'], location['lon']],
+            popup=folium.Popup(_location_popup(location_entries, location), max_width=200),
+            tooltip=tooltip,
+            icon=folium.Icon(color=color, icon=icon, prefix='glyphicon')
+        ).add_to(feature_groups[cat])
+
+
+def add_iris_choropleth(m: folium.Map, iris_layer: MultiLevelGeoJson, values: pd.Series,
+                        name: str, label: str):
+    """
+    Ajoute une choroplèthe d'une valeur par IRIS (masquée par défaut)
+
+    Les géométries sont celles de la couche `iris_layer` ; `values` donne
+    la valeur de chacune de ses entités, dans le même ordre (NA en gris).
+    Sans aucune valeur (p. ex. aucun équipement de la catégorie dans la
+    région), la couche n'est pas ajoutée.
+    """
+    if values.notna().sum() == 0:
+        logger.warning(f"Choropleth skipped, no value: {name}")
+        return
+
+    values = values.round().astype('Int64')
+    colormap = linear.YlOrRd_09.to_step(data=values.dropna().to_numpy(), n=6, method='quantiles',
+                                        round_method='int')
+    colormap.caption = name
+
+    MultiLevelGeoJson(
+        source=iris_layer,
+        name=name,
+        colors=[colormap.rgb_hex_str(value) if pd.notna(value) else '#cccccc' for value in values],
+        extra={label: values.astype(object).where(values.notna(), '-').to_numpy()},
+        style={'color': 'white', 'weight': 0.5, 'fillOpacity': 0.6},
+        highlight={'color': 'black', 'weight': 2},
+        show=False,
+    ).add_to(m)
+    colormap.add_to(m)
+
+    logger.info(f"Choropleth added: {name}")
+
+
+def add_density_overlays(m: folium.Map, bpe_gdf, url: str, directory: Path):
+    """
+    Ajoute une image de densité par catégorie (masquée par défaut),
+    calculée sur tous les équipements de `bpe_gdf`
+
+    Les images sont écrites en PNG dans `directory` et référencées par
+    leur URL (LinkedImageOverlay) : elles n'alourdissent pas la page.
+
+    Args:
+        url: Dossier des images, relatif à la page (ou URL)
+        directory: Dossier où écrire les images
+    """
+    from folium.utilities import write_png
+    from utils.density import density_overlays
+    from utils.tiling import category_slug
+
+    with span('density overlays', rows=len(bpe_gdf)) as s:
+        images, bounds, zoom = density_overlays(bpe_gdf)
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        size = 0
+        for cat_name, image in images.items():
+            path = directory / f"{category_slug(cat_name)}.png"
+            path.write_bytes(write_png(image))
+            size += path.stat().st_size
+            LinkedImageOverlay(
+                f"{url}/{path.name}",
+                bounds,
+                name=f"Densité : {cat_name}",
+                show=False,
+            ).add_to(m)
+        s.set(layers=len(images), zoom=zoom, bytes=size)
+    logger.info(f"{len(images)} density overlays written: {directory}")
+
+
+def add_density_tiles(m: folium.Map, url: str, index: dict):
+    """
+    Ajoute les tuiles de densité de chaque catégorie (masquées par défaut)
+
+    Args:
+        url: Dossier des tuiles, relatif à la page (ou URL)
+        index: Index des tuiles (voir export_density_tiles)
+    """
+    (south, west), (north, east) = index['bounds']
+    for layer in index['layers']:
+        folium.TileLayer(
+            tiles=f"{url}/{layer['id']}/{{z}}/{{x}}/{{y}}.png",
+            attr='BPE (Insee)',
+            name=f"Densité : {layer['name']}",
+            overlay=True,
+            control=True,
+            show=False,
+            min_native_zoom=index['minzoom'],
+            max_native_zoom=index['maxzoom'],
+            bounds=[[south, west], [north, east]],
+        ).add_to(m)
+    logger.info(f"{len(index['layers'])} density tile layers added ({url})")
+
+
+def build_map(iris_levels, bpe_gdf, counts: pd.DataFrame = None, access: pd.DataFrame = None,
+              fit_bounds: bool = False, density_tiles: tuple = None,
+              density_images: tuple = None) -> folium.Map:
+    """
+    Construit la carte interactive à partir de données déjà chargées
+
+    Args:
+        iris_levels: Contours IRIS simplifiés par niveau de zoom (simplify_levels)
+        bpe_gdf: Équipements géolocalisés (WGS84)
+        counts: Équipements par IRIS et catégorie, indexés par code_iris
+            (None = pas de choroplèthe)
+        access: Distances par IRIS et catégorie, indexées par code_iris
+            (None = pas de carte d'accessibilité)
+        fit_bounds: Cadrer la carte sur l'emprise des IRIS plutôt que sur
+            leur centre au zoom MAP_ZOOM
+        density_tiles: (URL, index) des tuiles de densité, si DENSITY_LAYERS
+            vaut 'tiles' (voir add_density_tiles)
+        density_images: (URL, dossier) des images de densité, si
+            DENSITY_LAYERS vaut 'overlay' (voir add_density_overlays)
+    """
+    # Contours du niveau le plus simplifié (centrage de la carte)
+    iris_gdf = iris_levels[iris_levels['zoom'] == iris_levels['zoom'].min()]
 
     center_lat = iris_gdf.geometry.centroid.y.mean()
     center_lon = iris_gdf.geometry.centroid.x.mean()
 
     m = folium.Map(
         location=[center_lat, center_lon],
-        zoom_start=11,
+        zoom_start=MAP_ZOOM,
         tiles='OpenStreetMap',
         control_scale=True
     )
+    if fit_bounds:
+        xmin, ymin, xmax, ymax = iris_gdf.total_bounds
+        m.fit_bounds([[ymin, xmin], [ymax, xmax]])
 
     name_col, code_col = 'nom_iris', 'code_iris'
-    folium.GeoJson(
-        iris_gdf,
+    iris_layer = MultiLevelGeoJson(
+        iris_levels,
+        decimals={zoom: decimals for zoom, _, decimals in IRIS_LEVELS},
         name='Contours IRIS',
-        style_function=lambda x: {
+        fields=[name_col, code_col],
+        aliases=['Nom:', 'Code:'],
+        style={
             'fillColor': 'lightblue',
             'color': 'blue',
             'weight': 1,
             'fillOpacity': 0.1,
         },
-        highlight_function=lambda x: {
+        highlight={
             'fillColor': 'yellow',
             'fillOpacity': 0.3,
         },
-        tooltip=folium.GeoJsonTooltip(
-            fields=[name_col, code_col],
-            aliases=['Nom:', 'Code:'],
-        )
     ).add_to(m)
 
     logger.info(f"{len(iris_gdf):,} IRIS added")
 
+    codes = iris_gdf[code_col].to_numpy()
+    if counts is not None and CHOROPLETH_COLUMN is not None:
+        totals = counts[CHOROPLETH_COLUMN].reindex(codes).fillna(0)
+        add_iris_choropleth(m, iris_layer, totals, f"Équipements par IRIS ({CHOROPLETH_COLUMN})",
+                            'Équipements:')
+
+    if access is not None and ACCESS_MAP_CATEGORY is not None:
+        distances = access[ACCESS_MAP_CATEGORY].reindex(codes)
+        add_iris_choropleth(m, iris_layer, distances,
+                            f"Distance à l'équipement le plus proche ({ACCESS_MAP_CATEGORY})",
+                            'Distance (m):')
+
+    # Density of all equipments, before grouping and sampling
+    if DENSITY_LAYERS == 'overlay' and density_images is not None:
+        add_density_overlays(m, bpe_gdf, *density_images)
+    elif DENSITY_LAYERS == 'tiles' and density_tiles is not None:
+        add_density_tiles(m, *density_tiles)
+
+    render_mode = MAP_RENDER_MODE
+    if render_mode == 'auto':
+        render_mode = 'bulk' if len(bpe_gdf) <= CLUSTER_THRESHOLD else 'clusters'
+
     # Creation of categories to manage the Marker Cluster
+    # (plain feature groups when clusters are precomputed)
+    def make_group(name):
+        if render_mode == 'clusters':
+            return folium.FeatureGroup(name=name).add_to(m)
+        cluster_options = {'chunkedLoading': True} if render_mode == 'bulk' else {}
+        return plugins.MarkerCluster(name=name, **cluster_options).add_to(m)
+
     feature_groups = {}
     for cat_name, cat_info in CATEGORIES.items():
-        feature_groups[cat_name] = plugins.MarkerCluster(name=cat_name).add_to(m)
+        feature_groups[cat_name] = make_group(cat_name)
 
     # Creation of a categorie "Autre" to manage specific cases
-    feature_groups['Autres'] = plugins.MarkerCluster(name='Autres').add_to(m)
-
-    # Sample the bpe base to display only a subsample if necessary
-    bpe_sample = bpe_gdf if len(bpe_gdf) <= MAX_MARKERS else bpe_gdf.sample(MAX_MARKERS)
-    if len(bpe_gdf) > MAX_MARKERS:
-        logger.info(f"Display of a subsample of {MAX_MARKERS:,} equipments (on {len(bpe_gdf):,})")
-
-    for idx, row in bpe_sample.iterrows():
-        cat = row['categorie']
-        
-        if cat in CATEGORIES:
-            color = CATEGORIES[cat]['color']
-            icon = CATEGORIES[cat]['icon']
+    feature_groups['Autres'] = make_group('Autres')
+
+    # One marker per location (see MARKER_GROUPING)
+    bpe_gdf = group_colocated(bpe_gdf)
+
+    with span('markers', rows=len(bpe_gdf), mode=render_mode):
+        if render_mode == 'clusters':
+            add_precomputed_clusters(bpe_gdf, feature_groups)
+        elif render_mode == 'bulk':
+            add_bulk_markers(bpe_gdf, feature_groups)
         else:
-            color = 'gray'
-            icon = 'info-sign'
-        
-        # Creation of the popup with informations
-        popup_html = f"""
-        <b>Type:</b> {row['TYPEQU']}<br>
-        <b>Catégorie:</b> {cat}<br>
-        """
-        
-        # Add others informations if available
-        if 'DEPCOM' in row and pd.notna(row['DEPCOM']):
-            popup_html += f"<b>Commune:</b> {row['DEPCOM']}<br>"
-        
-        folium.Marker(
-            location=[row.geometry.y, row.geometry.x],
-            popup=folium.Popup(popup_html, max_width=200),
-            tooltip=f"{cat} - {row['TYPEQU']}",
-            icon=folium.Icon(color=color, icon=icon, prefix='glyphicon')
-        ).add_to(feature_groups[cat])
+            add_markers(bpe_gdf, feature_groups)
   
     # Add layer control
     folium.LayerControl(collapsed=False).add_to(m)
@@ -98,12 +308,59 @@ def create_interactive_map():
     """
     for cat_name, cat_info in CATEGORIES.items():
         legend_html += f"""
-        <p><i class="fa fa-circle" style="color:{cat_info['color']}"></i> {cat_name}</p>
+        <p><span style="display:inline-block; width:12px; height:12px; border-radius:50%;
+                  background:{cat_info['color']}"></span> {cat_name}</p>
         """
 
     legend_html += "</div>"
 
     m.get_root().html.add_child(folium.Element(legend_html))
 
-    m.save(OUTPUT_FILE)
-    logger.info(f"Map saved: {OUTPUT_FILE}")
\ No newline at end of file
+    return m
+
+
+def create_interactive_map(bundle_dir: Path = None, output_path: Path = OUTPUT_FILE):
+    """
+    Crée la carte interactive à partir des fichiers de OUTPUT_DIR
+
+    Args:
+        bundle_dir: Si renseigné, la carte est écrite sous forme de dossier
+            autonome (ressources locales, données par couche compressées)
+            au lieu du fichier HTML unique `output_path`
+        output_path: Fichier HTML de la carte
+    """
+    counts = iris_counts_loader() if CHOROPLETH_COLUMN is not None else None
+    access = access_loader() if ACCESS_MAP_CATEGORY is not None else None
+
+    # Density tiles (stage 'density') and images: copied (written) into the
+    # bundle, otherwise referenced relative to the HTML page
+    density_tiles = density_images = None
+    if DENSITY_LAYERS == 'overlay':
+        if bundle_dir is not None:
+            density_images = ('density', Path(bundle_dir) / 'density')
+        else:
+            url = os.path.relpath(DENSITY_DIR, Path(output_path).resolve().parent)
+            density_images = (Path(url).as_posix(), DENSITY_DIR)
+    if DENSITY_LAYERS == 'tiles':
+        from utils.density import DENSITY_INDEX
+        with open(DENSITY_DIR / DENSITY_INDEX, encoding='utf-8') as f:
+            index = json.load(f)
+        if bundle_dir is not None:
+            shutil.rmtree(Path(bundle_dir) / 'density', ignore_errors=True)
+            shutil.copytree(DENSITY_DIR, Path(bundle_dir) / 'density')
+            density_tiles = ('density', index)
+        else:
+            url = os.path.relpath(DENSITY_DIR, Path(output_path).resolve().parent)
+            density_tiles = (Path(url).as_posix(), index)
+
+    m = build_map(iris_levels_loader(), bpe_loader(), counts, access,
+                  density_tiles=density_tiles, density_images=density_images)
+
+    if bundle_dir is not None:
+        write_bundle(m, bundle_dir)
+        return
+
+    with span('html save', cat='io') as s:
+        m.save(output_path)
+        s.set(bytes=Path(output_path).stat().st_size)
+    logger.info(f"Map saved: {output_path}")
@@ -0,0 +1,487 @@
+"""
+Couches folium spécifiques au projet
+
+Les données sont sérialisées une seule fois sous forme de tableaux compacts ;
+les objets Leaflet (marqueurs, popups, icônes) sont créés dans le navigateur.
+"""
+
+import folium
+import numpy as np
+import pandas as pd
+import shapely
+from branca.element import MacroElement
+from folium.map import Layer
+from folium.template import Template
+from folium.utilities import get_obj_in_upper_tree
+
+from utils.colocation import location_table
+
+# Précision des coordonnées WGS84 transmises (1e-5 degré ~ 1 m)
+COORD_DECIMALS = 5
+
+
+def _encode_column(values: pd.Series) -> dict:
+    """Encode une colonne texte en dictionnaire + indices"""
+    codes, uniques = pd.factorize(values.astype('string'), use_na_sentinel=True)
+    return {'values': [str(v) for v in uniques], 'codes': codes.tolist()}
+
+
+def point_data(points) -> dict:
+    """
+    Colonnes compactes des emplacements d'un ensemble d'équipements (WGS84)
+
+    Chaque emplacement (voir location_table) est transmis avec ses
+    coordonnées et son nombre d'équipements (`total`) ; ses entrées (TYPEQU,
+    effectif et, s'il y a plusieurs catégories, catégorie) occupent les
+    indices offsets[i] à offsets[i + 1] - 1.
+    """
+    locations, entries = location_table(points)
+    sizes = np.bincount(entries['location'].to_numpy(), minlength=len(locations))
+    data = {
+        'lat': np.round(locations['lat'].to_numpy(), COORD_DECIMALS).tolist(),
+        'lon': np.round(locations['lon'].to_numpy(), COORD_DECIMALS).tolist(),
+        'total': locations['count'].tolist(),
+        'offsets': np.r_[0, np.cumsum(sizes)].tolist(),
+        'typequ': _encode_column(entries['TYPEQU']),
+        'count': entries['count'].tolist(),
+    }
+    if entries['categorie'].nunique() > 1:
+        data['category'] = _encode_column(entries['categorie'])
+    if 'DEPCOM' in locations.columns:
+        data['depcom'] = _encode_column(locations['DEPCOM'])
+    return data
+
+
+# Fonctions JS communes : icône de catégorie et création du marqueur d'un
+# emplacement à partir des colonnes produites par point_data()
+POINT_MARKER_JS = """
+            var icon = L.AwesomeMarkers.icon({
+                icon: {{ this.icon|tojson }}, markerColor: {{ this.color|tojson }},
+                iconColor: 'white', prefix: 'glyphicon', extraClasses: 'fa-rotate-0'
+            });
+            var category = {{ this.category|tojson }};
+            var types = data.typequ.values, typeCodes = data.typequ.codes;
+            var categories = data.category ? data.category.values : null;
+            var categoryCodes = data.category ? data.category.codes : null;
+            var communes = data.depcom ? data.depcom.values : null;
+            var communeCodes = data.depcom ? data.depcom.codes : null;
+
+            function entryCategory(k) {
+                return categories ? categories[categoryCodes[k]] : category;
+            }
+
+            function popup(i) {
+                var start = data.offsets[i], end = data.offsets[i + 1], html;
+                if (data.total[i] === 1) {
+                    html = '<b>Type:</b> ' + types[typeCodes[start]] + '<br>'
+                         + '<b>Catégorie:</b> ' + entryCategory(start) + '<br>';
+                } else {
+                    html = '<b>' + data.total[i] + ' équipements</b><br>';
+                    if (!categories) html += '<b>Catégorie:</b> ' + category + '<br>';
+                    for (var k = start; k < end; k++) {
+                        html += types[typeCodes[k]] + (data.count[k] > 1 ? ' ×' + data.count[k] : '')
+                              + (categories ? ' (' + entryCategory(k) + ')' : '') + '<br>';
+                    }
+                }
+                if (communes && communeCodes[i] >= 0) {
+                    html += '<b>Commune:</b> ' + communes[communeCodes[i]] + '<br>';
+                }
+                return html;
+            }
+
+            function pointMarker(i) {
+                var marker = L.marker([data.lat[i], data.lon[i]], {icon: icon});
+                var start = data.offsets[i];
+                marker.bindPopup(popup.bind(null, i), {maxWidth: 200, maxHeight: 300});
+                marker.bindTooltip(data.total[i] === 1
+                    ? entryCategory(start) + ' - ' + types[typeCodes[start]]
+                    : category + ' - ' + data.total[i] + ' équipements');
+                return marker;
+            }
+"""
+
+# Transmission des données d'un élément : en ligne, ou, dans un bundle
+# (utils.bundle), depuis un fichier chargé au premier affichage de la couche.
+# Le script de l'élément définit `map`, `group` (couche surveillée) et
+# `setup(payload)`.
+LOAD_PAYLOAD_JS = """
+            {%- if this.bundle_name %}
+            mobiticBundle.onShow(group, map, {{ this.bundle_name|tojson }}, setup);
+            {%- elif this.source %}
+            setup({{ this.source.get_name() }}.payload);
+            {%- else %}
+            setup({{ this.payload|tojson }});
+            {%- endif %}
+"""
+
+
+class BundledPayload:
+    """
+    Données (`payload`) d'un élément, incluses dans la page ou écrites à part
+
+    Attributes:
+        bundle_name: Nom du fichier de données dans un bundle (None = en ligne)
+    """
+
+    bundle_name = None
+
+    def render(self, **kwargs):
+        self.map_name = get_obj_in_upper_tree(self, folium.Map).get_name()
+        super().render(**kwargs)
+
+
+class BulkMarkers(BundledPayload, MacroElement):
+    """
+    Ajoute en une fois tous les points d'une catégorie à un MarkerCluster
+
+    Les points sont transmis sous forme de colonnes (latitudes, longitudes,
+    codes TYPEQU et communes encodés par dictionnaire), un marqueur par
+    emplacement (voir group_colocated). Une seule icône est créée par
+    catégorie ; popups et infobulles sont générées à l'ouverture.
+
+    Args:
+        points: GeoDataFrame WGS84 (colonnes TYPEQU, éventuellement DEPCOM)
+        category: Nom de la catégorie affiché dans les popups
+        color: Couleur du marqueur (Leaflet.awesome-markers)
+        icon: Nom de l'icône glyphicon
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this.map_name }}, group = {{ this._parent.get_name() }};
+
+            function setup(data) {
+    """ + POINT_MARKER_JS + """
+                var markers = new Array(data.lat.length);
+                for (var i = 0; i < data.lat.length; i++) {
+                    markers[i] = pointMarker(i);
+                }
+                group.addLayers(markers);
+            }
+    """ + LOAD_PAYLOAD_JS + """
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, points, category: str, color: str, icon: str):
+        super().__init__()
+        self._name = 'BulkMarkers'
+        self.category = category
+        self.color = color
+        self.icon = icon
+        self.payload = point_data(points)
+
+
+class PrecomputedClusters(BundledPayload, MacroElement):
+    """
+    Affiche dans un FeatureGroup les groupes précalculés d'une catégorie
+
+    À chaque déplacement, seuls les groupes du zoom courant situés dans la
+    vue sont dessinés ; au-delà du zoom maximal des groupes, les équipements
+    sont affichés individuellement (toujours limités à la vue).
+
+    Args:
+        points: GeoDataFrame WGS84 des équipements de la catégorie
+        levels: Groupes par zoom des emplacements de la catégorie, tels que
+            renvoyés par cluster_categories()
+        category: Nom de la catégorie
+        color: Couleur de la catégorie
+        icon: Nom de l'icône glyphicon
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var minZoom = {{ this.min_zoom }}, maxZoom = {{ this.max_zoom }};
+            var map = {{ this.map_name }}, group = {{ this._parent.get_name() }};
+            var color = {{ this.color|tojson }};
+
+            function setup(payload) {
+                var data = payload.data, levels = payload.levels;
+    """ + POINT_MARKER_JS + """
+                function clusterMarker(lat, lon, n, zoom) {
+                    var size = n < 10 ? 26 : n < 100 ? 32 : n < 1000 ? 38 : 46;
+                    var marker = L.marker([lat, lon], {icon: L.divIcon({
+                        className: '', iconSize: [size, size],
+                        html: '<div style="width:' + size + 'px;height:' + size + 'px;'
+                            + 'line-height:' + size + 'px;border-radius:50%;background:' + color + ';'
+                            + 'opacity:0.85;color:white;font-weight:bold;text-align:center;'
+                            + 'border:2px solid white;box-sizing:border-box">' + n + '</div>'
+                    })});
+                    marker.bindTooltip(category + ' : ' + n + ' équipements');
+                    marker.on('click', function() { map.setView([lat, lon], zoom + 2); });
+                    return marker;
+                }
+
+                function render() {
+                    group.clearLayers();
+                    if (!map.hasLayer(group)) return;
+                    var zoom = map.getZoom(), bounds = map.getBounds().pad(0.2), layers = [];
+                    if (zoom > maxZoom) {
+                        for (var i = 0; i < data.lat.length; i++) {
+                            if (bounds.contains([data.lat[i], data.lon[i]])) layers.push(pointMarker(i));
+                        }
+                    } else {
+                        var level = levels[Math.max(minZoom, zoom)];
+                        for (var j = 0; j < level.count.length; j++) {
+                            if (!bounds.contains([level.lat[j], level.lon[j]])) continue;
+                            layers.push(level.point[j] >= 0 ? pointMarker(level.point[j])
+                                : clusterMarker(level.lat[j], level.lon[j], level.count[j], zoom));
+                        }
+                    }
+                    layers.forEach(function(layer) { group.addLayer(layer); });
+                }
+
+                map.on('moveend', render);
+                group.on('add', render);
+                render();
+            }
+    """ + LOAD_PAYLOAD_JS + """
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, points, levels: dict, category: str, color: str, icon: str):
+        super().__init__()
+        self._name = 'PrecomputedClusters'
+        self.category = category
+        self.color = color
+        self.icon = icon
+        self.min_zoom = min(levels)
+        self.max_zoom = max(levels)
+        self.payload = {
+            'data': point_data(points),
+            'levels': {
+                zoom: {
+                    'lat': np.round(level['lat'], COORD_DECIMALS).tolist(),
+                    'lon': np.round(level['lon'], COORD_DECIMALS).tolist(),
+                    'count': level['count'].tolist(),
+                    'point': level['point'].tolist(),
+                }
+                for zoom, level in levels.items()
+            },
+        }
+
+
+def encode_polygons(geometries, decimals: int) -> list:
+    """
+    Quantifie et encode en différences successives des (Multi)Polygones WGS84
+
+    Les coordonnées sont arrondies à `decimals` décimales et converties en
+    entiers ; chaque anneau est transmis sous la forme [x0, y0, dx1, dy1, ...].
+    L'arrondi étant le même pour tous, les sommets partagés par deux IRIS
+    restent identiques. Les anneaux réduits à moins de 4 points par l'arrondi
+    sont supprimés.
+
+    Returns:
+        Pour chaque géométrie, la liste de ses polygones (listes d'anneaux)
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    parts, part_geometry = shapely.get_parts(geometries, return_index=True)
+    rings, ring_part = shapely.get_rings(parts, return_index=True)
+    coords, coord_ring = shapely.get_coordinates(rings, return_index=True)
+
+    quantized = np.round(coords * 10 ** decimals).astype('int64')
+
+    # Points consécutifs confondus après arrondi
+    same_ring = np.r_[False, coord_ring[1:] == coord_ring[:-1]]
+    duplicate = same_ring & np.r_[False, (quantized[1:] == quantized[:-1]).all(axis=1)]
+    quantized, coord_ring = quantized[~duplicate], coord_ring[~duplicate]
+    same_ring = same_ring[~duplicate]
+
+    deltas = quantized.copy()
+    deltas[1:] -= quantized[:-1]
+    deltas[~same_ring] = quantized[~same_ring]
+
+    counts = np.bincount(coord_ring, minlength=len(rings))
+    offsets = np.r_[0, np.cumsum(counts * 2)]
+    flat = deltas.ravel().tolist()
+
+    encoded = [[] for _ in range(len(geometries))]
+    polygon, polygon_part = None, -1
+    for ring, part in enumerate(ring_part):
+        is_exterior = part != polygon_part
+        if is_exterior:
+            polygon, polygon_part = None, part
+            if counts[ring] >= 4:
+                polygon = []
+                encoded[part_geometry[part]].append(polygon)
+        if polygon is not None and counts[ring] >= 4:
+            polygon.append(flat[offsets[ring]:offsets[ring + 1]])
+
+    return encoded
+
+
+class MultiLevelGeoJson(BundledPayload, Layer):
+    """
+    Couche de polygones dont la géométrie dépend du zoom
+
+    Chaque niveau (contours plus ou moins simplifiés) est transmis quantifié
+    et encodé en différences (voir encode_polygons) ; il n'est décodé en
+    GeoJSON dans le navigateur qu'au premier zoom où il est affiché. Les
+    attributs ne sont transmis qu'une fois pour tous les niveaux.
+
+    Une seconde couche peut réutiliser les géométries d'une première
+    (`source`) en leur appliquant ses propres couleurs, par exemple pour
+    une choroplèthe.
+
+    Args:
+        levels: GeoDataFrame WGS84, une ligne par entité et par niveau, avec
+            une colonne `zoom` (zoom minimal du niveau). Les entités sont
+            dans le même ordre à chaque niveau.
+        decimals: Décimales conservées par niveau {zoom: décimales}
+        name: Nom de la couche dans le contrôle des couches
+        fields: Attributs affichés dans l'infobulle
+        aliases: Libellés de ces attributs
+        style: Style Leaflet des polygones
+        highlight: Style appliqué au survol
+        source: MultiLevelGeoJson déjà ajoutée à la carte dont les
+            géométries et attributs sont réutilisés (levels est alors ignoré)
+        colors: Couleur de remplissage de chaque entité (ordre des entités)
+        extra: Valeurs supplémentaires de l'infobulle {libellé: valeurs}
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = L.featureGroup();
+        (function() {
+            var group = {{ this.get_name() }}, map = {{ this.map_name }};
+            var style = {{ this.style|tojson }}, highlight = {{ this.highlight|tojson }};
+            var colors = {{ this.colors|tojson }}, extra = {{ this.extra|tojson }};
+            var layers = {}, current = null, payload = null;
+
+            function featureStyle(i) {
+                return colors ? Object.assign({}, style, {fillColor: colors[i]}) : style;
+            }
+
+            function escape(value) {
+                return String(value).replace(/&/g, '&amp;').replace(/</g, '&lt;');
+            }
+
+            function tooltip(i) {
+                var row = payload.properties[i], html = '<table>';
+                for (var j = 0; j < payload.aliases.length; j++) {
+                    html += '<tr><th>' + escape(payload.aliases[j]) + '</th><td>'
+                          + escape(row[j]) + '</td></tr>';
+                }
+                for (var k = 0; k < extra.length; k++) {
+                    html += '<tr><th>' + escape(extra[k][0]) + '</th><td>'
+                          + escape(extra[k][1][i]) + '</td></tr>';
+                }
+                return html + '</table>';
+            }
+
+            function decodeRing(ring, scale) {
+                var coords = new Array(ring.length / 2), x = 0, y = 0;
+                for (var i = 0; i < ring.length; i += 2) {
+                    x += ring[i];
+                    y += ring[i + 1];
+                    coords[i / 2] = [x / scale, y / scale];
+                }
+                return coords;
+            }
+
+            function buildLayer(level) {
+                var features = [];
+                level.geometries.forEach(function(polygons, i) {
+                    if (!polygons.length) return;
+                    features.push({type: 'Feature', properties: i, geometry: {
+                        type: 'MultiPolygon',
+                        coordinates: polygons.map(function(rings) {
+                            return rings.map(function(ring) { return decodeRing(ring, level.scale); });
+                        })
+                    }});
+                });
+                return L.geoJSON(features, {
+                    style: function(feature) { return featureStyle(feature.properties); },
+                    onEachFeature: function(feature, layer) {
+                        layer.bindTooltip(tooltip.bind(null, feature.properties), {sticky: true});
+                        layer.on('mouseover', function() { layer.setStyle(highlight); });
+                        layer.on('mouseout', function() { layer.setStyle(featureStyle(feature.properties)); });
+                    }
+                });
+            }
+
+            function update() {
+                var zoom = map.getZoom(), index = 0;
+                for (var i = 0; i < payload.levels.length; i++) {
+                    if (zoom >= payload.levels[i].minZoom) index = i;
+                }
+                if (index === current) return;
+                if (current !== null) group.removeLayer(layers[current]);
+                layers[index] = layers[index] || buildLayer(payload.levels[index]);
+                group.addLayer(layers[index]);
+                current = index;
+            }
+
+            function setup(data) {
+                payload = group.payload = data;
+                map.on('zoomend', update);
+                update();
+            }
+    """ + LOAD_PAYLOAD_JS + """
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, levels=None, decimals: dict = None, name: str = None, fields: list = (),
+                 aliases: list = None, style: dict = None, highlight: dict = None,
+                 source: 'MultiLevelGeoJson' = None, colors: list = None, extra: dict = None,
+                 overlay: bool = True, control: bool = True, show: bool = True):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = 'MultiLevelGeoJson'
+        self.style = style or {}
+        self.highlight = {**self.style, **(highlight or {})}
+        self.source = source
+        self.colors = list(colors) if colors is not None else None
+        self.extra = [[label, np.asarray(values).tolist()] for label, values in (extra or {}).items()]
+        if source is not None:
+            self.payload = source.payload
+            return
+
+        zooms = sorted(levels['zoom'].unique())
+        first = levels[levels['zoom'] == zooms[0]]
+        self.payload = {
+            'aliases': list(aliases or fields),
+            'properties': first[list(fields)].astype('string').fillna('').values.tolist(),
+            'levels': [],
+        }
+        for zoom in zooms:
+            level = levels[levels['zoom'] == zoom]
+            if len(level) != len(first):
+                raise ValueError(f"Level z{zoom} has {len(level)} features, expected {len(first)}")
+            self.payload['levels'].append({
+                'minZoom': int(zoom),
+                'scale': 10 ** decimals[zoom],
+                'geometries': encode_polygons(level.geometry.to_numpy(), decimals[zoom]),
+            })
+
+
+class LinkedImageOverlay(Layer):
+    """
+    Image superposée référencée par son URL
+
+    folium.raster_layers.ImageOverlay intègre en base64 les fichiers
+    locaux ; ici l'image reste un fichier, que Leaflet ne télécharge qu'au
+    premier affichage de la couche.
+
+    Args:
+        url: URL de l'image, relative à la page
+        bounds: Emprise [[sud, ouest], [nord, est]]
+        name: Nom de la couche dans le contrôle des couches
+        show: Couche affichée au chargement
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.imageOverlay(
+                {{ this.url|tojson }}, {{ this.bounds|tojson }}, {});
+        {% endmacro %}
+    """)
+
+    def __init__(self, url: str, bounds: list, name: str = None, show: bool = True):
+        super().__init__(name=name, overlay=True, control=True, show=show)
+        self._name = 'LinkedImageOverlay'
+        self.url = url
+        self.bounds = bounds
@@ -0,0 +1,207 @@
+"""
+Jeux de données partitionnés par département (format hive)
+
+Les intermédiaires BPE et IRIS sont stockés une partition par département :
+
+    bpe/
+    ├── _manifest.json          # source, empreinte et volume de chaque partition
+    ├── dep=01/part-0.parquet
+    └── dep=69/part-0.parquet
+
+Le manifeste associe à chaque partition la clé du traitement qui l'a
+produite (version de la source + paramètres) : élargir DEPARTEMENTS ne
+construit que les partitions manquantes ou périmées, et les loaders ne
+lisent que les partitions demandées (élagage par le chemin `dep=XX`).
+La colonne `dep` n'est pas stockée dans les fichiers : elle est rétablie
+à la lecture depuis le chemin.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+PARTITION_KEY = 'dep'
+PARTITION_FILE = 'part-0.parquet'
+MANIFEST_FILE = '_manifest.json'   # préfixe '_' : ignoré par les lecteurs parquet
+ROW_GROUP_ROWS = 65_536            # Lignes par groupe : lecture par lots en mémoire bornée
+
+# Valeurs de partition lues comme chaînes ('01' et non 1)
+PARTITIONING = ds.partitioning(pa.schema([(PARTITION_KEY, pa.string())]), flavor='hive')
+
+
+def partition_path(root: Path, dep: str) -> Path:
+    """Fichier de la partition d'un département"""
+    return Path(root) / f"{PARTITION_KEY}={dep}" / PARTITION_FILE
+
+
+def partition_paths(root: Path, departements: list) -> list:
+    """Fichiers des partitions de `departements` (entrées / sorties des étapes)"""
+    return [partition_path(root, dep) for dep in departements]
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PartitionedDataset:
+    """
+    Jeu de données partitionné par département, avec son manifeste
+
+    Args:
+        root: Dossier du jeu de données
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.manifest_path = self.root / MANIFEST_FILE
+        self._lock = threading.Lock()
+        self._manifest = self._load_manifest()
+
+    def _load_manifest(self) -> dict:
+        if self.manifest_path.exists():
+            try:
+                with open(self.manifest_path, encoding='utf-8') as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Manifest unreadable, partitions will be rebuilt ({e})")
+        return {'partitions': {}}
+
+    def _save_manifest(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix='_', suffix='.json')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self._manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.manifest_path)
+
+    def entry(self, dep: str) -> dict:
+        """Entrée du manifeste d'une partition (None si absente ou sans fichier)"""
+        entry = self._manifest['partitions'].get(dep)
+        if entry is None or not partition_path(self.root, dep).exists():
+            return None
+        return entry
+
+    def stale(self, departements: list, keys) -> list:
+        """
+        Départements dont la partition manque ou a été produite avec une
+        autre clé
+
+        Args:
+            keys: Clé attendue, commune (str) ou par département (dict)
+        """
+        return [dep for dep in departements
+                if (self.entry(dep) or {}).get('key') != (keys[dep] if isinstance(keys, dict) else keys)]
+
+    def temporary_path(self, dep: str) -> Path:
+        """Fichier où écrire une partition avant de la valider (voir commit)"""
+        path = partition_path(self.root, dep)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path.with_name(f".{PARTITION_FILE}.tmp")
+
+    def commit(self, dep: str, tmp: Path, key: str, source: str, rows: int):
+        """
+        Remplace la partition d'un département par le fichier `tmp` et
+        l'enregistre au manifeste
+
+        Args:
+            key: Clé du traitement (voir stale)
+            source: Version de la source (millésime, empreinte...)
+            rows: Nombre de lignes écrites
+        """
+        path = partition_path(self.root, dep)
+        os.replace(tmp, path)
+
+        with self._lock:
+            self._manifest['partitions'][dep] = {
+                'key': key,
+                'source': source,
+                'sha256': _sha256(path),
+                'rows': rows,
+                'bytes': path.stat().st_size,
+                'updated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            }
+            self._save_manifest()
+
+    def write(self, dep: str, frame: pd.DataFrame, key: str, source: str):
+        """
+        Écrit la partition d'un département et l'enregistre au manifeste
+
+        Args:
+            frame: Lignes du département (DataFrame ou GeoDataFrame)
+            key: Clé du traitement (voir stale)
+            source: Version de la source (millésime, empreinte...)
+        """
+        tmp = self.temporary_path(dep)
+        frame.drop(columns=[PARTITION_KEY], errors='ignore').to_parquet(
+            tmp, index=False, row_group_size=ROW_GROUP_ROWS)
+        self.commit(dep, tmp, key, source, len(frame))
+
+    def write_many(self, frame: pd.DataFrame, values, departements: list, keys, source) -> list:
+        """
+        Écrit une partition par département de `departements`
+
+        Args:
+            values: Département de chaque ligne de `frame`
+            keys: Clé commune (str) ou par département (dict)
+            source: Version de la source, commune (str) ou par département (dict)
+
+        Un département sans aucune ligne (code erroné, absent du millésime)
+        est signalé et reçoit une partition vide : les étapes suivantes le
+        traitent comme zéro ligne au lieu de le croire manquant.
+
+        Returns:
+            Départements écrits
+        """
+        deps = pd.Series(values).astype(str).to_numpy()
+        positions = pd.Series(deps).groupby(deps, sort=False).indices
+        written = []
+        for dep in departements:
+            if dep not in positions:
+                logger.warning(f"No rows for departement {dep}, empty partition written ({self.root.name})")
+            rows = positions.get(dep, [])
+            with span('partition write', cat='io', dataset=self.root.name, dep=dep, rows=len(rows)):
+                self.write(dep, frame.iloc[rows].reset_index(drop=True),
+                           keys[dep] if isinstance(keys, dict) else keys,
+                           source[dep] if isinstance(source, dict) else source)
+            written.append(dep)
+
+        logger.info(f"{self.root.name}: {len(written)} partition(s) written ({', '.join(written)})")
+        return written
+
+    def columns(self) -> list:
+        """Colonnes du jeu de données, y compris la colonne de partition"""
+        for dep in sorted(self._manifest['partitions']):
+            if partition_path(self.root, dep).exists():
+                return pq.read_schema(partition_path(self.root, dep)).names + [PARTITION_KEY]
+        raise FileNotFoundError(f"No partition in {self.root}")
+
+    def read_options(self, departements: list) -> dict:
+        """
+        Options de lecture (pd / gpd.read_parquet sur `root`) limitant la
+        lecture aux partitions de `departements`
+
+        Raises:
+            FileNotFoundError: Si une partition demandée manque
+        """
+        missing = [dep for dep in departements if not partition_path(self.root, dep).exists()]
+        if missing:
+            raise FileNotFoundError(f"Partitions missing in {self.root} for departements "
+                                    f"{', '.join(missing)} (run --download)")
+        return {'filters': [(PARTITION_KEY, 'in', list(departements))], 'partitioning': PARTITIONING}
@@ -0,0 +1,226 @@
+"""
+Exécution incrémentale et parallèle des étapes du pipeline
+
+Chaque étape déclare ses fichiers d'entrée et de sortie. Une étape est à
+jour si ses sorties existent et si l'empreinte de ses entrées (contenu des
+fichiers + paramètres) n'a pas changé depuis sa dernière exécution. Les
+étapes indépendantes s'exécutent en parallèle.
+"""
+
+import cProfile
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+
+from config import OUTPUT_DIR
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_STATE_PATH = OUTPUT_DIR / ".pipeline_state.json"
+
+
+class Stage:
+    """
+    Étape du pipeline
+
+    Args:
+        name: Nom de l'étape
+        func: Fonction exécutée (appelée avec force=... si `forceable`)
+        inputs: Fichiers lus par l'étape
+        outputs: Fichiers produits par l'étape
+        deps: Noms des étapes à exécuter avant celle-ci
+        params: Paramètres pris en compte dans l'empreinte (valeurs sérialisables)
+        always_run: Étape toujours exécutée (sources distantes, revalidées
+            par le cache de téléchargement)
+        forceable: La fonction accepte un argument `force`
+    """
+
+    def __init__(self, name: str, func, inputs: list = (), outputs: list = (),
+                 deps: list = (), params=None, always_run: bool = False,
+                 forceable: bool = False):
+        self.name = name
+        self.func = func
+        self.inputs = [Path(p) for p in inputs]
+        self.outputs = [Path(p) for p in outputs]
+        self.deps = list(deps)
+        self.params = params
+        self.always_run = always_run
+        self.forceable = forceable
+
+    def __repr__(self) -> str:
+        return f"Stage({self.name!r})"
+
+
+class Pipeline:
+    """
+    Graphe d'étapes exécuté par un pool de threads
+
+    Args:
+        stages: Liste des étapes
+        state_path: Fichier JSON mémorisant les empreintes des étapes
+    """
+
+    def __init__(self, stages: list, state_path: Path = PIPELINE_STATE_PATH):
+        self.stages = {stage.name: stage for stage in stages}
+        self.state_path = Path(state_path)
+        self._lock = threading.Lock()
+        self._state = self._load_state()
+
+        for stage in stages:
+            unknown = set(stage.deps) - set(self.stages)
+            if unknown:
+                raise ValueError(f"Stage {stage.name!r} depends on unknown stages {unknown}")
+
+    # ------------------------------------------------------------------
+    # État persistant
+    # ------------------------------------------------------------------
+
+    def _load_state(self) -> dict:
+        if self.state_path.exists():
+            try:
+                with open(self.state_path, encoding='utf-8') as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Pipeline state unreadable, reset ({e})")
+        return {'stages': {}, 'files': {}}
+
+    def _save_state(self):
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.state_path.parent, suffix='.json')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self._state, f, indent=2)
+        os.replace(tmp, self.state_path)
+
+    def file_hash(self, path: Path) -> str:
+        """
+        SHA-256 d'un fichier, recalculé seulement si sa taille
+        ou sa date de modification ont changé
+        """
+        stat = path.stat()
+        key = str(path.resolve())
+        with self._lock:
+            known = self._state['files'].get(key)
+        if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+            return known['sha256']
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+
+        with self._lock:
+            self._state['files'][key] = {
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'sha256': digest.hexdigest(),
+            }
+        return digest.hexdigest()
+
+    def fingerprint(self, stage: Stage) -> str:
+        """Empreinte des entrées et paramètres d'une étape"""
+        inputs = {str(p): self.file_hash(p) if p.exists() else None for p in stage.inputs}
+        payload = json.dumps([inputs, stage.params], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def is_up_to_date(self, stage: Stage) -> bool:
+        if stage.always_run:
+            return False
+        if not all(p.exists() for p in stage.outputs):
+            return False
+        with self._lock:
+            known = self._state['stages'].get(stage.name)
+        return known == self.fingerprint(stage)
+
+    # ------------------------------------------------------------------
+    # Exécution
+    # ------------------------------------------------------------------
+
+    def _run_stage(self, stage: Stage, force: bool, profile_dir: Path = None) -> bool:
+        if not force and self.is_up_to_date(stage):
+            logger.info(f"[{stage.name}] up to date, skipped")
+            return False
+
+        logger.info(f"[{stage.name}] started")
+        start = time.perf_counter()
+        profiler = cProfile.Profile() if profile_dir is not None else None
+        with span(stage.name, cat='stage'):
+            if profiler is not None:
+                profiler.enable()
+            try:
+                if stage.forceable:
+                    stage.func(force=force)
+                else:
+                    stage.func()
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                    Path(profile_dir).mkdir(parents=True, exist_ok=True)
+                    profiler.dump_stats(Path(profile_dir) / f"{stage.name}.prof")
+        logger.info(f"[{stage.name}] done in {time.perf_counter() - start:.1f}s")
+
+        fingerprint = self.fingerprint(stage)
+        with self._lock:
+            self._state['stages'][stage.name] = fingerprint
+            self._save_state()
+        return True
+
+    def run(self, targets: list = None, jobs: int = 1, force: bool = False,
+            profile_dir: Path = None) -> dict:
+        """
+        Exécute les étapes `targets` (toutes par défaut)
+
+        Les dépendances hors de `targets` sont supposées déjà produites.
+
+        Args:
+            targets: Noms des étapes à exécuter
+            jobs: Nombre d'étapes exécutées simultanément
+            force: Réexécuter les étapes même si elles sont à jour
+            profile_dir: Si renseigné, chaque étape exécutée est profilée
+                (cProfile) dans <profile_dir>/<étape>.prof ; les étapes
+                s'exécutent alors une à une (un seul profileur actif)
+
+        Returns:
+            {nom de l'étape: True si exécutée, False si à jour}
+        """
+        if profile_dir is not None and jobs > 1:
+            logger.info("Profiling: stages run one at a time")
+            jobs = 1
+
+        selected = [name for name in self.stages if targets is None or name in targets]
+        pending = {name: {dep for dep in self.stages[name].deps if dep in selected}
+                   for name in selected}
+        results = {}
+
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            running = {}
+            while pending or running:
+                ready = [name for name, deps in pending.items() if not deps]
+                for name in ready:
+                    del pending[name]
+                    running[executor.submit(self._run_stage, self.stages[name], force,
+                                            profile_dir)] = name
+
+                if not running:
+                    raise RuntimeError(f"Dependency cycle between stages {sorted(pending)}")
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception:
+                        for other in running:
+                            other.cancel()
+                        logger.error(f"[{name}] failed")
+                        raise
+                    for deps in pending.values():
+                        deps.discard(name)
+
+        return results
@@ -0,0 +1,318 @@
+"""
+Téléchargement parallèle et reprenable par requêtes Range
+
+Le fichier est découpé en segments transférés chacun par une requête
+Range sur une session partagée (pool de connexions), et écrits à leur
+position dans un fichier partiel sur disque. L'avancement de chaque
+segment est enregistré à côté du fichier partiel :
+
+    partial/<empreinte de l'URL>.part    # contenu, écrit en place
+    partial/<empreinte de l'URL>.json    # URL, validateurs, segments
+
+Une coupure réseau relance le segment là où il s'est arrêté ; un
+téléchargement interrompu (processus arrêté, tentatives épuisées) reprend
+au passage suivant si le serveur annonce toujours la même version (ETag
+ou Last-Modified, vérifiés aussi par If-Range). La taille finale et, si le
+serveur la fournit, l'empreinte SHA-256 (Repr-Digest / Digest) sont
+vérifiées.
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import requests
+import urllib3
+from tqdm import tqdm
+
+from config import CHUNK_SIZE, DOWNLOAD_MAX_CHUNK_SIZE, DOWNLOAD_CONNECTIONS, DOWNLOAD_SEGMENT_SIZE
+from config import DOWNLOAD_RETRIES, DOWNLOAD_RETRY_DELAY, REQUEST_TIMEOUT
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Coupures après lesquelles un segment est relancé
+TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                    urllib3.exceptions.ProtocolError, urllib3.exceptions.ReadTimeoutError,
+                    ConnectionError)
+
+# Durée visée par lecture : en deçà le chunk double, au-delà de 4x il diminue de moitié
+CHUNK_TARGET_SECONDS = 0.1
+
+# Intervalle minimal entre deux enregistrements de l'avancement (s)
+STATE_SAVE_INTERVAL = 1.0
+
+_DIGEST = re.compile(r'sha-256=:?([A-Za-z0-9+/=]+):?', re.IGNORECASE)
+_CONTENT_RANGE = re.compile(r'bytes\s+\d+-\d+/(\d+)')
+
+
+class IncompleteDownload(Exception):
+    """Le contenu reçu ne correspond pas à la taille ou à l'empreinte annoncées"""
+
+
+class SourceChanged(Exception):
+    """La ressource a changé depuis le début du téléchargement (If-Range)"""
+
+
+def supports_ranges(headers) -> bool:
+    """Le serveur accepte les requêtes Range et annonce la taille (non compressée)"""
+    return headers.get('Accept-Ranges', '').lower() == 'bytes' and \
+        headers.get('Content-Length', '').isdigit() and not headers.get('Content-Encoding')
+
+
+def announced_sha256(headers) -> str:
+    """Empreinte SHA-256 annoncée par le serveur (Repr-Digest ou Digest), en hexadécimal"""
+    for name in ('Repr-Digest', 'Digest'):
+        match = _DIGEST.search(headers.get(name, ''))
+        if match:
+            return base64.b64decode(match.group(1)).hex()
+    return None
+
+
+def read_adaptive(raw, min_size: int = CHUNK_SIZE, max_size: int = DOWNLOAD_MAX_CHUNK_SIZE):
+    """
+    Lit un flux de réponse par chunks dont la taille suit le débit
+
+    Chaque lecture vise CHUNK_TARGET_SECONDS : la taille double tant que
+    les lectures sont plus rapides, et diminue de moitié si elles sont
+    bien plus lentes (connexion lente, progression encore visible).
+    """
+    size = min_size
+    while True:
+        start = time.perf_counter()
+        chunk = raw.read(size)
+        if not chunk:
+            return
+        yield chunk
+        elapsed = time.perf_counter() - start
+        if elapsed < CHUNK_TARGET_SECONDS and size < max_size:
+            size = min(size * 2, max_size)
+        elif elapsed > 4 * CHUNK_TARGET_SECONDS and size > min_size:
+            size = max(size // 2, min_size)
+
+
+class PartialDownload:
+    """
+    Fichier partiel d'une URL et état de ses segments [début, fin, position]
+
+    Args:
+        directory: Dossier des fichiers partiels
+        url: URL téléchargée
+        size: Taille annoncée
+        validator: ETag (ou Last-Modified) de la version téléchargée
+    """
+
+    def __init__(self, directory: Path, url: str, size: int, validator: str):
+        name = hashlib.sha256(url.encode()).hexdigest()[:32]
+        self.path = Path(directory) / f"{name}.part"
+        self.state_path = Path(directory) / f"{name}.json"
+        self.url = url
+        self.size = size
+        self.validator = validator
+        self.segments = []
+        self._lock = threading.Lock()
+        self._saved_at = 0.0
+
+    def resume(self, segment_size: int, connections: int) -> int:
+        """
+        Reprend l'état enregistré s'il porte sur la même version, sinon
+        prépare un fichier vide découpé en segments
+
+        Returns:
+            Octets déjà téléchargés
+        """
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                state = json.load(f)
+            if self.validator and self.path.exists() and self.path.stat().st_size == self.size and \
+                    (state['url'], state['size'], state['validator']) == (self.url, self.size, self.validator):
+                self.segments = state['segments']
+                return sum(pos - start for start, end, pos in self.segments)
+        except (OSError, ValueError, KeyError):
+            pass
+
+        count = max(1, min(connections, self.size // segment_size))
+        bounds = [self.size * i // count for i in range(count + 1)]
+        self.segments = [[bounds[i], bounds[i + 1] - 1, bounds[i]] for i in range(count)]
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'wb') as f:
+            f.truncate(self.size)
+        self.save(force=True)
+        return 0
+
+    def advance(self, index: int, length: int):
+        with self._lock:
+            self.segments[index][2] += length
+        self.save()
+
+    def save(self, force: bool = False):
+        """Enregistre l'avancement (au plus une fois par STATE_SAVE_INTERVAL)"""
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._saved_at < STATE_SAVE_INTERVAL:
+                return
+            self._saved_at = now
+            state = {'url': self.url, 'size': self.size, 'validator': self.validator,
+                     'segments': [list(segment) for segment in self.segments]}
+            tmp = self.state_path.with_suffix('.json.tmp')
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(tmp, self.state_path)
+
+    def complete(self) -> bool:
+        return all(pos > end for start, end, pos in self.segments)
+
+    def discard(self):
+        self.path.unlink(missing_ok=True)
+        self.state_path.unlink(missing_ok=True)
+
+
+def _fetch_segment(session: requests.Session, partial: PartialDownload, index: int, pbar: tqdm,
+                   stop: threading.Event = None):
+    """
+    Transfère un segment, relancé depuis sa position après chaque coupure
+
+    S'arrête au chunk suivant si `stop` est levé (échec d'un autre segment).
+    """
+    start, end, _ = partial.segments[index]
+    attempt = 0
+    while partial.segments[index][2] <= end:
+        if stop is not None and stop.is_set():
+            return
+        pos = partial.segments[index][2]
+        headers = {'Range': f'bytes={pos}-{end}', 'Accept-Encoding': 'identity'}
+        if partial.validator:
+            headers['If-Range'] = partial.validator
+        try:
+            with span('http range', cat='http', range=headers['Range']) as s:
+                response = session.get(partial.url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT)
+                try:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        raise SourceChanged(f"{partial.url} answered {response.status_code} "
+                                            f"to a Range request (If-Range {partial.validator})")
+                    match = _CONTENT_RANGE.match(response.headers.get('Content-Range', ''))
+                    if match and int(match.group(1)) != partial.size:
+                        raise IncompleteDownload(f"{partial.url}: {int(match.group(1)):,} bytes "
+                                                 f"in Content-Range, {partial.size:,} announced")
+                    with open(partial.path, 'r+b') as f:
+                        f.seek(pos)
+                        for chunk in read_adaptive(response.raw):
+                            chunk = chunk[:end + 1 - partial.segments[index][2]]
+                            f.write(chunk)
+                            partial.advance(index, len(chunk))
+                            pbar.update(len(chunk))
+                            if partial.segments[index][2] > end or (stop is not None and stop.is_set()):
+                                break
+                finally:
+                    response.close()
+                s.set(bytes=partial.segments[index][2] - pos)
+
+            if stop is not None and stop.is_set():
+                return
+            if partial.segments[index][2] <= end:
+                raise ConnectionError(f"connection closed at byte {partial.segments[index][2]:,}")
+
+        except TRANSIENT_ERRORS as e:
+            # Une coupure après progression ne compte pas comme un échec répété
+            attempt = 1 if partial.segments[index][2] > pos else attempt + 1
+            partial.save(force=True)
+            if attempt > DOWNLOAD_RETRIES:
+                raise
+            delay = DOWNLOAD_RETRY_DELAY * 2 ** (attempt - 1)
+            logger.warning(f"Segment {index} of {partial.url} interrupted ({e}), "
+                           f"resuming at byte {partial.segments[index][2]:,} in {delay:.1f}s "
+                           f"({attempt}/{DOWNLOAD_RETRIES})")
+            if stop is not None:
+                stop.wait(delay)
+            else:
+                time.sleep(delay)
+
+
+def download_ranges(session: requests.Session, url: str, headers, directory: Path, desc: str = None,
+                    connections: int = DOWNLOAD_CONNECTIONS,
+                    segment_size: int = DOWNLOAD_SEGMENT_SIZE) -> tuple:
+    """
+    Télécharge `url` par requêtes Range parallèles dans un fichier partiel
+
+    Args:
+        session: Session requests partagée par les segments
+        headers: En-têtes d'une réponse à un GET de `url` (taille, validateurs)
+        directory: Dossier des fichiers partiels (reprise)
+        desc: Libellé de la barre de progression
+        connections: Segments transférés en parallèle
+        segment_size: Taille minimale d'un segment
+
+    Returns:
+        (SHA-256 du contenu, chemin du fichier téléchargé). Le fichier
+        appartient à l'appelant, qui le déplace ou le supprime.
+
+    Raises:
+        IncompleteDownload: Si la taille ou l'empreinte ne correspondent
+            pas à celles annoncées (le fichier partiel est supprimé)
+        SourceChanged: Si la ressource a changé en cours de téléchargement
+            (le fichier partiel est supprimé, le téléchargement suivant
+            repart de zéro)
+    """
+    size = int(headers['Content-Length'])
+    # If-Range n'accepte qu'un validateur fort : pas d'ETag faible (W/"...")
+    etag = headers.get('ETag')
+    validator = etag if etag and not etag.startswith('W/') else headers.get('Last-Modified')
+    partial = PartialDownload(directory, url, size, validator)
+    done = partial.resume(segment_size, connections)
+    if done:
+        logger.info(f"Resuming {url} at {done / size:.0%} ({done:,} of {size:,} bytes)")
+
+    pending = [i for i, (start, end, pos) in enumerate(partial.segments) if pos <= end]
+    # Levé au premier échec : les autres segments s'arrêtent sans finir leur transfert
+    stop = threading.Event()
+    with span('http transfer', cat='http', url=url, segments=len(pending)) as s, \
+            tqdm(total=size, initial=done, unit='B', unit_scale=True, desc=desc or url) as pbar:
+        try:
+            if len(pending) > 1:
+                executor = ThreadPoolExecutor(max_workers=len(pending))
+                try:
+                    futures = [executor.submit(_fetch_segment, session, partial, i, pbar, stop) for i in pending]
+                    for future in as_completed(futures):
+                        future.result()
+                except BaseException:
+                    stop.set()
+                    raise
+                finally:
+                    # Attend l'arrêt des segments en cours avant de toucher au fichier partiel
+                    executor.shutdown(wait=True, cancel_futures=True)
+            else:
+                for i in pending:
+                    _fetch_segment(session, partial, i, pbar)
+        except (SourceChanged, IncompleteDownload):
+            partial.discard()
+            raise
+        except BaseException:
+            partial.save(force=True)
+            raise
+        s.set(bytes=pbar.n - done)
+
+    received = partial.path.stat().st_size
+    if not partial.complete() or received != size:
+        partial.discard()
+        raise IncompleteDownload(f"{url}: {received:,} bytes on disk, {size:,} announced")
+
+    with span('hash', cat='io', bytes=size):
+        digest = hashlib.sha256()
+        with open(partial.path, 'rb') as f:
+            for block in iter(lambda: f.read(DOWNLOAD_MAX_CHUNK_SIZE), b''):
+                digest.update(block)
+    expected = announced_sha256(headers)
+    if expected and expected != digest.hexdigest():
+        partial.discard()
+        raise IncompleteDownload(f"{url}: SHA-256 {digest.hexdigest()} differs from announced {expected}")
+
+    partial.state_path.unlink(missing_ok=True)
+    return digest.hexdigest(), partial.path
@@ -0,0 +1,409 @@
+"""
+Serveur local des données de la carte (--serve)
+
+La BPE et les contours IRIS simplifiés sont chargés une seule fois en
+mémoire et indexés (un STRtree et des groupes précalculés par catégorie,
+un STRtree par niveau de contours). La page servie interroge l'API à
+chaque déplacement de la carte :
+
+    /api/points?bbox=ouest,sud,est,nord&zoom=12&categories=Santé,Commerces
+    /api/iris?bbox=ouest,sud,est,nord&zoom=12
+
+Les réponses (JSON en colonnes ou GeoJSON avec format=geojson) sont
+calculées pour l'emprise arrondie à la grille des tuiles du zoom, ce qui
+permet de les conserver dans un cache LRU ; elles sont compressées en gzip
+si le navigateur l'accepte.
+"""
+
+import gzip
+import json
+import logging
+import mimetypes
+import time
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
+
+import numpy as np
+import pandas as pd
+import shapely
+from folium.template import Template
+
+from config import (OFFLINE_ASSETS_DIR, SERVER_HOST, SERVER_PORT, SERVER_CACHE_SIZE,
+                    IRIS_LEVELS, CATEGORIES, CATEGORY_NAMES)
+from utils.clustering import cluster_points
+from utils.data_manager import bpe_loader, iris_levels_loader
+from utils.map_layers import COORD_DECIMALS
+
+logger = logging.getLogger(__name__)
+
+IRIS_PROPERTIES = ['code_iris', 'nom_iris']
+
+
+class BadRequest(ValueError):
+    """Paramètres de requête invalides (réponse 400)"""
+
+
+def snap_bbox(bbox: tuple, zoom: int) -> tuple:
+    """Élargit une emprise à la grille des tuiles (en degrés) du zoom `zoom`"""
+    step = 360.0 / 2 ** zoom
+    west, south, east, north = bbox
+    return (max(-180.0, np.floor(west / step) * step), max(-90.0, np.floor(south / step) * step),
+            min(180.0, np.ceil(east / step) * step), min(90.0, np.ceil(north / step) * step))
+
+
+def _rounded(values: np.ndarray) -> list:
+    return np.round(values, COORD_DECIMALS).tolist()
+
+
+class CategoryIndex:
+    """
+    Équipements d'une catégorie indexés pour les requêtes par emprise
+
+    Jusqu'au zoom maximal des groupes précalculés, une requête renvoie les
+    groupes du zoom (et les équipements isolés) ; au-delà, les équipements
+    de l'emprise, trouvés par le STRtree.
+    """
+
+    def __init__(self, points: pd.DataFrame):
+        self.lon = points.geometry.x.to_numpy()
+        self.lat = points.geometry.y.to_numpy()
+        self.typequ = points['TYPEQU'].astype('string').fillna('').to_numpy(dtype=object)
+        self.depcom = (points['DEPCOM'].astype('string').fillna('').to_numpy(dtype=object)
+                       if 'DEPCOM' in points.columns else None)
+        self.tree = shapely.STRtree(shapely.points(self.lon, self.lat))
+        self.levels = cluster_points(self.lon, self.lat)
+        self.min_zoom, self.max_zoom = min(self.levels), max(self.levels)
+
+    def query(self, bbox: tuple, zoom: int) -> tuple:
+        """
+        Returns:
+            (groupes {'lon', 'lat', 'count'}, indices des équipements isolés)
+        """
+        if zoom > self.max_zoom:
+            indices = np.sort(self.tree.query(shapely.box(*bbox)))
+            return {'lon': [], 'lat': [], 'count': []}, indices
+
+        level = self.levels[max(zoom, self.min_zoom)]
+        west, south, east, north = bbox
+        inside = ((level['lon'] >= west) & (level['lon'] <= east)
+                  & (level['lat'] >= south) & (level['lat'] <= north))
+        grouped = inside & (level['count'] > 1)
+        clusters = {
+            'lon': _rounded(level['lon'][grouped]),
+            'lat': _rounded(level['lat'][grouped]),
+            'count': level['count'][grouped].tolist(),
+        }
+        return clusters, np.sort(level['point'][inside & (level['count'] == 1)])
+
+    def points(self, indices: np.ndarray) -> dict:
+        data = {
+            'lon': _rounded(self.lon[indices]),
+            'lat': _rounded(self.lat[indices]),
+            'typequ': self.typequ[indices].tolist(),
+        }
+        if self.depcom is not None:
+            data['depcom'] = self.depcom[indices].tolist()
+        return data
+
+
+class IrisIndex:
+    """Contours IRIS d'un niveau de simplification, sérialisés à l'avance"""
+
+    def __init__(self, level: pd.DataFrame, decimals: int):
+        geometries = shapely.transform(level.geometry.to_numpy(), lambda c: np.round(c, decimals))
+        columns = [col for col in IRIS_PROPERTIES if col in level.columns]
+        properties = level[columns].astype('string').fillna('').to_dict('records')
+        self.features = [
+            f'{{"type":"Feature","properties":{json.dumps(props, ensure_ascii=False)},'
+            f'"geometry":{geometry}}}'
+            for props, geometry in zip(properties, shapely.to_geojson(geometries))
+        ]
+        self.tree = shapely.STRtree(level.geometry.to_numpy())
+
+    def query(self, bbox: tuple) -> str:
+        indices = np.sort(self.tree.query(shapely.box(*bbox)))
+        return '{"type":"FeatureCollection","features":[' + \
+            ','.join(self.features[i] for i in indices) + ']}'
+
+
+class MapData:
+    """
+    Données de la carte chargées en mémoire et cache des réponses
+
+    Args:
+        cache_size: Nombre de réponses conservées (LRU)
+    """
+
+    def __init__(self, cache_size: int = SERVER_CACHE_SIZE):
+        start = time.perf_counter()
+        bpe_gdf = bpe_loader(['TYPEQU', 'DEPCOM'])
+        self.categories = {
+            cat: CategoryIndex(points)
+            for cat, points in bpe_gdf.groupby('categorie', observed=True)
+        }
+
+        iris_levels = iris_levels_loader()
+        decimals = {zoom: dec for zoom, _, dec in IRIS_LEVELS}
+        self.iris = {
+            int(zoom): IrisIndex(level, decimals.get(zoom, COORD_DECIMALS))
+            for zoom, level in iris_levels.groupby('zoom')
+        }
+
+        self.response = lru_cache(maxsize=cache_size)(self._response)
+        logger.info(f"{len(bpe_gdf):,} equipments and {len(self.iris)} IRIS levels indexed "
+                    f"in {time.perf_counter() - start:.1f}s")
+
+    def category_list(self) -> list:
+        return [{'name': cat, 'color': CATEGORIES.get(cat, {}).get('color', 'gray'),
+                 'count': len(self.categories[cat].lon)}
+                for cat in CATEGORY_NAMES if cat in self.categories]
+
+    def points_payload(self, bbox: tuple, zoom: int, categories: tuple, fmt: str) -> str:
+        result = {}
+        for cat in categories:
+            index = self.categories.get(cat)
+            if index is None:
+                continue
+            clusters, indices = index.query(bbox, zoom)
+            result[cat] = {'clusters': clusters, 'points': index.points(indices)}
+
+        if fmt == 'json':
+            return json.dumps(result, ensure_ascii=False, separators=(',', ':'))
+
+        features = []
+        for cat, data in result.items():
+            clusters, points = data['clusters'], data['points']
+            for lon, lat, count in zip(clusters['lon'], clusters['lat'], clusters['count']):
+                features.append({'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+                                 'properties': {'categorie': cat, 'count': count}})
+            for i, (lon, lat) in enumerate(zip(points['lon'], points['lat'])):
+                properties = {'categorie': cat, 'TYPEQU': points['typequ'][i]}
+                if 'depcom' in points:
+                    properties['DEPCOM'] = points['depcom'][i]
+                features.append({'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+                                 'properties': properties})
+        return json.dumps({'type': 'FeatureCollection', 'features': features},
+                          ensure_ascii=False, separators=(',', ':'))
+
+    def iris_payload(self, bbox: tuple, zoom: int) -> str:
+        level = max((z for z in self.iris if z <= zoom), default=min(self.iris))
+        return self.iris[level].query(bbox)
+
+    def _response(self, kind: str, bbox: tuple, zoom: int, categories: tuple, fmt: str) -> tuple:
+        """Corps de la réponse, brut et compressé (mis en cache)"""
+        if kind == 'points':
+            body = self.points_payload(bbox, zoom, categories, fmt)
+        else:
+            body = self.iris_payload(bbox, zoom)
+        raw = body.encode('utf-8')
+        return raw, gzip.compress(raw, compresslevel=5)
+
+
+def parse_query(query: dict) -> tuple:
+    """Emprise (arrondie à la grille des tuiles), zoom, catégories et format"""
+    try:
+        bbox = tuple(float(v) for v in query['bbox'][0].split(','))
+        zoom = int(query.get('zoom', ['12'])[0])
+    except (KeyError, ValueError):
+        raise BadRequest("expected bbox=west,south,east,north and an integer zoom")
+    if len(bbox) != 4 or not 0 <= zoom <= 22:
+        raise BadRequest("expected bbox=west,south,east,north and 0 <= zoom <= 22")
+
+    categories = query.get('categories', [''])[0]
+    categories = tuple(sorted(c for c in categories.split(',') if c)) if categories else tuple(CATEGORY_NAMES)
+    fmt = query.get('format', ['json'])[0]
+    if fmt not in ('json', 'geojson'):
+        raise BadRequest("format must be 'json' or 'geojson'")
+    return snap_bbox(bbox, zoom), zoom, categories, fmt
+
+
+class MapRequestHandler(BaseHTTPRequestHandler):
+    """Page de la carte, ressources de offline_assets et API de données"""
+
+    server_version = 'mobiTIC'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            if url.path in ('/', '/index.html'):
+                self._send(self.server.page.encode('utf-8'), 'text/html; charset=utf-8')
+            elif url.path == '/api/categories':
+                self._send(json.dumps(self.server.data.category_list(), ensure_ascii=False).encode('utf-8'),
+                           'application/json')
+            elif url.path in ('/api/points', '/api/iris'):
+                bbox, zoom, categories, fmt = parse_query(parse_qs(url.query))
+                kind = url.path.rsplit('/', 1)[1]
+                if kind == 'iris':
+                    categories, fmt = (), 'geojson'
+                raw, compressed = self.server.data.response(kind, bbox, zoom, categories, fmt)
+                content_type = 'application/geo+json' if fmt == 'geojson' else 'application/json'
+                if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    self._send(compressed, content_type, {'Content-Encoding': 'gzip'})
+                else:
+                    self._send(raw, content_type)
+            elif url.path.startswith('/assets/'):
+                self._send_asset(unquote(url.path[len('/assets/'):]))
+            else:
+                self._error(404, 'not found')
+        except BadRequest as e:
+            self._error(400, str(e))
+        except Exception as e:
+            logger.error(f"Error on {self.path}: {e}")
+            self._error(500, 'internal error')
+
+    def _send_asset(self, relative: str):
+        # Leaflet cherche ses images dans css/images
+        if relative.startswith('css/images/'):
+            relative = relative[len('css/'):]
+        root = OFFLINE_ASSETS_DIR.resolve()
+        path = (root / relative).resolve()
+        if not path.is_relative_to(root) or not path.is_file():
+            self._error(404, 'not found')
+            return
+        content_type = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+        self._send(path.read_bytes(), content_type, {'Cache-Control': 'max-age=86400'})
+
+    def _send(self, body: bytes, content_type: str, headers: dict = None):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status: int, message: str):
+        body = json.dumps({'error': message}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+
+PAGE_TEMPLATE = Template("""<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>mobiTIC - carte dynamique</title>
+    <link rel="stylesheet" href="assets/css/leaflet.css">
+    <style>
+        html, body, #map { height: 100%; margin: 0; }
+        .cluster { border-radius: 50%; color: white; font: bold 12px sans-serif; text-align: center;
+                   border: 2px solid white; box-sizing: border-box; opacity: 0.85; }
+    </style>
+    <script src="assets/js/leaflet.js"></script>
+</head>
+<body>
+<div id="map"></div>
+<script>
+var map = L.map('map', {preferCanvas: true}).setView({{ center|tojson }}, {{ zoom }});
+L.tileLayer('https://tile.openstreetmap.org/{z}/{x}/{y}.png', {
+    maxZoom: 19, attribution: '&copy; OpenStreetMap contributors'
+}).addTo(map);
+L.control.scale().addTo(map);
+
+var iris = L.geoJSON(null, {
+    style: {color: 'blue', weight: 1, fillColor: 'lightblue', fillOpacity: 0.1},
+    onEachFeature: function(feature, layer) {
+        layer.bindTooltip('<b>Nom:</b> ' + feature.properties.nom_iris
+                          + '<br><b>Code:</b> ' + feature.properties.code_iris, {sticky: true});
+    }
+}).addTo(map);
+var groups = {}, colors = {}, overlays = {'Contours IRIS': iris}, controller = null;
+
+function clusterMarker(lat, lon, n, color) {
+    var size = n < 10 ? 26 : n < 100 ? 32 : n < 1000 ? 38 : 46;
+    var marker = L.marker([lat, lon], {icon: L.divIcon({
+        className: '', iconSize: [size, size],
+        html: '<div class="cluster" style="width:' + size + 'px;height:' + size + 'px;line-height:'
+            + size + 'px;background:' + color + '">' + n + '</div>'
+    })});
+    marker.on('click', function() { map.setView([lat, lon], map.getZoom() + 2); });
+    return marker;
+}
+
+function draw(cat, data) {
+    var group = groups[cat], color = colors[cat], c = data.clusters, p = data.points;
+    group.clearLayers();
+    for (var i = 0; i < c.count.length; i++) group.addLayer(clusterMarker(c.lat[i], c.lon[i], c.count[i], color));
+    for (var j = 0; j < p.lat.length; j++) {
+        var popup = '<b>Type:</b> ' + p.typequ[j] + '<br><b>Catégorie:</b> ' + cat
+                  + (p.depcom && p.depcom[j] ? '<br><b>Commune:</b> ' + p.depcom[j] : '');
+        group.addLayer(L.circleMarker([p.lat[j], p.lon[j]], {
+            radius: 6, color: 'white', weight: 1, fillColor: color, fillOpacity: 0.9
+        }).bindPopup(popup));
+    }
+}
+
+function refresh() {
+    if (controller) controller.abort();
+    controller = new AbortController();
+    var b = map.getBounds(), query = 'bbox=' + [b.getWest(), b.getSouth(), b.getEast(), b.getNorth()].join(',')
+        + '&zoom=' + map.getZoom();
+    var active = Object.keys(groups).filter(function(cat) { return map.hasLayer(groups[cat]); });
+    Object.keys(groups).forEach(function(cat) { if (active.indexOf(cat) < 0) groups[cat].clearLayers(); });
+    if (active.length) {
+        fetch('api/points?' + query + '&categories=' + encodeURIComponent(active.join(',')),
+              {signal: controller.signal})
+            .then(function(r) { return r.json(); })
+            .then(function(data) { Object.keys(data).forEach(function(cat) { draw(cat, data[cat]); }); })
+            .catch(function() {});
+    }
+    if (map.hasLayer(iris)) {
+        fetch('api/iris?' + query, {signal: controller.signal})
+            .then(function(r) { return r.json(); })
+            .then(function(data) { iris.clearLayers(); iris.addData(data); })
+            .catch(function() {});
+    }
+}
+
+fetch('api/categories').then(function(r) { return r.json(); }).then(function(categories) {
+    categories.forEach(function(cat) {
+        colors[cat.name] = cat.color;
+        groups[cat.name] = L.layerGroup().addTo(map);
+        overlays[cat.name + ' (' + cat.count + ')'] = groups[cat.name];
+    });
+    L.control.layers(null, overlays, {collapsed: false}).addTo(map);
+    map.on('moveend overlayadd overlayremove', refresh);
+    refresh();
+});
+</script>
+</body>
+</html>
+""")
+
+
+class MapServer(ThreadingHTTPServer):
+    """Serveur HTTP multi-thread portant les données indexées et la page"""
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple, data: MapData):
+        super().__init__(address, MapRequestHandler)
+        self.data = data
+        lon = np.concatenate([index.lon for index in data.categories.values()] or [[0.0]])
+        lat = np.concatenate([index.lat for index in data.categories.values()] or [[0.0]])
+        self.page = PAGE_TEMPLATE.render(center=[float(np.median(lat)), float(np.median(lon))], zoom=11)
+
+
+def serve(host: str = SERVER_HOST, port: int = SERVER_PORT):
+    """Charge les données et sert la carte dynamique jusqu'à interruption"""
+    try:
+        server = MapServer((host, port), MapData())
+        logger.info(f"Serving map on http://{host}:{server.server_port}/ (Ctrl+C to stop)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("Server stopped")
+        finally:
+            server.server_close()
+
+    except Exception as e:
+        logger.error(f"Erreur du serveur : {e}")
+        raise
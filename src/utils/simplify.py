@@ -0,0 +1,89 @@
+"""
+Simplification des contours IRIS par niveau de zoom
+
+Les IRIS forment une couverture : pas de recouvrement et sommets identiques
+le long des frontières communes. La simplification de couverture de GEOS
+traite chaque arc partagé une seule fois, si bien que deux IRIS voisins
+gardent exactement la même frontière simplifiée (ni trou ni chevauchement).
+Les tolérances sont exprimées en mètres : le calcul se fait en Lambert-93.
+"""
+
+import logging
+
+import geopandas as gpd
+import pandas as pd
+import shapely
+
+from config import IRIS_LEVELS, IRIS_LEVELS_PATH, CRS_LAMBERT93, CRS_WGS84
+from utils.data_manager import iris_loader
+
+logger = logging.getLogger(__name__)
+
+# Attributs conservés avec les contours simplifiés
+IRIS_PROPERTIES = ['code_iris', 'nom_iris']
+
+
+def simplify_coverage(geometries: gpd.GeoSeries, tolerance: float) -> gpd.GeoSeries:
+    """
+    Simplifie une couverture de polygones en préservant sa topologie
+
+    Args:
+        geometries: Polygones d'un CRS projeté
+        tolerance: Tolérance dans l'unité du CRS (racine carrée de l'aire
+            des triangles supprimés, algorithme de Visvalingam-Whyatt)
+    """
+    simplified = shapely.coverage_simplify(geometries.to_numpy(), tolerance)
+    return gpd.GeoSeries(simplified, index=geometries.index, crs=geometries.crs)
+
+
+def simplify_levels(iris_gdf: gpd.GeoDataFrame, levels: list = IRIS_LEVELS) -> gpd.GeoDataFrame:
+    """
+    Contours IRIS simplifiés de chaque niveau de zoom
+
+    Args:
+        iris_gdf: Contours IRIS
+        levels: Liste de (zoom minimal, tolérance en mètres, décimales)
+
+    Returns:
+        GeoDataFrame WGS84 contenant, pour chaque niveau, tous les IRIS et
+        une colonne `zoom` (zoom minimal d'affichage du niveau)
+    """
+    iris_gdf = iris_gdf[iris_gdf.geometry.notna() & ~iris_gdf.geometry.is_empty]
+    iris_l93 = iris_gdf.to_crs(CRS_LAMBERT93)
+    columns = [col for col in IRIS_PROPERTIES if col in iris_l93.columns]
+
+    if not shapely.coverage_is_valid(iris_l93.geometry.to_numpy()):
+        logger.warning("IRIS contours are not a valid coverage, "
+                       "simplified boundaries may not match exactly")
+
+    n_vertices = int(shapely.get_num_coordinates(iris_l93.geometry.to_numpy()).sum())
+    frames = []
+    for min_zoom, tolerance, _ in levels:
+        simplified = simplify_coverage(iris_l93.geometry, tolerance)
+        level = iris_l93[columns].copy()
+        level['zoom'] = min_zoom
+        frames.append(gpd.GeoDataFrame(level, geometry=simplified).to_crs(CRS_WGS84))
+
+        kept = int(shapely.get_num_coordinates(simplified.to_numpy()).sum())
+        logger.info(f"Niveau z{min_zoom}+ (tolérance {tolerance:g} m) : "
+                    f"{kept:,} sommets sur {n_vertices:,}")
+
+    return gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), crs=CRS_WGS84)
+
+
+def simplify_iris(levels: list = IRIS_LEVELS):
+    """
+    Calcule les contours IRIS de chaque niveau de zoom (voir simplify_levels)
+    et les écrit en GeoParquet dans IRIS_LEVELS_PATH
+
+    Args:
+        levels: Liste de (zoom minimal, tolérance en mètres, décimales)
+    """
+    try:
+        iris_levels = simplify_levels(iris_loader(), levels)
+        iris_levels.to_parquet(IRIS_LEVELS_PATH, index=False)
+        logger.info(f"Contours simplifiés sauvegardés : {IRIS_LEVELS_PATH}")
+
+    except Exception as e:
+        logger.info(f"Erreur lors de la simplification des IRIS : {e}")
+        raise
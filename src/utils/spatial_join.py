@@ -0,0 +1,92 @@
+"""
+Rattachement des équipements BPE aux IRIS
+
+Un index STRtree est construit sur les contours IRIS et interrogé en une
+seule fois pour tous les points (requête vectorisée de shapely) ; le
+résultat est conservé sur disque, avec le nombre d'équipements par IRIS
+et par catégorie.
+"""
+
+import logging
+import time
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from config import BPE_IRIS_PATH, IRIS_COUNTS_PATH, CATEGORY_NAMES
+from utils.data_manager import iris_loader, bpe_loader
+
+logger = logging.getLogger(__name__)
+
+# Colonne du nombre total d'équipements dans la table de comptage
+TOTAL_COLUMN = 'total'
+
+
+def locate_points(points: gpd.GeoSeries, polygons: gpd.GeoSeries) -> np.ndarray:
+    """
+    Indice du polygone contenant chaque point (-1 si aucun)
+
+    Un point situé sur une frontière commune est attribué à l'un des
+    polygones qui le contiennent.
+    """
+    tree = shapely.STRtree(polygons.to_numpy())
+    point_idx, polygon_idx = tree.query(points.to_numpy(), predicate='intersects')
+
+    located = np.full(len(points), -1, dtype='int64')
+    # Une seule paire (point, polygone) conservée par point
+    first = np.unique(point_idx, return_index=True)[1]
+    located[point_idx[first]] = polygon_idx[first]
+    return located
+
+
+def category_counts(bpe_iris: pd.DataFrame, iris_codes: pd.Series) -> pd.DataFrame:
+    """
+    Nombre d'équipements par IRIS (lignes) et par catégorie (colonnes)
+
+    Tous les IRIS de `iris_codes` figurent dans la table, y compris ceux
+    sans équipement ; la colonne TOTAL_COLUMN somme les catégories.
+    """
+    counts = (bpe_iris.groupby(['code_iris', 'categorie'], observed=True).size()
+              .unstack(fill_value=0)
+              .reindex(index=pd.Index(iris_codes.unique(), name='code_iris'),
+                       columns=CATEGORY_NAMES, fill_value=0)
+              .astype('int32'))
+    counts.columns = counts.columns.astype('string')
+    counts[TOTAL_COLUMN] = counts.sum(axis=1)
+    return counts
+
+
+def attach_iris(bpe_gdf: gpd.GeoDataFrame, iris_gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """Ajoute à chaque équipement le `code_iris` de l'IRIS qui le contient (NA si aucun)"""
+    start = time.perf_counter()
+    located = locate_points(bpe_gdf.geometry, iris_gdf.geometry)
+    codes = iris_gdf['code_iris'].to_numpy()
+    bpe_gdf['code_iris'] = pd.array(np.where(located >= 0, codes[located], None), dtype='string')
+    logger.info(f"{(located >= 0).sum():,} / {len(bpe_gdf):,} equipments located "
+                f"in an IRIS ({time.perf_counter() - start:.2f}s)")
+    return bpe_gdf
+
+
+def join_bpe_iris():
+    """
+    Ajoute `code_iris` à chaque équipement et calcule la table de comptage
+
+    Écrit BPE_IRIS_PATH (GeoParquet de la BPE avec `code_iris`) et
+    IRIS_COUNTS_PATH (une ligne par IRIS, une colonne par catégorie).
+    """
+    try:
+        iris_gdf = iris_loader(['code_iris'])
+        bpe_gdf = attach_iris(bpe_loader(), iris_gdf)
+
+        bpe_gdf.to_parquet(BPE_IRIS_PATH, index=False)
+        logger.info(f"Jointure BPE / IRIS sauvegardée : {BPE_IRIS_PATH}")
+
+        counts = category_counts(bpe_gdf, iris_gdf['code_iris'])
+        counts.reset_index().to_parquet(IRIS_COUNTS_PATH, index=False)
+        logger.info(f"Comptage par IRIS et catégorie sauvegardé : {IRIS_COUNTS_PATH}")
+
+    except Exception as e:
+        logger.info(f"Erreur lors de la jointure BPE / IRIS : {e}")
+        raise
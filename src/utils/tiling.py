@@ -0,0 +1,418 @@
+"""
+Découpage des couches BPE et IRIS en pyramide de tuiles z/x/y (GeoJSON)
+
+Chaque tuile ne contient que les objets qui la touchent, les polygones
+étant découpés à son emprise (avec une marge pour que les contours ne
+soient pas tracés sur les bords de tuile). La visionneuse générée charge
+uniquement les tuiles visibles avec le Leaflet de `offline_assets`.
+"""
+
+import json
+import logging
+import shutil
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import shapely
+from folium.template import Template
+
+from config import CATEGORIES, CATEGORY_NAMES, OFFLINE_ASSETS_DIR, TILES_DIR
+from config import TILE_MIN_ZOOM, TILE_MAX_ZOOM, BPE_TILE_MIN_ZOOM, TILE_WORKERS
+from utils.data_manager import iris_loader, bpe_loader
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256
+
+# Marge de découpage des polygones, en fraction de tuile
+CLIP_MARGIN = 4 / TILE_SIZE
+
+# Nombre de tuiles écrites par tâche du pool de processus
+TILES_PER_TASK = 256
+
+# Précision des coordonnées écrites (1e-6 degré ~ 10 cm)
+COORD_DECIMALS = 6
+
+IRIS_PROPERTIES = ['code_iris', 'nom_iris']
+BPE_PROPERTIES = ['TYPEQU', 'DEPCOM']
+
+
+# ----------------------------------------------------------------------------
+# Géométrie des tuiles (Web Mercator)
+# ----------------------------------------------------------------------------
+
+def lonlat_to_tile(lon, lat, zoom: int) -> tuple:
+    """Indices (x, y) des tuiles contenant les points (vectorisé)"""
+    n = 2 ** zoom
+    lat = np.clip(np.asarray(lat, dtype='float64'), -85.0511, 85.0511)
+    x = (np.asarray(lon, dtype='float64') + 180.0) / 360.0 * n
+    y = (1.0 - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2.0 * n
+    return (np.clip(np.floor(x), 0, n - 1).astype('int64'),
+            np.clip(np.floor(y), 0, n - 1).astype('int64'))
+
+
+def tile_bounds(x, y, zoom: int) -> tuple:
+    """Emprise (ouest, sud, est, nord) en degrés d'une tuile"""
+    n = 2 ** zoom
+
+    def lat(yy):
+        return np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.asarray(yy) / n))))
+
+    return (np.asarray(x) / n * 360.0 - 180.0, lat(np.asarray(y) + 1),
+            (np.asarray(x) + 1) / n * 360.0 - 180.0, lat(y))
+
+
+def category_slug(name: str) -> str:
+    """Nom de dossier ASCII d'une catégorie ('Sports & Loisirs' -> 'sports-loisirs')"""
+    ascii_name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode()
+    return '-'.join(''.join(c if c.isalnum() else ' ' for c in ascii_name.lower()).split())
+
+
+# ----------------------------------------------------------------------------
+# Écriture des tuiles (exécutée dans les processus du pool)
+# ----------------------------------------------------------------------------
+
+def _feature(geometry_json: str, properties: dict) -> str:
+    return ('{"type":"Feature","geometry":' + geometry_json
+            + ',"properties":' + json.dumps(properties, ensure_ascii=False) + '}')
+
+
+def _write_tile(layer_dir: Path, zoom: int, x: int, y: int, features: list):
+    path = layer_dir / str(zoom) / str(x) / f"{y}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{"type":"FeatureCollection","features":[' + ','.join(features) + ']}')
+
+
+def _write_point_tiles(layer_dir: Path, zoom: int, keys: np.ndarray, coords: np.ndarray,
+                       properties: list) -> int:
+    """Écrit les tuiles de points ; `keys` (x, y) est trié par tuile"""
+    starts = np.flatnonzero(np.r_[True, np.any(keys[1:] != keys[:-1], axis=1)])
+    bounds = np.r_[starts, len(keys)]
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        features = [
+            _feature(f'{{"type":"Point","coordinates":[{lon},{lat}]}}', properties[i])
+            for i, (lon, lat) in zip(range(start, end), coords[start:end])
+        ]
+        _write_tile(layer_dir, zoom, int(keys[start, 0]), int(keys[start, 1]), features)
+    return len(starts)
+
+
+def _write_polygon_tiles(layer_dir: Path, zoom: int, tiles: list, geometries: np.ndarray,
+                         properties: list) -> int:
+    """Découpe et écrit les tuiles de polygones ; `tiles` = [(x, y, indices)]"""
+    written = 0
+    for x, y, indices in tiles:
+        west, south, east, north = tile_bounds(x, y, zoom)
+        margin_x, margin_y = (east - west) * CLIP_MARGIN, (north - south) * CLIP_MARGIN
+        clipped = shapely.clip_by_rect(geometries[indices], west - margin_x, south - margin_y,
+                                       east + margin_x, north + margin_y)
+        keep = ~shapely.is_empty(clipped)
+        if not keep.any():
+            continue
+        clipped = shapely.set_precision(clipped[keep], 10 ** -COORD_DECIMALS)
+        features = [_feature(geojson, properties[i])
+                    for geojson, i in zip(shapely.to_geojson(clipped), np.asarray(indices)[keep])]
+        _write_tile(layer_dir, zoom, x, y, features)
+        written += 1
+    return written
+
+
+# ----------------------------------------------------------------------------
+# Construction des pyramides
+# ----------------------------------------------------------------------------
+
+def _properties(gdf, columns: list) -> list:
+    columns = [col for col in columns if col in gdf.columns]
+    frame = gdf[columns].astype('string').astype(object)
+    frame = frame.where(frame.notna(), None)
+    return frame.to_dict('records')
+
+
+def build_point_tasks(points, layer_dir: Path, zooms: range) -> list:
+    """Prépare les tâches d'écriture des tuiles d'une couche de points"""
+    coords = np.round(shapely.get_coordinates(points.geometry.values), COORD_DECIMALS)
+    properties = _properties(points, BPE_PROPERTIES)
+
+    tasks = []
+    for zoom in zooms:
+        x, y = lonlat_to_tile(coords[:, 0], coords[:, 1], zoom)
+        order = np.lexsort((y, x))
+        keys = np.column_stack([x, y])[order]
+
+        # Découpage en paquets de TILES_PER_TASK tuiles, aux frontières de tuiles
+        starts = np.flatnonzero(np.r_[True, np.any(keys[1:] != keys[:-1], axis=1)])
+        cuts = np.r_[starts[::TILES_PER_TASK], len(keys)]
+        for start, end in zip(cuts[:-1], cuts[1:]):
+            rows = order[start:end]
+            tasks.append((_write_point_tiles, layer_dir, zoom, keys[start:end], coords[rows],
+                          [properties[i] for i in rows]))
+    return tasks
+
+
+def build_polygon_tasks(polygons, layer_dir: Path, zooms: range) -> list:
+    """Prépare les tâches de découpage des tuiles d'une couche de polygones"""
+    geometries = polygons.geometry.values
+    properties = _properties(polygons, IRIS_PROPERTIES)
+    bounds = shapely.bounds(geometries)
+
+    tasks = []
+    for zoom in zooms:
+        x_min, y_min = lonlat_to_tile(bounds[:, 0], bounds[:, 3], zoom)
+        x_max, y_max = lonlat_to_tile(bounds[:, 2], bounds[:, 1], zoom)
+
+        # Tuiles candidates de chaque polygone (rectangle de tuiles de son emprise)
+        tiles = {}
+        for i in range(len(geometries)):
+            for x in range(x_min[i], x_max[i] + 1):
+                for y in range(y_min[i], y_max[i] + 1):
+                    tiles.setdefault((x, y), []).append(i)
+
+        items = sorted(tiles.items())
+        for start in range(0, len(items), TILES_PER_TASK):
+            chunk = items[start:start + TILES_PER_TASK]
+            used = sorted({i for _, indices in chunk for i in indices})
+            local = {i: k for k, i in enumerate(used)}
+            tasks.append((_write_polygon_tiles, layer_dir, zoom,
+                          [(x, y, [local[i] for i in indices]) for (x, y), indices in chunk],
+                          geometries[used], [properties[i] for i in used]))
+    return tasks
+
+
+def _run_task(task: tuple) -> int:
+    func, *args = task
+    return func(*args)
+
+
+def export_tiles(iris_gdf=None, bpe_gdf=None, tiles_dir: Path = TILES_DIR,
+                 workers: int = TILE_WORKERS) -> Path:
+    """
+    Génère la pyramide de tuiles IRIS et BPE (une couche par catégorie)
+    ainsi que la visionneuse `index.html`
+
+    Returns:
+        Chemin de la visionneuse
+    """
+    try:
+        if iris_gdf is None:
+            iris_gdf = iris_loader(columns=IRIS_PROPERTIES)
+        if bpe_gdf is None:
+            bpe_gdf = bpe_loader(columns=BPE_PROPERTIES)
+
+        tiles_dir = Path(tiles_dir)
+        for layer in ('iris', 'bpe'):
+            shutil.rmtree(tiles_dir / layer, ignore_errors=True)
+
+        layers = [{'id': 'iris', 'name': 'Contours IRIS', 'kind': 'polygon',
+                   'url': 'iris/{z}/{x}/{y}.json', 'minZoom': TILE_MIN_ZOOM, 'show': True}]
+        tasks = build_polygon_tasks(iris_gdf, tiles_dir / 'iris',
+                                    range(TILE_MIN_ZOOM, TILE_MAX_ZOOM + 1))
+
+        for cat_name in CATEGORY_NAMES:
+            points = bpe_gdf[bpe_gdf['categorie'] == cat_name]
+            if points.empty:
+                continue
+            slug = category_slug(cat_name)
+            color = CATEGORIES.get(cat_name, {}).get('color', 'gray')
+            layers.append({'id': slug, 'name': cat_name, 'kind': 'point', 'color': color,
+                           'url': f'bpe/{slug}/{{z}}/{{x}}/{{y}}.json',
+                           'minZoom': BPE_TILE_MIN_ZOOM, 'show': False})
+            tasks += build_point_tasks(points, tiles_dir / 'bpe' / slug,
+                                       range(BPE_TILE_MIN_ZOOM, TILE_MAX_ZOOM + 1))
+
+        logger.info(f"Tiling: {len(tasks)} tasks, zooms {TILE_MIN_ZOOM}-{TILE_MAX_ZOOM}")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            n_tiles = sum(executor.map(_run_task, tasks))
+        logger.info(f"{n_tiles:,} tiles written in {tiles_dir}")
+
+        west, south, east, north = iris_gdf.total_bounds
+        viewer_path = write_tile_viewer(tiles_dir, layers, [[south, west], [north, east]])
+        logger.info(f"Tile viewer saved: {viewer_path}")
+        return viewer_path
+
+    except Exception as e:
+        logger.error(f"Error during tiling: {e}")
+        raise
+
+
+# ----------------------------------------------------------------------------
+# Visionneuse
+# ----------------------------------------------------------------------------
+
+# Couche Leaflet dessinant des tuiles GeoJSON sur canvas, avec recherche
+# de l'objet cliqué dans la tuile (points : rayon, polygones : point dans polygone)
+GEOJSON_TILES_JS = """
+L.GeoJSONTiles = L.GridLayer.extend({
+    options: {url: '', kind: 'polygon', color: 'blue', radius: 4, maxNativeZoom: 14},
+
+    createTile: function(coords, done) {
+        var tile = L.DomUtil.create('canvas', 'leaflet-tile');
+        var size = this.getTileSize(), ratio = window.devicePixelRatio || 1;
+        tile.width = size.x * ratio;
+        tile.height = size.y * ratio;
+        tile.style.width = size.x + 'px';
+        tile.style.height = size.y + 'px';
+        var layer = this;
+        this.loadTile(coords).then(function(data) {
+            tile._features = data ? layer._draw(tile, coords, data, ratio) : [];
+            done(null, tile);
+        }).catch(function(err) { done(err, tile); });
+        return tile;
+    },
+
+    loadTile: function(coords) {
+        return fetch(L.Util.template(this.options.url, coords)).then(function(response) {
+            return response.ok ? response.json() : null;
+        });
+    },
+
+    _project: function(coords, lonlat) {
+        var size = this.getTileSize();
+        return this._map.project([lonlat[1], lonlat[0]], coords.z)
+            .subtract([coords.x * size.x, coords.y * size.y]);
+    },
+
+    _draw: function(tile, coords, data, ratio) {
+        var ctx = tile.getContext('2d'), o = this.options, features = [];
+        ctx.scale(ratio, ratio);
+        ctx.fillStyle = o.kind === 'point' ? o.color : 'rgba(173, 216, 230, 0.1)';
+        ctx.strokeStyle = o.kind === 'point' ? 'white' : 'blue';
+        ctx.lineWidth = 1;
+        for (var i = 0; i < data.features.length; i++) {
+            var f = data.features[i], g = f.geometry;
+            if (g.type === 'Point') {
+                var p = this._project(coords, g.coordinates);
+                ctx.beginPath();
+                ctx.arc(p.x, p.y, o.radius, 0, 2 * Math.PI);
+                ctx.fill();
+                ctx.stroke();
+                features.push({point: p, properties: f.properties});
+            } else {
+                var polygons = g.type === 'Polygon' ? [g.coordinates]
+                             : g.type === 'MultiPolygon' ? g.coordinates : [];
+                var rings = [];
+                ctx.beginPath();
+                for (var j = 0; j < polygons.length; j++) {
+                    for (var k = 0; k < polygons[j].length; k++) {
+                        var ring = polygons[j][k].map(this._project.bind(this, coords));
+                        rings.push(ring);
+                        ctx.moveTo(ring[0].x, ring[0].y);
+                        for (var m = 1; m < ring.length; m++) ctx.lineTo(ring[m].x, ring[m].y);
+                        ctx.closePath();
+                    }
+                }
+                ctx.fill('evenodd');
+                ctx.stroke();
+                features.push({rings: rings, properties: f.properties});
+            }
+        }
+        return features;
+    },
+
+    featureAt: function(latlng) {
+        var z = Math.min(this._map.getZoom(), this.options.maxNativeZoom);
+        var size = this.getTileSize(), p = this._map.project(latlng, z);
+        var x = Math.floor(p.x / size.x), y = Math.floor(p.y / size.y);
+        var tile = this._tiles[x + ':' + y + ':' + z];
+        if (!tile || !tile.el._features) return null;
+        var local = p.subtract([x * size.x, y * size.y]), features = tile.el._features;
+        for (var i = features.length - 1; i >= 0; i--) {
+            var f = features[i];
+            if (f.point ? f.point.distanceTo(local) <= this.options.radius + 2
+                        : L.GeoJSONTiles.inRings(local, f.rings)) return f.properties;
+        }
+        return null;
+    }
+});
+
+L.GeoJSONTiles.inRings = function(p, rings) {
+    var inside = false;
+    for (var r = 0; r < rings.length; r++) {
+        for (var i = 0, ring = rings[r], j = ring.length - 1; i < ring.length; j = i++) {
+            if ((ring[i].y > p.y) !== (ring[j].y > p.y) &&
+                p.x < (ring[j].x - ring[i].x) * (p.y - ring[i].y) / (ring[j].y - ring[i].y) + ring[i].x) {
+                inside = !inside;
+            }
+        }
+    }
+    return inside;
+};
+
+L.geoJSONTiles = function(options) { return new L.GeoJSONTiles(options); };
+"""
+
+VIEWER_TEMPLATE = Template("""<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>mobiTIC - carte tuilée</title>
+    <link rel="stylesheet" href="assets/css/leaflet.css">
+    <style>html, body, #map { height: 100%; margin: 0; }</style>
+    <script src="assets/js/leaflet.js"></script>
+</head>
+<body>
+<div id="map"></div>
+<script>
+{{ tiles_js }}
+var map = L.map('map', {preferCanvas: true}).fitBounds({{ bounds|tojson }});
+L.tileLayer('https://tile.openstreetmap.org/{z}/{x}/{y}.png', {
+    maxZoom: 19, attribution: '&copy; OpenStreetMap contributors'
+}).addTo(map);
+L.control.scale().addTo(map);
+
+var overlays = {}, tiled = [];
+{{ layers|tojson }}.forEach(function(def) {
+    var layer = L.geoJSONTiles({
+        url: def.url, kind: def.kind, color: def.color || 'blue',
+        minZoom: def.minZoom, maxNativeZoom: {{ max_zoom }}
+    });
+    layer._def = def;
+    overlays[def.name] = layer;
+    tiled.push(layer);
+    if (def.show) layer.addTo(map);
+});
+L.control.layers(null, overlays, {collapsed: false}).addTo(map);
+
+map.on('click', function(e) {
+    for (var i = tiled.length - 1; i >= 0; i--) {
+        if (!map.hasLayer(tiled[i])) continue;
+        var props = tiled[i].featureAt(e.latlng);
+        if (!props) continue;
+        var html = tiled[i]._def.kind === 'point'
+            ? '<b>Type:</b> ' + props.TYPEQU + '<br><b>Catégorie:</b> ' + tiled[i]._def.name
+              + (props.DEPCOM ? '<br><b>Commune:</b> ' + props.DEPCOM : '')
+            : '<b>Nom:</b> ' + props.nom_iris + '<br><b>Code:</b> ' + props.code_iris;
+        L.popup().setLatLng(e.latlng).setContent(html).openOn(map);
+        return;
+    }
+});
+</script>
+</body>
+</html>
+""")
+
+
+def copy_leaflet_assets(dest: Path):
+    """Copie Leaflet (JS, CSS, images) depuis offline_assets"""
+    for relative in ('js/leaflet.js', 'css/leaflet.css'):
+        target = dest / relative
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(OFFLINE_ASSETS_DIR / relative, target)
+    shutil.copytree(OFFLINE_ASSETS_DIR / 'images', dest / 'css' / 'images', dirs_exist_ok=True)
+
+
+def write_tile_viewer(tiles_dir: Path, layers: list, bounds: list) -> Path:
+    """Écrit `index.html` et les ressources Leaflet dans le dossier des tuiles"""
+    copy_leaflet_assets(tiles_dir / 'assets')
+    with open(tiles_dir / 'metadata.json', 'w', encoding='utf-8') as f:
+        json.dump({'layers': layers, 'bounds': bounds,
+                   'minzoom': TILE_MIN_ZOOM, 'maxzoom': TILE_MAX_ZOOM}, f, ensure_ascii=False, indent=2)
+
+    viewer_path = tiles_dir / 'index.html'
+    viewer_path.write_text(VIEWER_TEMPLATE.render(
+        tiles_js=GEOJSON_TILES_JS, layers=layers, bounds=bounds, max_zoom=TILE_MAX_ZOOM
+    ), encoding='utf-8')
+    return viewer_path
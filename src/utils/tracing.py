@@ -0,0 +1,223 @@
+"""
+Traces d'exécution (--trace) et profils par étape (--profile)
+
+Les étapes du pipeline et leurs sous-étapes (transferts HTTP, extraction
+7z, lecture du shapefile, reprojection, filtrage, écritures, boucle des
+marqueurs, enregistrement HTML) sont délimitées par des `span` :
+
+    with span('reprojection', rows=len(gdf)) as s:
+        gdf = gdf.to_crs(CRS_WGS84)
+        s.set(bytes=...)
+
+Sans traceur actif (cas par défaut), `span` ne fait rien. Sinon chaque
+span mesure sa durée, la mémoire résidente au début et en fin, et le
+pic atteint entre les deux (échantillonné par un thread), plus les
+valeurs passées (rows, bytes...). La trace est écrite au format Chrome
+(chrome://tracing, https://ui.perfetto.dev), avec la courbe de la mémoire
+résidente. Seul le processus principal est tracé (pas les processus des
+tuiles ni des cartes régionales).
+"""
+
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from config import TRACE_SAMPLE_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Traceur actif (None : traces désactivées)
+_tracer = None
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def current_rss() -> int:
+    """
+    Mémoire résidente du processus (octets)
+
+    Hors Linux, la valeur est la mémoire résidente de pointe (ru_maxrss) :
+    les écarts mesurés sont alors des hausses du pic du processus.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Span:
+    """Intervalle mesuré ; `set` ajoute des valeurs (rows, bytes...) à la trace"""
+
+    __slots__ = ('name', 'cat', 'args', 'tid', 'start', 'rss_start', 'rss_peak')
+
+    def __init__(self, name: str, cat: str, args: dict):
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.tid = threading.get_ident()
+        self.rss_start = self.rss_peak = current_rss()
+        self.start = time.perf_counter()
+
+    def set(self, **args):
+        self.args.update(args)
+
+
+class _NullSpan:
+    """Span d'un traceur inactif"""
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """
+    Collecte des spans et des mesures de mémoire
+
+    Args:
+        sample_interval: Période d'échantillonnage de la mémoire résidente (s)
+    """
+
+    def __init__(self, sample_interval: float = TRACE_SAMPLE_INTERVAL):
+        self.sample_interval = sample_interval
+        self.events = []
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._open = set()
+        self._threads = {}
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name='trace-sampler', daemon=True)
+        self._sampler.start()
+
+    def _timestamp(self, t: float) -> float:
+        """Horodatage Chrome (microsecondes depuis le début de la trace)"""
+        return round((t - self._origin) * 1e6, 1)
+
+    def _sample(self):
+        while not self._stop.wait(self.sample_interval):
+            rss = current_rss()
+            with self._lock:
+                for s in self._open:
+                    s.rss_peak = max(s.rss_peak, rss)
+                self.events.append({'name': 'RSS', 'ph': 'C', 'pid': self._pid, 'tid': 0,
+                                    'ts': self._timestamp(time.perf_counter()),
+                                    'args': {'MB': round(rss / 1024 ** 2, 1)}})
+
+    def begin(self, name: str, cat: str, args: dict) -> Span:
+        s = Span(name, cat, args)
+        with self._lock:
+            self._open.add(s)
+            self._threads.setdefault(s.tid, threading.current_thread().name)
+        return s
+
+    def end(self, s: Span):
+        end = time.perf_counter()
+        rss = current_rss()
+        with self._lock:
+            self._open.discard(s)
+            self.events.append({
+                'name': s.name, 'cat': s.cat, 'ph': 'X', 'pid': self._pid, 'tid': s.tid,
+                'ts': self._timestamp(s.start), 'dur': round((end - s.start) * 1e6, 1),
+                'args': {
+                    **s.args,
+                    'rss_start_mb': round(s.rss_start / 1024 ** 2, 1),
+                    'rss_delta_mb': round((rss - s.rss_start) / 1024 ** 2, 1),
+                    'peak_delta_mb': round((max(s.rss_peak, rss) - s.rss_start) / 1024 ** 2, 1),
+                },
+            })
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+
+    def spans(self, cat: str = None) -> list:
+        """Spans terminés (événements 'X'), éventuellement d'une catégorie"""
+        with self._lock:
+            return [e for e in self.events if e['ph'] == 'X' and (cat is None or e['cat'] == cat)]
+
+    def write(self, path: Path):
+        """Écrit la trace au format Chrome trace-event (JSON)"""
+        with self._lock:
+            metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': tid,
+                         'args': {'name': name}} for tid, name in self._threads.items()]
+            metadata.append({'name': 'process_name', 'ph': 'M', 'pid': self._pid, 'tid': 0,
+                             'args': {'name': 'mobitic'}})
+            trace = {'traceEvents': metadata + self.events, 'displayTimeUnit': 'ms'}
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(trace, f, ensure_ascii=False, default=str)
+        logger.info(f"Trace saved: {path} ({len(self.events):,} events)")
+
+
+def _forget_in_child():
+    """Processus fils (fork) : traces désactivées, le traceur reste au parent"""
+    global _tracer
+    _tracer = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_in_child)
+
+
+def start_tracing(sample_interval: float = TRACE_SAMPLE_INTERVAL) -> Tracer:
+    """Active les traces pour tout le processus"""
+    global _tracer
+    _tracer = Tracer(sample_interval)
+    return _tracer
+
+
+def stop_tracing(path: Path = None) -> Tracer:
+    """
+    Désactive les traces, écrit la trace dans `path` si renseigné et
+    journalise la durée et le pic de mémoire de chaque étape
+    """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is None:
+        return None
+    tracer.stop()
+
+    for event in tracer.spans('stage'):
+        logger.info(f"[{event['name']}] {event['dur'] / 1e6:.2f}s, "
+                    f"peak +{event['args']['peak_delta_mb']:,.0f} MB")
+    if path is not None:
+        tracer.write(path)
+    return tracer
+
+
+@contextmanager
+def span(name: str, cat: str = 'step', **args):
+    """
+    Délimite une sous-étape dans la trace (sans effet si elle est inactive)
+
+    Args:
+        name: Nom affiché
+        cat: Catégorie ('stage', 'step', 'http', 'io'...)
+        **args: Valeurs enregistrées (rows, bytes, chemin...)
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield _NULL_SPAN
+        return
+
+    s = tracer.begin(name, cat, dict(args))
+    try:
+        yield s
+    except BaseException as e:
+        s.set(error=repr(e))
+        raise
+    finally:
+        tracer.end(s)
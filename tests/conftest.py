@@ -0,0 +1,15 @@
+"""
+Configuration commune des tests
+
+Les réglages (config.settings) sont lus à l'import : le dossier de données
+est redirigé vers un dossier temporaire avant tout import du projet.
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT / 'src'), str(ROOT / 'benchmarks')]
+os.environ.setdefault('MOBITIC_DATA_DIR', tempfile.mkdtemp(prefix='mobitic-tests-'))
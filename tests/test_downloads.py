@@ -0,0 +1,316 @@
+"""
+Téléchargements contre le serveur local StandInServer (benchmarks/server.py)
+
+ - segments Range reprenables (range_download) ;
+ - cache à revalidation conditionnelle (download_cache) ;
+ - lecture distante de la BPE par groupes de lignes (data_downloader).
+"""
+
+import base64
+import hashlib
+import os
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+import requests
+
+from server import StandInServer
+from synthetic import bpe_frame
+from utils import data_downloader, range_download
+from utils.download_cache import DownloadCache
+from utils.http_client import RangeNotSupported
+from utils.partitions import partition_path
+from utils.range_download import IncompleteDownload, SourceChanged, download_ranges
+
+SIZE = 3 * 1024 ** 2 + 123
+SEGMENT_SIZE = 256 * 1024
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(range_download, 'DOWNLOAD_RETRY_DELAY', 0.0)
+
+
+@pytest.fixture
+def served(tmp_path):
+    """Dossier servi contenant `archive.bin` (SIZE octets aléatoires)"""
+    directory = tmp_path / 'served'
+    directory.mkdir()
+    (directory / 'archive.bin').write_bytes(os.urandom(SIZE))
+    return directory
+
+
+def _sha256(path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def _head(server, name: str = 'archive.bin'):
+    url = f"{server.url}/{name}"
+    return url, requests.head(url).headers
+
+
+def _rewrite(path):
+    """Nouvelle version de même taille ; mtime décalé (l'ETag en dépend)"""
+    path.write_bytes(os.urandom(path.stat().st_size))
+    stat = path.stat()
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+
+
+# ----------------------------------------------------------------------------
+# Téléchargement par segments
+# ----------------------------------------------------------------------------
+
+def test_segments_resume_after_drops(served, tmp_path):
+    with StandInServer(served, drops=3) as server:
+        url, headers = _head(server)
+        sha256, path = download_ranges(requests.Session(), url, headers, tmp_path / 'partial',
+                                       connections=4, segment_size=SEGMENT_SIZE)
+        requests_count, bytes_sent = server.counters()
+
+    assert sha256 == _sha256(served / 'archive.bin')
+    assert path.read_bytes() == (served / 'archive.bin').read_bytes()
+    # Chaque coupure relance son segment à la position atteinte
+    assert requests_count == 4 + 3 + 1
+    assert bytes_sent == SIZE
+    assert not path.with_suffix('.json').exists()
+
+
+def test_interrupted_download_resumes(served, tmp_path, monkeypatch):
+    partial_dir = tmp_path / 'partial'
+    with StandInServer(served, drops=1) as server:
+        url, headers = _head(server)
+        monkeypatch.setattr(range_download, 'DOWNLOAD_RETRIES', 0)
+        with pytest.raises(range_download.TRANSIENT_ERRORS):
+            download_ranges(requests.Session(), url, headers, partial_dir, connections=1)
+        _, first = server.counters()
+
+        # Passage suivant : reprise à la position enregistrée
+        sha256, path = download_ranges(requests.Session(), url, headers, partial_dir, connections=1)
+        _, total = server.counters()
+
+    assert 0 < first < SIZE
+    assert sha256 == _sha256(served / 'archive.bin')
+    assert total == SIZE
+
+
+def test_changed_validator_restarts(served, tmp_path, monkeypatch):
+    partial_dir = tmp_path / 'partial'
+    with StandInServer(served, drops=1) as server:
+        url, headers = _head(server)
+        monkeypatch.setattr(range_download, 'DOWNLOAD_RETRIES', 0)
+        with pytest.raises(range_download.TRANSIENT_ERRORS):
+            download_ranges(requests.Session(), url, headers, partial_dir, connections=1)
+        _, first = server.counters()
+
+        _rewrite(served / 'archive.bin')
+        url, headers = _head(server)
+        sha256, path = download_ranges(requests.Session(), url, headers, partial_dir, connections=1)
+        _, total = server.counters()
+
+    # Autre ETag : l'état enregistré est ignoré, la nouvelle version est transférée en entier
+    assert sha256 == _sha256(served / 'archive.bin')
+    assert total - first == SIZE
+
+
+def test_source_changed_during_download(served, tmp_path):
+    partial_dir = tmp_path / 'partial'
+    with StandInServer(served) as server:
+        url, headers = _head(server)
+        _rewrite(served / 'archive.bin')
+        # If-Range porte l'ancien ETag : le serveur répond 200, version complète
+        with pytest.raises(SourceChanged):
+            download_ranges(requests.Session(), url, headers, partial_dir, connections=2,
+                            segment_size=SEGMENT_SIZE)
+
+    assert list(partial_dir.iterdir()) == []
+
+
+def test_digest_mismatch_is_incomplete(served, tmp_path):
+    partial_dir = tmp_path / 'partial'
+    with StandInServer(served) as server:
+        url, headers = _head(server)
+        wrong = base64.b64encode(hashlib.sha256(b'other').digest()).decode()
+        headers = {**headers, 'Repr-Digest': f'sha-256=:{wrong}:'}
+        with pytest.raises(IncompleteDownload, match='SHA-256'):
+            download_ranges(requests.Session(), url, headers, partial_dir)
+
+    assert list(partial_dir.iterdir()) == []
+
+
+def test_announced_digest_is_checked(served, tmp_path):
+    with StandInServer(served) as server:
+        url, headers = _head(server)
+        digest = base64.b64encode(hashlib.sha256((served / 'archive.bin').read_bytes()).digest()).decode()
+        headers = {**headers, 'Repr-Digest': f'sha-256=:{digest}:'}
+        sha256, _ = download_ranges(requests.Session(), url, headers, tmp_path / 'partial')
+
+    assert sha256 == _sha256(served / 'archive.bin')
+
+
+def test_size_mismatch_is_incomplete(served, tmp_path):
+    partial_dir = tmp_path / 'partial'
+    with StandInServer(served) as server:
+        url, headers = _head(server)
+        headers = {**headers, 'Content-Length': str(SIZE + 1000)}
+        with pytest.raises(IncompleteDownload, match='Content-Range'):
+            download_ranges(requests.Session(), url, headers, partial_dir, connections=2,
+                            segment_size=SEGMENT_SIZE)
+
+    assert list(partial_dir.iterdir()) == []
+
+
+def test_failed_segment_stops_the_others(served, tmp_path, monkeypatch):
+    # Environ 3 s par segment de 768 Kio ; une réponse coupée à la moitié, sans relance
+    monkeypatch.setattr(range_download, 'DOWNLOAD_RETRIES', 0)
+    with StandInServer(served, rate=256 * 1024, drops=1) as server:
+        url, headers = _head(server)
+        start = time.perf_counter()
+        with pytest.raises(range_download.TRANSIENT_ERRORS):
+            download_ranges(requests.Session(), url, headers, tmp_path / 'partial', connections=4,
+                            segment_size=SEGMENT_SIZE)
+        elapsed = time.perf_counter() - start
+        _, bytes_sent = server.counters()
+
+    # Les autres segments s'arrêtent avec celui qui échoue, sans finir leur transfert
+    assert elapsed < 2.5
+    assert bytes_sent < 0.7 * SIZE
+
+
+# ----------------------------------------------------------------------------
+# Cache à revalidation conditionnelle
+# ----------------------------------------------------------------------------
+
+def test_cache_hit_on_not_modified(served, tmp_path):
+    cache = DownloadCache(tmp_path / 'cache')
+    with StandInServer(served) as server:
+        url = f"{server.url}/archive.bin"
+        first = cache.fetch(url)
+        _, sent = server.counters()
+        second = cache.fetch(url)
+        _, sent_again = server.counters()
+
+    assert first.changed and first.sha256 == _sha256(served / 'archive.bin')
+    assert not second.changed
+    assert (second.sha256, second.path) == (first.sha256, first.path)
+    assert sent_again == sent   # 304 : aucun octet transféré
+
+
+def test_cache_hit_on_unchanged_hash(served, tmp_path):
+    cache = DownloadCache(tmp_path / 'cache')
+    path = served / 'archive.bin'
+    with StandInServer(served) as server:
+        url = f"{server.url}/archive.bin"
+        first = cache.fetch(url)
+        # Même contenu, autre ETag : transfert complet mais empreinte inchangée
+        stat = path.stat()
+        os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+        second = cache.fetch(url)
+
+    assert not second.changed
+    assert second.sha256 == first.sha256
+
+
+def test_cache_miss_on_new_version(served, tmp_path):
+    cache = DownloadCache(tmp_path / 'cache')
+    with StandInServer(served) as server:
+        url = f"{server.url}/archive.bin"
+        first = cache.fetch(url)
+        _rewrite(served / 'archive.bin')
+        second = cache.fetch(url)
+
+    assert second.changed
+    assert second.sha256 == _sha256(served / 'archive.bin') != first.sha256
+
+
+def test_revalidate_without_head(served, tmp_path):
+    cache = DownloadCache(tmp_path / 'cache')
+    with StandInServer(served, head=False) as server:
+        artifact = cache.revalidate(f"{server.url}/archive.bin")
+
+    # HEAD refusé : GET conditionnel, l'artefact est stocké
+    assert artifact.path is not None
+    assert artifact.sha256 == _sha256(served / 'archive.bin')
+
+
+def test_range_read_then_fetch_keep_version(served, tmp_path):
+    cache = DownloadCache(tmp_path / 'cache')
+    with StandInServer(served) as server:
+        url = f"{server.url}/archive.bin"
+        # Lecture par Range (validateurs seuls), puis téléchargement complet
+        remote = cache.revalidate(url)
+        cache.remember(url, requests.head(url).headers)
+        fetched = cache.fetch(url)
+        again = cache.revalidate(url)
+        cache.remember(url, requests.head(url).headers)
+        _, sent = server.counters()
+        last = cache.fetch(url)
+        _, sent_again = server.counters()
+
+    assert remote.path is None and remote.changed
+    assert not fetched.changed and fetched.version == remote.version
+    # Contenu en cache : chemin local, même version, entrée conservée par remember
+    assert again.path == fetched.path and again.version == remote.version
+    assert cache.entry(url)['sha256'] == fetched.sha256
+    assert not last.changed and sent_again == sent
+
+
+# ----------------------------------------------------------------------------
+# Lecture distante de la BPE
+# ----------------------------------------------------------------------------
+
+DEPARTEMENTS = ['69', '01', '42']
+
+
+@pytest.fixture
+def bpe_source(tmp_path):
+    """BPE synthétique servie, un groupe de lignes par département"""
+    directory = tmp_path / 'bpe'
+    directory.mkdir()
+    frame = bpe_frame(DEPARTEMENTS, rows_per_departement=20000, iris_per_departement=50)
+    pq.write_table(pa.Table.from_pandas(frame, preserve_index=False), directory / 'BPE.parquet',
+                   row_group_size=20000)
+    return directory
+
+
+def _sorted(frame: pd.DataFrame) -> pd.DataFrame:
+    return frame.sort_values(['TYPEQU', 'LAMBERT_X', 'LAMBERT_Y', 'DEPCOM']).reset_index(drop=True)
+
+
+def test_remote_bpe_reads_selected_row_groups(bpe_source, monkeypatch):
+    expected = data_downloader._read_bpe_local(bpe_source / 'BPE.parquet', ['01'])
+    with StandInServer(bpe_source) as server:
+        monkeypatch.setattr(data_downloader, 'BPE_URL', f"{server.url}/BPE.parquet")
+        bpe_df, headers = data_downloader._read_bpe_remote(['01'])
+        _, bytes_sent = server.counters()
+
+    pd.testing.assert_frame_equal(_sorted(bpe_df), _sorted(expected))
+    assert set(bpe_df['DEP']) == {'01'}
+    assert headers['ETag']
+    # Pied de page et un seul groupe de lignes sur trois
+    assert bytes_sent < (bpe_source / 'BPE.parquet').stat().st_size / 2
+
+
+def test_bpe_without_ranges_falls_back(bpe_source, tmp_path, monkeypatch):
+    expected = data_downloader._read_bpe_local(bpe_source / 'BPE.parquet', ['01'])
+    cache = DownloadCache(tmp_path / 'cache')
+    monkeypatch.setattr(data_downloader, 'get_cache', lambda: cache)
+    monkeypatch.setattr(data_downloader, 'BPE_PATH', tmp_path / 'partitions' / 'bpe')
+    monkeypatch.setattr(data_downloader, 'DEPARTEMENTS', ['01'])
+    monkeypatch.setattr(data_downloader, 'BPE_REMOTE_READ', True)
+
+    with StandInServer(bpe_source, ranges=False) as server:
+        monkeypatch.setattr(data_downloader, 'BPE_URL', f"{server.url}/BPE.parquet")
+        with pytest.raises(RangeNotSupported):
+            data_downloader._read_bpe_remote(['01'])
+        data_downloader.download_bpe()
+        _, bytes_sent = server.counters()
+
+    # Fichier complet téléchargé dans le cache, puis filtré localement
+    assert bytes_sent >= (bpe_source / 'BPE.parquet').stat().st_size
+    assert cache.entry(data_downloader.BPE_URL)['sha256'] == _sha256(bpe_source / 'BPE.parquet')
+    written = pd.read_parquet(partition_path(data_downloader.BPE_PATH, '01'))
+    assert len(written) == len(expected)
+    assert set(written['DEP'].astype(str)) == {'01'}
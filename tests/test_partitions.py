@@ -0,0 +1,18 @@
+"""Jeux de données partitionnés par département (utils.partitions)"""
+
+import pandas as pd
+
+from utils.partitions import PartitionedDataset, partition_path
+
+
+def test_departement_without_rows_gets_empty_partition(tmp_path):
+    frame = pd.DataFrame({'DEP': ['69', '69', '01'], 'TYPEQU': ['A101', 'D201', 'E107']})
+    dataset = PartitionedDataset(tmp_path / 'bpe')
+
+    written = dataset.write_many(frame, frame['DEP'], ['69', '01', '99'], 'key', 'source')
+
+    assert written == ['69', '01', '99']
+    assert dataset.entry('99')['rows'] == 0
+    assert dataset.stale(['69', '01', '99'], 'key') == []
+    empty = pd.read_parquet(partition_path(dataset.root, '99'))
+    assert empty.empty and list(empty.columns) == ['DEP', 'TYPEQU']